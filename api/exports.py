@@ -0,0 +1,206 @@
+"""Whole-table exports, for people who want everything rather than a page at a time.
+
+Rather than going through the DRF serializers, rows are fetched with
+``.values()`` in keyset-paginated chunks (``WHERE pk > last_pk ORDER BY pk LIMIT n``),
+so memory use is flat and each query stays cheap however far through the table
+we are.
+"""
+
+import csv
+import gzip
+import io
+import os
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from busstops.models import Service, StopPoint
+from bustimes.models import Trip
+from vehicles.models import Vehicle
+
+from . import filters
+
+CHUNK_SIZE = 5000
+
+
+def stop_row(row):
+    if row["latlong"]:
+        row["latlong"] = row["latlong"].coords
+    return row
+
+
+def trip_row(row):
+    row["start"] = int(row["start"].total_seconds())
+    row["end"] = int(row["end"].total_seconds())
+    return row
+
+
+class Export:
+    def __init__(self, get_queryset, fields, filterset_class, transform=None):
+        self.get_queryset = get_queryset
+        self.fields = fields
+        self.filterset_class = filterset_class
+        self.transform = transform
+
+    def chunks(self, queryset=None, chunk_size=CHUNK_SIZE):
+        """Yield lists of up to chunk_size rows (as dicts), in primary key order"""
+        if queryset is None:
+            queryset = self.get_queryset()
+        queryset = queryset.order_by("pk").values(*self.fields)
+        pk_name = queryset.model._meta.pk.name
+
+        last_pk = None
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][pk_name]
+
+            if self.transform:
+                chunk = [self.transform(row) for row in chunk]
+            yield chunk
+
+            if len(chunk) < chunk_size:
+                break
+
+
+EXPORTS = {
+    "stops": Export(
+        lambda: StopPoint.objects.all(),
+        [
+            "atco_code",
+            "naptan_code",
+            "common_name",
+            "indicator",
+            "landmark",
+            "street",
+            "town",
+            "locality_id",
+            "latlong",
+            "bearing",
+            "stop_type",
+            "bus_stop_type",
+            "admin_area_id",
+            "created_at",
+            "modified_at",
+            "active",
+        ],
+        filters.StopFilter,
+        stop_row,
+    ),
+    "services": Export(
+        lambda: Service.objects.filter(current=True).annotate(
+            operators=ArrayAgg("operator", filter=~Q(operator=None))
+        ),
+        [
+            "id",
+            "slug",
+            "line_name",
+            "description",
+            "region_id",
+            "mode",
+            "operators",
+        ],
+        filters.ServiceFilter,
+    ),
+    "vehicles": Export(
+        lambda: Vehicle.objects.all(),
+        [
+            "id",
+            "slug",
+            "fleet_number",
+            "fleet_code",
+            "reg",
+            "vehicle_type_id",
+            "livery_id",
+            "colours",
+            "branding",
+            "operator_id",
+            "garage_id",
+            "name",
+            "notes",
+            "withdrawn",
+        ],
+        filters.VehicleFilter,
+    ),
+    "trips": Export(
+        lambda: Trip.objects.all(),
+        [
+            "id",
+            "route_id",
+            "route__service_id",
+            "operator_id",
+            "inbound",
+            "start",
+            "end",
+            "destination_id",
+            "headsign",
+            "calendar_id",
+            "vehicle_journey_code",
+            "ticket_machine_code",
+            "block",
+            "garage_id",
+            "vehicle_type_id",
+        ],
+        filters.TripFilter,
+        trip_row,
+    ),
+}
+
+# pre-generated by the api.tasks.write_export_snapshots periodic task
+SNAPSHOTS = ("stops", "trips")
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+# each writer yields one string per chunk of rows, rather than one per row
+
+
+def ndjson_lines(export, chunks):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for chunk in chunks:
+        yield "".join(f"{encoder.encode(row)}\n" for row in chunk)
+
+
+def csv_lines(export, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(export.fields)
+    for chunk in chunks:
+        writer.writerows(row.values() for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # just the header row - there were no rows
+
+
+WRITERS = {
+    "ndjson": ndjson_lines,
+    "csv": csv_lines,
+}
+
+
+def get_snapshot_path(name, format):
+    return settings.DATA_DIR / "exports" / f"{name}.{format}.gz"
+
+
+def write_snapshot(name, format):
+    export = EXPORTS[name]
+    path = get_snapshot_path(name, format)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # write to a temporary file first, so a half-written snapshot is never served
+    temp_path = path.with_suffix(".tmp")
+    with gzip.open(temp_path, "wt", compresslevel=6) as open_file:
+        for line in WRITERS[format](export, export.chunks()):
+            open_file.write(line)
+    os.replace(temp_path, path)
@@ -0,0 +1,44 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from busstops.models import Locality, Operator, Service, StopPoint
+from busstops.utils import bump_generations
+from bustimes.models import Garage
+from vehicles.models import Livery, Vehicle, VehicleType
+
+# fields updated all the time by the live vehicle tracking importers,
+# that don't appear in the API
+IGNORED_FIELDS = {"latest_journey", "latest_journey_data", "tracking"}
+
+
+@receiver(post_save, sender=Vehicle)
+@receiver(post_save, sender=VehicleType)
+@receiver(post_save, sender=Livery)
+@receiver(post_save, sender=Operator)
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=StopPoint)
+@receiver(post_save, sender=Locality)
+@receiver(post_save, sender=Garage)
+def bump_generation_on_save(sender, update_fields=None, **kwargs):
+    if update_fields and update_fields <= IGNORED_FIELDS:
+        return
+    bump_generations(sender)
+
+
+@receiver(post_delete, sender=Vehicle)
+@receiver(post_delete, sender=VehicleType)
+@receiver(post_delete, sender=Livery)
+@receiver(post_delete, sender=Operator)
+@receiver(post_delete, sender=Service)
+@receiver(post_delete, sender=StopPoint)
+@receiver(post_delete, sender=Locality)
+@receiver(post_delete, sender=Garage)
+def bump_generation_on_delete(sender, **kwargs):
+    bump_generations(sender)
+
+
+@receiver(m2m_changed, sender=Service.operator.through)
+@receiver(m2m_changed, sender=Vehicle.features.through)
+def bump_generation_on_m2m_change(sender, instance, action, model, **kwargs):
+    if action.startswith("post_"):
+        bump_generations(type(instance), model)
@@ -0,0 +1,11 @@
+from huey import crontab
+from huey.contrib.djhuey import db_periodic_task
+
+from .exports import FORMATS, SNAPSHOTS, write_snapshot
+
+
+@db_periodic_task(crontab(hour=4, minute=30))
+def write_export_snapshots():
+    for name in SNAPSHOTS:
+        for format in FORMATS:
+            write_snapshot(name, format)
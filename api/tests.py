@@ -1,4 +1,14 @@
-from django.test import TestCase
+import gzip
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.test import TestCase, override_settings
+
+from busstops.models import StopPoint
+from vehicles.models import VehicleType
+
+from .tasks import write_export_snapshots
 
 
 class ApiTest(TestCase):
@@ -13,3 +23,92 @@ class ApiTest(TestCase):
         self.assertContains(
             response, "<a class='navbar-brand' href='/'>bustimes.org</a>"
         )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_conditional_requests(self):
+        VehicleType.objects.create(name="Optare Solo")
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/vehicletypes/")
+        self.assertEqual(response.json()["results"][0]["name"], "Optare Solo")
+        etag = response["ETag"]
+
+        # served from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/vehicletypes/")
+        self.assertEqual(response.json()["results"][0]["name"], "Optare Solo")
+        self.assertEqual(response["ETag"], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/vehicletypes/", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 304)
+
+        # different query
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/vehicletypes/?limit=10")
+        self.assertNotEqual(response["ETag"], etag)
+
+        # saving a vehicle type changes the vehicle types generation
+        VehicleType.objects.create(name="Optare Versa")
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/vehicletypes/", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        StopPoint.objects.create(
+            atco_code="210021509680",
+            common_name="Kingsway",
+            latlong="POINT(-1.5 53)",
+            active=True,
+        )
+        StopPoint.objects.create(
+            atco_code="210021509681", common_name="Queensway", active=False
+        )
+
+    def test_export(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/exports/stops.ndjson")
+            lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(lines), 2)
+        stop = json.loads(lines[0])
+        self.assertEqual(stop["atco_code"], "210021509680")
+        self.assertEqual(stop["latlong"], [-1.5, 53.0])
+
+        response = self.client.get("/api/exports/stops.csv?atco_code=210021509681")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0][:33], "atco_code,naptan_code,common_name")
+        self.assertEqual(lines[1][:25], "210021509681,,Queensway,,")
+        self.assertEqual(len(lines), 2)
+
+        response = self.client.get("/api/exports/stops.csv?stop_type=ZZZ")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/api/exports/users.csv")
+        self.assertEqual(response.status_code, 404)
+
+    def test_snapshot(self):
+        with (
+            TemporaryDirectory() as directory,
+            override_settings(DATA_DIR=Path(directory)),
+        ):
+            response = self.client.get("/api/exports/stops.csv.gz")
+            self.assertEqual(response.status_code, 404)
+
+            write_export_snapshots()
+
+            response = self.client.get("/api/exports/stops.ndjson.gz")
+            self.assertEqual(response["Content-Type"], "application/gzip")
+            content = gzip.decompress(b"".join(response.streaming_content))
+            response.close()
+        self.assertEqual(len(content.splitlines()), 2)
@@ -1,22 +1,29 @@
-import struct
+from hashlib import sha1
+from time import time
+from urllib.parse import urlencode
+
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import pagination, viewsets
 from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.cache import cache
 from django.db.models import Q
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 
-from vehicles.time_aware_polyline import encode_time_aware_polyline
+from vehicles.time_aware_polyline import encode_locations
 
-from busstops.models import Operator, Service, StopPoint
-from bustimes.models import StopTime, Trip
+from busstops.models import Locality, Operator, Service, StopPoint
+from busstops.utils import get_generations
+from bustimes.models import Garage, StopTime, Trip
 from bustimes.utils import contiguous_stoptimes_only
 from vehicles.models import Livery, Vehicle, VehicleJourney, VehicleType
 from vehicles.utils import redis_client
 
 from sql_util.utils import Exists
 
-from . import filters, serializers
+from . import exports, filters, serializers
 
 
 class BadException(APIException):
@@ -34,7 +41,51 @@ class CursorPagination(pagination.CursorPagination):
     max_page_size = 1000
 
 
-class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
+class CachedViewSetMixin:
+    """Cache list and detail response data, keyed by the query and by the generation
+    stamps of the tables the data comes from (see busstops.utils.bump_generations),
+    and respond to If-None-Match requests with a 304 without touching the database"""
+
+    cache_dependencies = ()  # models
+    cache_timeout = 3600
+
+    def get_cache_version(self, request):
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        return sha1(
+            f"{get_generations(*self.cache_dependencies)}"
+            # expire ETags along with the cache, in case of changes made with
+            # .update() or .bulk_create() by something that didn't bump a generation
+            f":{int(time() // self.cache_timeout)}"
+            f":{request.get_host()}{request.path}?{query}"
+            f":{request.accepted_renderer.format}".encode()
+        ).hexdigest()
+
+    def get_cached_response(self, request, get_response, *args, **kwargs):
+        version = self.get_cache_version(request)
+        etag = f'"{version}"'
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = f"api:{version}"
+            data = cache.get(cache_key)
+            if data is None:
+                response = get_response(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(cache_key, response.data, self.cache_timeout)
+            else:
+                response = Response(data)
+
+        response["ETag"] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().retrieve, *args, **kwargs)
+
+
+class VehicleViewSet(CachedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = (
         Vehicle.objects.select_related("vehicle_type", "livery", "operator", "garage")
         .annotate(special_features=ArrayAgg("features__name", filter=~Q(features=None)))
@@ -43,23 +94,26 @@ class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = serializers.VehicleSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = filters.VehicleFilter
+    cache_dependencies = (Vehicle, VehicleType, Livery, Operator, Garage)
 
 
-class LiveryViewSet(viewsets.ReadOnlyModelViewSet):
+class LiveryViewSet(CachedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Livery.objects.order_by("id")
     serializer_class = serializers.LiverySerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = filters.LiveryFilter
+    cache_dependencies = (Livery,)
 
 
-class VehicleTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class VehicleTypeViewSet(CachedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = VehicleType.objects.all()
     serializer_class = serializers.VehicleTypeSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = filters.VehicleTypeFilter
+    cache_dependencies = (VehicleType,)
 
 
-class OperatorViewSet(viewsets.ReadOnlyModelViewSet):
+class OperatorViewSet(CachedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = (
         Operator.objects.filter(
             Exists("vehicle") | Exists("service", filter=Q(service__current=True))
@@ -71,21 +125,24 @@ class OperatorViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = CursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = filters.OperatorFilter
+    cache_dependencies = (Operator, Service, Vehicle)
 
 
-class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
+class ServiceViewSet(CachedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Service.objects.filter(current=True).prefetch_related("operator")
     serializer_class = serializers.ServiceSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = filters.ServiceFilter
+    cache_dependencies = (Service,)
 
 
-class StopViewSet(viewsets.ReadOnlyModelViewSet):
+class StopViewSet(CachedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = StopPoint.objects.order_by("atco_code").select_related("locality")
     serializer_class = serializers.StopSerializer
     pagination_class = CursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = filters.StopFilter
+    cache_dependencies = (StopPoint, Locality)
 
 
 class TripViewSet(viewsets.ReadOnlyModelViewSet):
@@ -138,13 +195,7 @@ class VehicleJourneyViewSet(viewsets.ReadOnlyModelViewSet):
 
         if redis_client:
             locations = redis_client.lrange(instance.get_redis_key(), 0, -1)
-            locations = [
-                struct.unpack("I 2f ?h ?h", location) for location in locations
-            ]
-            polyline = encode_time_aware_polyline(
-                [[lat, lng, time] for time, lat, lng, _, _, _, _ in locations]
-            )
-            extra_data["time_aware_polyline"] = polyline
+            extra_data["time_aware_polyline"] = encode_locations(locations)
 
         extra_data["service"] = {
             "id": instance.service_id,
@@ -152,3 +203,39 @@ class VehicleJourneyViewSet(viewsets.ReadOnlyModelViewSet):
         }
 
         return Response(serializer.data | extra_data)
+
+
+def export(request, name, format):
+    """Stream a whole table (optionally filtered, with the same filters as the
+    paginated API) as newline-delimited JSON or CSV"""
+    if name not in exports.EXPORTS:
+        raise Http404
+    table = exports.EXPORTS[name]
+
+    filterset = table.filterset_class(request.GET, table.get_queryset())
+    if not filterset.is_valid():
+        return JsonResponse(filterset.errors, status=400)
+
+    chunks = table.chunks(filterset.qs)
+    return StreamingHttpResponse(
+        exports.WRITERS[format](table, chunks),
+        content_type=exports.FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename={name}.{format}"},
+    )
+
+
+def export_snapshot(request, name, format):
+    """Serve a pre-generated gzipped copy of one of the biggest tables"""
+    if name not in exports.SNAPSHOTS:
+        raise Http404
+    path = exports.get_snapshot_path(name, format)
+    try:
+        open_file = path.open("rb")
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(
+        open_file,
+        as_attachment=True,
+        filename=path.name,
+        content_type="application/gzip",
+    )
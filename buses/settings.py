@@ -68,6 +68,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "busstops.middleware.ServerTimingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "busstops.middleware.GZipIfNotStreamingMiddleware",
     "busstops.middleware.WhiteNoiseWithFallbackMiddleware",
@@ -225,7 +226,7 @@ if TEST or DEBUG:
 
 if REDIS_URL and not TEST:
     CACHES["redis"] = {
-        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "BACKEND": "busstops.server_timing.RedisCache",
         "LOCATION": REDIS_URL,
         "KEY_PREFIX": os.environ.get("CACHE_KEY_PREFIX", ""),
     }
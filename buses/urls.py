@@ -1,10 +1,15 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.contrib import admin
-from api import api
+from api import api, views as api_views
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("accounts/", include("accounts.urls")),
+    re_path(r"^api/exports/(?P<name>\w+)\.(?P<format>ndjson|csv)$", api_views.export),
+    re_path(
+        r"^api/exports/(?P<name>\w+)\.(?P<format>ndjson|csv)\.gz$",
+        api_views.export_snapshot,
+    ),
     path("api/", include(api.router.urls)),
     path("", include("busstops.urls")),
 ]
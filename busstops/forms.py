@@ -1,4 +1,5 @@
 from django import forms
+from django.http import QueryDict
 from turnstile.fields import TurnstileField
 
 
@@ -25,6 +26,7 @@ class TimetableForm(forms.Form):
     calendar = forms.IntegerField(required=False)
     detailed = forms.BooleanField(required=False)
     vehicles = forms.BooleanField(required=False)
+    hour = forms.IntegerField(required=False, min_value=0, max_value=47)
     service = forms.MultipleChoiceField(
         required=False, widget=forms.CheckboxSelectMultiple
     )
@@ -53,17 +55,33 @@ class TimetableForm(forms.Form):
         else:
             del self.fields["service"]
 
+    def get_window_query(self, hour) -> str:
+        """Query string for another window of a very long timetable,
+        with the same date, services and other options"""
+        query = QueryDict(mutable=True)
+        for name in self.fields:
+            if name != "hour" and self.data.get(name):
+                if hasattr(self.data, "getlist"):
+                    value = self.data.getlist(name)
+                else:
+                    value = self.data[name]
+                query.setlist(name, value if isinstance(value, list) else [value])
+        query["hour"] = hour
+        return query.urlencode()
+
     def get_timetable(self, service):
         if self.is_valid():
             date = self.cleaned_data["date"]
             calendar_id = self.cleaned_data["calendar"]
             line_names = self.cleaned_data.get("service")
             detailed = self.cleaned_data["detailed"]
+            hour = self.cleaned_data["hour"]
         else:
             date = None
             calendar_id = None
             line_names = None
             detailed = False
+            hour = None
 
         return service.get_timetable(
             day=date,
@@ -71,6 +89,7 @@ class TimetableForm(forms.Form):
             also_services=self.related,
             line_names=line_names,
             detailed=detailed,
+            hour=hour,
         )
 
 
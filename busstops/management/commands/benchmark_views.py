@@ -0,0 +1,467 @@
+"""Generate some synthetic timetable and live vehicle data,
+request the busiest pages and JSON endpoints, and compare the number of database
+queries and Redis commands against the committed baseline - to catch an
+accidental N+1 query, say, before it reaches production. The counts are with a
+cold cache, and can vary with the time of day (which departures are shown), so
+the test that checks them runs at a fixed time.
+
+    ./manage.py benchmark_views                   # compare against the baseline
+    ./manage.py benchmark_views --save-baseline   # after an intentional change
+
+Times depend on the machine, so they're only compared if asked, against times
+saved locally (with however much data you like):
+
+    ./manage.py benchmark_views --services 20 --stops 30 --trips 200 --vehicles 3000 --save-times
+    ./manage.py benchmark_views --services 20 --stops 30 --trips 200 --vehicles 3000 --time-tolerance 1.5
+
+All the database changes are rolled back at the end, and the Redis keys removed,
+but the live vehicle data is added to the same Redis keys used by the live map,
+so this refuses to run unless DEBUG is on.
+"""
+
+import json
+import struct
+from datetime import timedelta
+from math import isqrt
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from bustimes.models import Calendar, Route, StopTime, Trip
+from vehicles.models import Vehicle, VehicleJourney
+from vehicles.utils import redis_client
+
+from ...models import (
+    DataSource,
+    Operator,
+    Region,
+    Service,
+    StopPoint,
+    StopUsage,
+)
+from ...server_timing import Timings, current_timings
+
+BASELINE_PATH = Path(__file__).resolve().parent.parent / "benchmark_baseline.json"
+TIMES_PATH = BASELINE_PATH.with_name("benchmark_times.json")  # not committed
+SIZES = {"services": 20, "stops": 30, "trips": 200, "vehicles": 3000}
+CENTRE = (1.2974, 52.6286)  # longitude, latitude
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        # the sizes default to those the baseline was saved with
+        parser.add_argument("--services", type=int)
+        parser.add_argument("--stops", type=int, help="per service")
+        parser.add_argument("--trips", type=int, help="per service")
+        parser.add_argument("--vehicles", type=int)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--time-tolerance",
+            type=float,
+            help="fail if a view takes this many times longer than the saved times",
+        )
+        parser.add_argument("--save-baseline", action="store_true")
+        parser.add_argument("--save-times", action="store_true")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG or not redis_client:
+            raise CommandError("needs DEBUG=1 and a (development) Redis server")
+
+        try:
+            baseline = json.loads(BASELINE_PATH.read_text())
+        except FileNotFoundError:
+            baseline = {"sizes": SIZES, "views": {}}
+        sizes = {
+            name: baseline["sizes"][name] if options[name] is None else options[name]
+            for name in SIZES
+        }
+        if sizes != baseline["sizes"] and not options["save_baseline"]:
+            # with more data, a view could legitimately make more queries
+            self.stdout.write(
+                f"the baseline counts are for {baseline['sizes']}, so not comparing them"
+            )
+            baseline["views"] = {}
+
+        times = {}
+        if options["time_tolerance"] is not None:
+            try:
+                saved_times = json.loads(TIMES_PATH.read_text())
+            except FileNotFoundError:
+                raise CommandError(f"no {TIMES_PATH} - run with --save-times first")
+            if saved_times["sizes"] != sizes:
+                raise CommandError(f"{TIMES_PATH} is for {saved_times['sizes']}")
+            times = saved_times["views"]
+
+        self.redis_keys = []
+        self.vehicle_ids = []
+        try:
+            with transaction.atomic():
+                self.create_data(**sizes)
+                results = self.run_benchmarks(options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            self.clean_up_redis()
+
+        if options["save_baseline"]:
+            self.save(BASELINE_PATH, sizes, results, ["queries", "redis_commands"])
+        if options["save_times"]:
+            self.save(TIMES_PATH, sizes, results, ["time"])
+        if options["save_baseline"] or options["save_times"]:
+            return
+
+        if not self.report(
+            results, baseline["views"], times, options["time_tolerance"]
+        ):
+            raise CommandError("over budget")
+
+    def save(self, path, sizes, results, keys):
+        views = {
+            name: {key: result[key] for key in keys} for name, result in results.items()
+        }
+        path.write_text(json.dumps({"sizes": sizes, "views": views}, indent=4) + "\n")
+        self.stdout.write(f"saved {path}")
+
+    def create_data(self, services, stops, trips, vehicles):
+        now = timezone.now()
+        today = timezone.localdate()
+        start = perf_counter()
+
+        source = DataSource.objects.create(name="Benchmark", datetime=now)
+        region = Region.objects.get_or_create(
+            id="GB", defaults={"name": "Great Britain"}
+        )[0]
+        operator = Operator.objects.create(
+            noc="BNCH", name="Benchmark Buses", slug="benchmark-buses", region=region
+        )
+        calendar = Calendar.objects.create(
+            mon=True,
+            tue=True,
+            wed=True,
+            thu=True,
+            fri=True,
+            sat=True,
+            sun=True,
+            start_date=today - timedelta(days=7),
+        )
+
+        # a hub stop served by every service, for the busiest possible stop page
+        self.hub = StopPoint(
+            atco_code="bnch0",
+            common_name="Bus Station",
+            latlong=Point(*CENTRE),
+            active=True,
+            source=source,
+        )
+        stop_points = [self.hub]
+        service_objects = []
+        for i in range(services):
+            service_objects.append(
+                Service(
+                    line_name=str(i + 1),
+                    description=f"Bus Station - Outskirts {i + 1}",
+                    slug=f"benchmark-{i + 1}",
+                    service_code=f"bnch{i + 1}",
+                    region=region,
+                    source=source,
+                    tracking=True,
+                )
+            )
+            for j in range(1, stops):
+                stop_points.append(
+                    StopPoint(
+                        atco_code=f"bnch{i}-{j}",
+                        common_name=f"Stop {j}",
+                        latlong=Point(CENTRE[0] + j * 0.002, CENTRE[1] + i * 0.002),
+                        active=True,
+                        source=source,
+                    )
+                )
+        StopPoint.objects.bulk_create(stop_points)
+        service_objects = Service.objects.bulk_create(service_objects)
+        Service.operator.through.objects.bulk_create(
+            [
+                Service.operator.through(service=service, operator=operator)
+                for service in service_objects
+            ]
+        )
+        self.service = service_objects[0]
+
+        routes = Route.objects.bulk_create(
+            [
+                Route(
+                    source=source,
+                    code=f"bnch{service.id}",
+                    service=service,
+                    line_name=service.line_name,
+                    start_date=today - timedelta(days=7),
+                )
+                for service in service_objects
+            ]
+        )
+        stop_usages = []
+        trip_objects = []
+        for i, route in enumerate(routes):
+            route_stops = [self.hub.atco_code] + [
+                f"bnch{i}-{j}" for j in range(1, stops)
+            ]
+            stop_usages += [
+                StopUsage(
+                    service=route.service,
+                    stop_id=stop_id,
+                    direction="outbound",
+                    order=order,
+                    timing_status="PTP",
+                )
+                for order, stop_id in enumerate(route_stops)
+            ]
+            for k in range(trips):
+                departure = timedelta(minutes=k * 24 * 60 // trips)
+                trip_objects.append(
+                    Trip(
+                        route=route,
+                        calendar=calendar,
+                        operator=operator,
+                        start=departure,
+                        end=departure + timedelta(minutes=2 * stops),
+                        ticket_machine_code=f"{route.id}-{k}",
+                    )
+                )
+        StopUsage.objects.bulk_create(stop_usages)
+        trip_objects = Trip.objects.bulk_create(trip_objects, batch_size=1000)
+
+        route_numbers = {route.id: i for i, route in enumerate(routes)}
+        stop_times = []
+        for trip in trip_objects:
+            i = route_numbers[trip.route_id]
+            for j in range(stops):
+                time = trip.start + timedelta(minutes=2 * j)
+                stop_times.append(
+                    StopTime(
+                        trip=trip,
+                        stop_id=f"bnch{i}-{j}" if j else self.hub.atco_code,
+                        arrival=time,
+                        departure=time,
+                        sequence=j,
+                        timing_status="PTP" if j % 5 == 0 else "OTH",
+                    )
+                )
+        StopTime.objects.bulk_create(stop_times, batch_size=5000)
+
+        self.create_vehicles(vehicles, source, operator, trip_objects, now)
+
+        self.stdout.write(
+            f"created {len(stop_points)} stops, {len(trip_objects)} trips, "
+            f"{len(stop_times)} stop times and {vehicles} vehicles "
+            f"in {perf_counter() - start:.1f}s"
+        )
+
+    def create_vehicles(self, count, source, operator, trips, now):
+        vehicles = Vehicle.objects.bulk_create(
+            [
+                Vehicle(
+                    code=f"bnch{i}",
+                    slug=f"bnch-{i}",
+                    fleet_code=str(i),
+                    operator=operator,
+                    source=source,
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        self.vehicle_ids = [vehicle.id for vehicle in vehicles]
+
+        journeys = VehicleJourney.objects.bulk_create(
+            [
+                VehicleJourney(
+                    datetime=now - timedelta(minutes=30),
+                    vehicle=vehicle,
+                    service_id=trips[i % len(trips)].route.service_id,
+                    trip=trips[i % len(trips)],
+                    route_name=trips[i % len(trips)].route.line_name,
+                    source=source,
+                    destination="Outskirts",
+                )
+                for i, vehicle in enumerate(vehicles)
+            ],
+            batch_size=1000,
+        )
+        for vehicle, journey in zip(vehicles, journeys):
+            vehicle.latest_journey = journey
+        Vehicle.objects.bulk_update(vehicles, ["latest_journey"], batch_size=1000)
+        self.journey = journeys[0]
+
+        # the same Redis data as import_live_vehicles would save
+        timestamp = now.timestamp()
+        pipeline = redis_client.pipeline(transaction=False)
+        geoadd = []
+        zadd = {}
+        side = isqrt(count - 1) + 1  # a square grid around the centre
+        for i, journey in enumerate(journeys):
+            x = CENTRE[0] + (i % side - side // 2) * 0.002
+            y = CENTRE[1] + (i // side - side // 2) * 0.002
+            geoadd += [x, y, journey.vehicle_id]
+            key = f"service{journey.service_id}vehicles:z"
+            zadd.setdefault(key, {})[journey.vehicle_id] = timestamp
+            pipeline.set(
+                f"vehicle{journey.vehicle_id}",
+                json.dumps(
+                    {
+                        "id": journey.vehicle_id,
+                        "journey_id": journey.id,
+                        "coordinates": (x, y),
+                        "heading": 90,
+                        "datetime": now,
+                        "destination": journey.destination,
+                        "trip_id": journey.trip_id,
+                        "service_id": journey.service_id,
+                        "service": {"line_name": journey.route_name},
+                    },
+                    cls=DjangoJSONEncoder,
+                ),
+            )
+        pipeline.geoadd("vehicle_location_locations", geoadd)
+        pipeline.zadd("vehicle_location_times", dict.fromkeys(geoadd[2::3], timestamp))
+        for key, members in zadd.items():
+            pipeline.zadd(key, members)
+
+        # 3 hours of locations every 10 seconds, for the journey_json view
+        journey_key = self.journey.get_redis_key()
+        pipeline.rpush(
+            journey_key,
+            *(
+                struct.pack(
+                    "I 2f ?h ?h",
+                    round(timestamp) - 10800 + i * 10,
+                    CENTRE[0] + i * 0.0001,
+                    CENTRE[1],
+                    True,
+                    90,
+                    False,
+                    0,
+                )
+                for i in range(1080)
+            ),
+        )
+        pipeline.execute()
+
+        self.redis_keys = [
+            *(f"vehicle{vehicle_id}" for vehicle_id in self.vehicle_ids),
+            *zadd,
+            journey_key,
+        ]
+
+    def clean_up_redis(self):
+        pipeline = redis_client.pipeline(transaction=False)
+        if self.redis_keys:
+            pipeline.delete(*self.redis_keys)
+        if self.vehicle_ids:
+            pipeline.zrem("vehicle_location_locations", *self.vehicle_ids)
+            pipeline.zrem("vehicle_location_times", *self.vehicle_ids)
+        pipeline.execute()
+
+    def get_urls(self):
+        xmin, ymin = CENTRE[0] - 0.02, CENTRE[1] - 0.02
+        xmax, ymax = CENTRE[0] + 0.02, CENTRE[1] + 0.02
+        return {
+            "stop_detail": f"/stops/{self.hub.atco_code}",
+            "service_detail": f"/services/{self.service.slug}",
+            "stop_times_json": f"/stops/{self.hub.atco_code}/times.json",
+            "vehicles_json": "/vehicles.json",
+            "vehicles_json_bounds": (
+                f"/vehicles.json?xmin={xmin}&ymin={ymin}&xmax={xmax}&ymax={ymax}"
+            ),
+            "vehicles_json_service": f"/vehicles.json?service={self.service.id}",
+            "journey_json": f"/journeys/{self.journey.id}.json",
+        }
+
+    def run_benchmarks(self, repeat):
+        client = Client(SERVER_NAME="localhost")
+        results = {}
+
+        for name, url in self.get_urls().items():
+            times = []
+            for i in range(repeat):
+                timings = Timings()
+                token = current_timings.set(timings)
+                try:
+                    with (
+                        CaptureQueriesContext(connection) as queries,
+                        # a cold cache, so the counts don't depend on what's cached
+                        override_settings(CACHES=self.get_caches()),
+                    ):
+                        start = perf_counter()
+                        response = client.get(url)
+                        if response.streaming:
+                            b"".join(response.streaming_content)
+                        times.append(perf_counter() - start)
+                finally:
+                    current_timings.reset(token)
+
+                if response.status_code != 200:
+                    raise CommandError(f"{url} returned {response.status_code}")
+
+            # counts from the last request, times from all of them
+            results[name] = {
+                "queries": len(queries),
+                "redis_commands": timings.redis_commands,
+                "time": round(median(times) * 1000, 1),
+            }
+
+        return results
+
+    @staticmethod
+    def get_caches():
+        return {
+            **settings.CACHES,
+            "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        }
+
+    def report(self, results, baseline, times, time_tolerance) -> bool:
+        if not baseline:
+            self.stdout.write("no baseline - run with --save-baseline to save one")
+
+        ok = True
+        self.stdout.write(
+            f"{'':24} {'queries':>16} {'Redis commands':>16} {'time (ms)':>20}"
+        )
+        for name, result in results.items():
+            budget = {"queries": "-", "redis_commands": "-", "time": "-"}
+            over = []
+            if name in baseline:
+                budget.update(baseline[name])
+                if result["queries"] > budget["queries"]:
+                    over.append("queries")
+                if result["redis_commands"] > budget["redis_commands"]:
+                    over.append("Redis commands")
+            if name in times:
+                budget.update(times[name])
+                if result["time"] > budget["time"] * time_tolerance:
+                    over.append("time")
+
+            self.stdout.write(
+                f"{name:24}"
+                f" {result['queries']:>7} ({budget['queries']:>6})"
+                f" {result['redis_commands']:>7} ({budget['redis_commands']:>6})"
+                f" {result['time']:>10} ({budget['time']:>7})"
+                + (f"  ⚠️ over budget: {', '.join(over)}" if over else "")
+            )
+            if over:
+                ok = False
+
+        return ok
@@ -10,7 +10,8 @@ from django.utils.text import slugify
 
 from vosa.models import Licence
 
-from ...models import DataSource, Operator, OperatorCode
+from ...models import DataSource, Operator, OperatorCode, Service
+from ...utils import bump_generations
 
 
 def get_region_id(region_id):
@@ -138,6 +139,7 @@ class Command(BaseCommand):
 
         to_create = []
         to_update = []
+        renamed = []
         operator_codes = []
         operator_licences = []
 
@@ -225,6 +227,8 @@ class Command(BaseCommand):
                     or twitter != operator.twitter
                     or vehicle_mode != operator.vehicle_mode
                 ):
+                    if name != operator.name:
+                        renamed.append(operator.noc)
                     operator.name = name
                     operator.url = url
                     operator.twitter = twitter
@@ -261,5 +265,17 @@ class Command(BaseCommand):
             to_update, ("url", "twitter", "name", "vehicle_mode")
         )
 
+        # so new and renamed operators (and their services) can be found by searching
+        if to_create or renamed:
+            Operator.objects.update_search_vectors(
+                [operator.noc for operator in to_create] + renamed
+            )
+        if renamed:
+            Service.objects.update_search_vectors(
+                Service.objects.filter(operator__in=renamed, current=True).values("pk")
+            )
+
         OperatorCode.objects.bulk_create(operator_codes)
         Operator.licences.through.objects.bulk_create(operator_licences)
+
+        bump_generations(Operator, Service)
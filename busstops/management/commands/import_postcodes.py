@@ -0,0 +1,80 @@
+"""Import the ONS Postcode Directory (ONSPD) - the zip file from
+https://geoportal.statistics.gov.uk/search?q=PRD_ONSPD or the big CSV file in it
+"""
+
+import csv
+import io
+import re
+import zipfile
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Postcode
+
+BATCH_SIZE = 10000
+
+
+def get_rows(path):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            name = next(
+                name
+                for name in archive.namelist()
+                if re.match(r"Data/ONSPD_.*_UK\.csv$", name)
+            )
+            with archive.open(name) as open_file:
+                yield from csv.DictReader(io.TextIOWrapper(open_file, "utf-8-sig"))
+    else:
+        with open(path, encoding="utf-8-sig") as open_file:
+            yield from csv.DictReader(open_file)
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str)
+
+    def get_postcodes(self, path):
+        outcodes = {}
+
+        for row in get_rows(path):
+            if row["doterm"] or row["lat"] == "99.999999":
+                continue  # terminated, or no location
+
+            postcode = "".join(row["pcd"].split())
+            lon = float(row["long"])
+            lat = float(row["lat"])
+
+            yield Postcode(id=postcode, latlong=Point(lon, lat, srid=4326))
+
+            outcode = postcode[:-3]
+            if outcode in outcodes:
+                total = outcodes[outcode]
+                total[0] += lon
+                total[1] += lat
+                total[2] += 1
+            else:
+                outcodes[outcode] = [lon, lat, 1]
+
+        for outcode, (lon, lat, count) in outcodes.items():
+            yield Postcode(
+                id=outcode, latlong=Point(lon / count, lat / count, srid=4326)
+            )
+
+    @transaction.atomic
+    def handle(self, path, **options):
+        Postcode.objects.all().delete()
+
+        batch = []
+        count = 0
+        for postcode in self.get_postcodes(path):
+            batch.append(postcode)
+            if len(batch) == BATCH_SIZE:
+                Postcode.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        Postcode.objects.bulk_create(batch)
+        count += len(batch)
+
+        self.stdout.write(f"{count} postcodes and outcodes")
@@ -6,13 +6,45 @@ from ciso8601 import parse_datetime
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django.utils.timezone import make_aware
 
+from busstops.management.profiling import ProfileMixin, phase
 from busstops.models import AdminArea, DataSource, Locality, StopArea, StopPoint
+from busstops.utils import bump_generations
 from bustimes.download_utils import download_if_modified
 
 logger = logging.getLogger(__name__)
 
+COPY_BATCH_SIZE = 10000
+
+STAGING_TABLE = """
+DROP TABLE IF EXISTS naptan_stop;
+CREATE TEMPORARY TABLE naptan_stop (
+    n integer,
+    atco_code text,
+    naptan_code text,
+    latlong geometry,
+    stop_area_id text,
+    locality_id text,
+    admin_area_id text,
+    active boolean,
+    created_at timestamptz,
+    modified_at timestamptz,
+    source_id text,
+    common_name text,
+    landmark text,
+    street text,
+    crossing text,
+    indicator text,
+    suburb text,
+    town text,
+    bearing text,
+    stop_type text,
+    bus_stop_type text,
+    timing_status text
+)"""
+
 
 def get_datetime(string):
     if string:
@@ -47,7 +79,7 @@ def get_point(element, atco_code):
         return GEOSGeometry(f"POINT({lon} {lat})")
 
 
-class Command(BaseCommand):
+class Command(ProfileMixin, BaseCommand):
     mapping = (
         ("Descriptor/CommonName", "common_name"),
         ("Descriptor/Landmark", "landmark"),
@@ -92,13 +124,6 @@ class Command(BaseCommand):
             ):
                 modified_at = stop_area_modified_at
 
-        if (existing_stop := self.existing_stops.get(atco_code)) and (
-            modified_at == existing_stop.modified_at
-            and atco_code not in self.overrides
-            and existing_stop.source_id == self.source.id
-        ):
-            return
-
         created_at = get_datetime(element.attrib["CreationDateTime"])
 
         point = get_point(element.find("Place/Location"), atco_code)
@@ -156,10 +181,25 @@ class Command(BaseCommand):
                     value = GEOSGeometry(value)
                 setattr(stop, key, value)
 
-        if atco_code in self.existing_stops:
-            self.stops_to_update.append(stop)
-        else:
-            self.stops_to_create.append(stop)
+        if stop.latlong and not stop.latlong.srid:
+            stop.latlong.srid = 4326
+
+        self.rows.append(
+            (
+                self.n + len(self.rows),  # to keep the last of any duplicates
+                stop.atco_code,
+                stop.naptan_code,
+                stop.latlong.hexewkb.decode() if stop.latlong else None,
+                stop.stop_area_id,
+                stop.locality_id,
+                stop.admin_area_id,
+                stop.active,
+                stop.created_at,
+                stop.modified_at,
+                stop.source_id,
+                *(getattr(stop, key) for key in self.text_fields),
+            )
+        )
 
     def get_stop_area(self, element):
         stop_area_code = element.findtext("StopAreaCode")
@@ -175,71 +215,104 @@ class Command(BaseCommand):
             stop_area_type=element.findtext("StopAreaType"),
         )
 
-    bulk_update_fields = [
-        "created_at",
-        "modified_at",
-        "naptan_code",
-        "latlong",
-        "bearing",
+    text_fields = (
         "common_name",
         "landmark",
         "street",
         "crossing",
-        "stop_type",
-        "bus_stop_type",
-        "timing_status",
-        "locality",
-        "admin_area",
-        "stop_area",
         "indicator",
         "suburb",
         "town",
-        "active",
-        "source",
-    ]
+        "bearing",
+        "stop_type",
+        "bus_stop_type",
+        "timing_status",
+    )
 
-    def update_and_create(self):
-        # create any new stop areas
-        stops = [stop for stop in self.stops_to_create if stop.stop_area_id]
-        stops += [stop for stop in self.stops_to_update if stop.stop_area_id]
-
-        existing_stop_areas = StopArea.objects.in_bulk(self.stop_areas.keys())
-        stop_areas_to_update = []
-        stop_areas_to_create = []
-        for stop_area_id, stop_area in self.stop_areas.items():
-            if stop_area_id in existing_stop_areas:
-                stop_areas_to_update.append(stop_area)
-            else:
-                stop_areas_to_create.append(stop_area)
-
-        StopArea.objects.bulk_create(stop_areas_to_create, batch_size=100)
-        StopArea.objects.bulk_update(
-            stop_areas_to_update,
-            ["name", "latlong", "active", "admin_area", "stop_area_type"],
-            batch_size=100,
-        )
+    @phase("write")
+    def copy_rows(self):
+        """Stream the parsed stops into the staging table"""
+        with (
+            connection.cursor() as cursor,
+            cursor.copy(
+                f"""COPY naptan_stop (
+                    n, atco_code, naptan_code, latlong, stop_area_id, locality_id,
+                    admin_area_id, active, created_at, modified_at, source_id,
+                    {", ".join(self.text_fields)}
+                ) FROM STDIN"""
+            ) as copy,
+        ):
+            for row in self.rows:
+                copy.write_row(row)
+        self.n += len(self.rows)
+        self.rows = []
 
-        existing_stop_areas = StopArea.objects.in_bulk(
-            [stop.stop_area_id for stop in stops]
-        )
-        stop_areas_to_create = set(
-            StopArea(
-                id=stop.stop_area_id, active=True, admin_area_id=stop.admin_area_id
+    @phase("write")
+    def update_and_create(self):
+        self.copy_rows()
+
+        with connection.cursor() as cursor:
+            # create any new stop areas
+            existing_stop_areas = StopArea.objects.in_bulk(self.stop_areas.keys())
+            stop_areas_to_update = []
+            stop_areas_to_create = []
+            for stop_area_id, stop_area in self.stop_areas.items():
+                if stop_area_id in existing_stop_areas:
+                    stop_areas_to_update.append(stop_area)
+                else:
+                    stop_areas_to_create.append(stop_area)
+
+            StopArea.objects.bulk_create(stop_areas_to_create, batch_size=100)
+            StopArea.objects.bulk_update(
+                stop_areas_to_update,
+                ["name", "latlong", "active", "admin_area", "stop_area_type"],
+                batch_size=100,
             )
-            for stop in stops
-            if stop.stop_area_id not in existing_stop_areas
-        )
-        StopArea.objects.bulk_create(stop_areas_to_create, batch_size=100)
 
-        # create new stops
-        StopPoint.objects.bulk_create(self.stops_to_create, batch_size=100)
-        self.stops_to_create = []
+            # placeholders for stop areas only referred to by stops
+            cursor.execute("""
+                INSERT INTO busstops_stoparea
+                    (id, name, admin_area_id, stop_area_type, active)
+                SELECT DISTINCT ON (stop_area_id)
+                    stop_area_id, '', admin_area_id::integer, '', true
+                FROM naptan_stop WHERE stop_area_id IS NOT NULL
+                ON CONFLICT (id) DO NOTHING""")
+
+            # create new stops, and update changed stops
+            # (and stops with overrides, or from a different source)
+            columns = [
+                "naptan_code",
+                "latlong",
+                "stop_area_id",
+                "locality_id",
+                "admin_area_id",
+                "active",
+                "created_at",
+                "modified_at",
+                "source_id",
+                *self.text_fields,
+            ]
+            cursor.execute(
+                f"""
+                INSERT INTO busstops_stoppoint
+                    (atco_code, short_common_name, {", ".join(columns)})
+                SELECT DISTINCT ON (atco_code)
+                    atco_code, '', naptan_code, ST_Transform(latlong, 4326),
+                    stop_area_id, locality_id, admin_area_id::integer, active,
+                    created_at, modified_at, source_id::integer,
+                    {", ".join(self.text_fields)}
+                FROM naptan_stop
+                ORDER BY atco_code, n DESC
+                ON CONFLICT (atco_code) DO UPDATE SET
+                    {", ".join(f"{column} = EXCLUDED.{column}" for column in columns)}
+                WHERE busstops_stoppoint.modified_at IS DISTINCT FROM EXCLUDED.modified_at
+                OR busstops_stoppoint.source_id IS DISTINCT FROM EXCLUDED.source_id
+                OR busstops_stoppoint.atco_code = ANY(%s)""",
+                [list(self.overrides)],
+            )
+            logger.info("%s stops created or updated", cursor.rowcount)
 
-        # update updated stops
-        StopPoint.objects.bulk_update(
-            self.stops_to_update, self.bulk_update_fields, batch_size=100
-        )
-        self.stops_to_update = []
+            cursor.execute("DROP TABLE naptan_stop")
 
     @staticmethod
     def add_arguments(parser):
@@ -250,7 +323,8 @@ class Command(BaseCommand):
         self.source = source
 
         path = settings.DATA_DIR / f"{source_name}.xml"
-        modified, _ = download_if_modified(path, source)
+        with phase("download"):
+            modified, _ = download_if_modified(path, source)
 
         if not modified:
             return
@@ -260,56 +334,52 @@ class Command(BaseCommand):
         with overrides_path.open() as open_file:
             self.overrides = yaml.load(open_file, yaml.BaseLoader)
 
-        self.stops_to_create = []
-        self.stops_to_update = []
-        self.admin_areas = {
-            admin_area.atco_code: admin_area
-            for admin_area in AdminArea.objects.order_by()
-        }
-        self.localities = set(
-            locality["pk"] for locality in Locality.objects.values("pk").order_by()
-        )
-        atco_code_prefix = None
-
+        self.rows = []
+        self.n = 0
+        with phase("lookup"):
+            self.admin_areas = {
+                admin_area.atco_code: admin_area
+                for admin_area in AdminArea.objects.order_by()
+            }
+            self.localities = set(
+                locality["pk"] for locality in Locality.objects.values("pk").order_by()
+            )
         self.stop_areas = {}
 
-        iterator = ET.iterparse(path, events=["start", "end"])
-        for event, element in iterator:
-            if event == "start":
-                if element.tag == "{http://www.naptan.org.uk/}NaPTAN":
-                    modified_at = get_datetime(element.attrib["ModificationDateTime"])
-                    if modified_at == source.datetime:
-                        return
-
-                    source.datetime = modified_at
+        with phase("parse"):
+            iterator = ET.iterparse(path, events=["start", "end"])
+            for event, element in iterator:
+                if event == "start":
+                    if element.tag == "{http://www.naptan.org.uk/}NaPTAN":
+                        modified_at = get_datetime(
+                            element.attrib["ModificationDateTime"]
+                        )
+                        if modified_at == source.datetime:
+                            return
 
-                continue
+                        source.datetime = modified_at
 
-            element.tag = element.tag.removeprefix("{http://www.naptan.org.uk/}")
-            if element.tag == "StopPoint":
-                atco_code = element.findtext("AtcoCode")
-                if atco_code[:3] != atco_code_prefix:
-                    if atco_code_prefix:
-                        self.update_and_create()
+                        # unlogged, and dropped at the end of the session if not before
+                        with connection.cursor() as cursor:
+                            cursor.execute(STAGING_TABLE)
 
-                    atco_code_prefix = atco_code[:3]
+                    continue
 
-                    self.existing_stops = (
-                        StopPoint.objects.only("atco_code", "modified_at", "source_id")
-                        .filter(atco_code__startswith=atco_code_prefix)
-                        .order_by()
-                        .in_bulk()
-                    )
+                element.tag = element.tag.removeprefix("{http://www.naptan.org.uk/}")
+                if element.tag == "StopPoint":
+                    self.get_stop(element)
 
-                self.get_stop(element)
+                    if len(self.rows) == COPY_BATCH_SIZE:
+                        self.copy_rows()
 
-                element.clear()  # save memory
+                    element.clear()  # save memory
 
-            elif element.tag == "StopArea":
-                stop_area = self.get_stop_area(element)
-                self.stop_areas[stop_area.id] = stop_area
-                element.clear()
+                elif element.tag == "StopArea":
+                    stop_area = self.get_stop_area(element)
+                    self.stop_areas[stop_area.id] = stop_area
+                    element.clear()
 
         self.update_and_create()
+        bump_generations(StopPoint)
 
         source.save(update_fields=["datetime"])
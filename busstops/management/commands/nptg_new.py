@@ -6,7 +6,7 @@ from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management.base import BaseCommand
 
-from ...models import AdminArea, DataSource, District, Locality, Region
+from ...models import AdminArea, DataSource, District, Locality, Region, Service
 from .naptan_new import get_datetime
 
 logger = logging.getLogger(__name__)
@@ -150,26 +150,49 @@ class Command(BaseCommand):
                 element.clear()  # save memory
 
             elif element.tag == "NptgLocalities":
-                localities = Locality.objects.only("modified_at").in_bulk()
+                localities = Locality.objects.only("modified_at", "name").in_bulk()
+                old_names = {pk: locality.name for pk, locality in localities.items()}
+                new_names = {}
                 localities_with_parents = []
+                changed_localities = []
 
                 for item in self.handle_localities(element):
+                    new_names[item.pk] = item.name
                     if item.parent_id and item.parent_id not in localities:
                         localities_with_parents.append(item)
                     else:
                         if item.pk not in localities:
-                            item.save(force_insert=True)
+                            item.save(force_insert=True, update_search_vector=False)
+                            changed_localities.append(item.pk)
                         elif localities[item.pk].modified_at != item.modified_at:
-                            item.save(force_update=True)
+                            item.save(force_update=True, update_search_vector=False)
+                            changed_localities.append(item.pk)
                         localities[item.id] = item
 
                 element.clear()  # save memory
 
                 for locality in localities_with_parents:
                     if locality.parent_id in localities:
-                        locality.save()
+                        locality.save(update_search_vector=False)
+                        changed_localities.append(locality.pk)
                 for locality in localities_with_parents:
                     if locality.parent_id not in localities:
-                        locality.save()
+                        locality.save(update_search_vector=False)
+                        changed_localities.append(locality.pk)
+
+                Locality.objects.update_search_vectors(changed_localities)
+
+                # services' search vectors include the names of their stops' localities
+                renamed_localities = [
+                    pk
+                    for pk in changed_localities
+                    if pk in old_names and old_names[pk] != new_names[pk]
+                ]
+                if renamed_localities:
+                    Service.objects.update_search_vectors(
+                        Service.objects.filter(
+                            stops__locality__in=renamed_localities, current=True
+                        ).values("pk")
+                    )
 
         source.save(update_fields=["datetime"])
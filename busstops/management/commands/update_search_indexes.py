@@ -1,19 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
 from django.core.management.base import BaseCommand
+from django.db import connection
 
 from ...models import Locality, Operator, Service
 
+BATCH_SIZE = 1000
+
+
+def update_batch(manager, pks):
+    try:
+        return manager.update_search_vectors(pks)
+    finally:
+        connection.close()  # each thread has its own connection
+
 
 class Command(BaseCommand):
-    def handle(self, *args, **options):
-        for queryset in (
-            Locality.objects.with_documents(),
-            Operator.objects.with_documents(),
-            Service.objects.with_documents().filter(current=True),
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Recompute every search vector, not just the missing ones",
+        )
+        parser.add_argument("--workers", type=int, default=4)
+
+    def handle(self, *args, full=False, workers=4, **options):
+        for model, queryset in (
+            (Locality, Locality.objects.all()),
+            (Operator, Operator.objects.all()),
+            (Service, Service.objects.filter(current=True)),
         ):
-            to_update = []
-            for item in queryset:
-                if item.search_vector != item.document:
-                    item.search_vector = item.document
-                    to_update.append(item)
+            start = perf_counter()
+
+            if full:
+                pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+                batches = [
+                    pks[i : i + BATCH_SIZE] for i in range(0, len(pks), BATCH_SIZE)
+                ]
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    updated = sum(
+                        executor.map(
+                            update_batch, [model.objects] * len(batches), batches
+                        )
+                    )
+            else:
+                # rows whose search vector has been cleared, or was never set
+                # (e.g. created by bulk_create)
+                pks = queryset.filter(search_vector=None).values_list("pk", flat=True)
+                updated = model.objects.update_search_vectors(list(pks))
 
-            queryset.bulk_update(to_update, ["search_vector"])
+            self.stdout.write(
+                f"{model.__name__}: {updated} updated in {perf_counter() - start:.1f}s"
+            )
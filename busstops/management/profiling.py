@@ -0,0 +1,255 @@
+"""A --profile option for long-running management commands (mostly importers).
+
+    ./manage.py import_transxchange data/TNDS/EA.zip --profile
+    ./manage.py naptan_new --profile sampling
+
+Each run writes a report to DATA_DIR/profiles (or --profile-dir) - time spent and
+database queries in each phase, and the slowest functions - plus either a .prof file
+(--profile cprofile, the default - open it with snakeviz) or a .folded file of
+sampled stacks (--profile sampling - open it with speedscope, or flamegraph.pl).
+
+Sampling has much less overhead than cProfile, so the phase timings are closer to
+the truth, but only sees the main thread. Work done in other processes (--workers)
+isn't profiled at all.
+
+Mark phases with ``with phase("parse"):`` etc - when not profiling, it does nothing.
+"""
+
+import cProfile
+import io
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from busstops.server_timing import Timings, current_timings
+
+current_profile = ContextVar("profile", default=None)
+
+SAMPLE_INTERVAL = 0.005  # seconds
+REPORT_FUNCTIONS = 40
+
+
+class Sampler(threading.Thread):
+    """Every few milliseconds, record the stack of another thread (and the current phase)"""
+
+    def __init__(self, profile, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.profile = profile
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if phases := self.profile.stack:
+                stack.append(f"[{phases[-1][0]}]")
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def get_folded(self) -> str:
+        # the "collapsed stacks" format understood by flamegraph.pl and speedscope
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def get_stats(self, limit=REPORT_FUNCTIONS) -> str:
+        # samples in which each function was running (self), or on the stack at all (total)
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = sum(self.stacks.values()) or 1
+        lines = [f"{'self':>7} {'total':>7}  function"]
+        for frame, count in total.most_common(limit):
+            lines.append(f"{own[frame] / samples:7.1%} {count / samples:7.1%}  {frame}")
+        return "\n".join(lines)
+
+
+class Profile:
+    def __init__(self, mode):
+        self.mode = mode
+        self.timings = Timings()
+        self.phases = {}  # name: [calls, seconds, queries, db seconds, redis commands]
+        self.stack = []  # [name, snapshot when entered or resumed]
+
+    def snapshot(self):
+        return (
+            perf_counter(),
+            self.timings.db_queries,
+            self.timings.db_time,
+            self.timings.redis_commands,
+        )
+
+    def record(self, name, since, now, calls=0):
+        totals = self.phases.setdefault(name, [0, 0.0, 0, 0.0, 0])
+        totals[0] += calls
+        for i, (before, after) in enumerate(zip(since, now), 1):
+            totals[i] += after - before
+
+    # phases can be nested - time in the inner phase isn't counted in the outer one
+
+    def enter(self, name):
+        now = self.snapshot()
+        if self.stack:
+            outer = self.stack[-1]
+            self.record(outer[0], outer[1], now)
+        self.stack.append([name, now])
+
+    def exit(self):
+        now = self.snapshot()
+        name, since = self.stack.pop()
+        self.record(name, since, now, calls=1)
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def get_report(self, title, total_time, functions) -> str:
+        timings = self.timings
+        lines = [
+            title,
+            "",
+            f"{total_time:.2f}s, {timings.db_queries} queries ({timings.db_time:.2f}s),"
+            f" {timings.redis_commands} Redis commands ({timings.redis_time:.2f}s)",
+            "",
+            f"{'phase':<24} {'calls':>7} {'seconds':>9} {'%':>6} {'queries':>8} {'db s':>8} {'redis':>7}",
+        ]
+        phases = dict(self.phases)
+        outside = [
+            0,
+            total_time - sum(phase[1] for phase in phases.values()),
+            timings.db_queries - sum(phase[2] for phase in phases.values()),
+            timings.db_time - sum(phase[3] for phase in phases.values()),
+            timings.redis_commands - sum(phase[4] for phase in phases.values()),
+        ]
+        phases["(no phase)"] = outside
+        for name, (calls, seconds, queries, db_time, redis_commands) in sorted(
+            phases.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                f"{name:<24} {calls:>7} {seconds:>9.2f}"
+                f" {seconds / total_time if total_time else 0:>6.1%}"
+                f" {queries:>8} {db_time:>8.2f} {redis_commands:>7}"
+            )
+        lines += ["", functions]
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def phase(name: str):
+    """Count time and queries towards a phase (e.g. "parse", "lookup", "write", "post-process")
+    of the command being profiled, if any"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+class ProfileMixin:
+    """For a BaseCommand subclass - adds --profile and --profile-dir options"""
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        # rather than add_arguments, which commands override without calling super()
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            "--profile",
+            nargs="?",
+            const="cprofile",
+            choices=["cprofile", "sampling"],
+            help="profile this run, and write a report",
+        )
+        parser.add_argument(
+            "--profile-dir",
+            type=Path,
+            help="where to write profiling reports (default: DATA_DIR/profiles)",
+        )
+        self.command_name = subcommand
+        return parser
+
+    def execute(self, *args, **options):
+        mode = options.pop("profile", None)
+        directory = options.pop("profile_dir", None)
+        if not mode:
+            return super().execute(*args, **options)
+
+        profile = Profile(mode)
+        name = getattr(self, "command_name", None) or self.__module__.split(".")[-1]
+        path = (directory or settings.DATA_DIR / "profiles") / (
+            f"{name}-{datetime.now():%Y%m%d-%H%M%S}"
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        if mode == "sampling":
+            profiler = Sampler(profile, threading.get_ident())
+        else:
+            profiler = cProfile.Profile()
+
+        token = current_profile.set(profile)
+        timings_token = current_timings.set(profile.timings)  # to count Redis commands
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(profile.timings.execute_wrapper)
+                    )
+                if mode == "sampling":
+                    profiler.start()
+                else:
+                    profiler.enable()
+                try:
+                    return super().execute(*args, **options)
+                finally:
+                    if mode == "sampling":
+                        profiler.stop()
+                    else:
+                        profiler.disable()
+        finally:
+            total_time = perf_counter() - start
+            current_timings.reset(timings_token)
+            current_profile.reset(token)
+
+            if mode == "sampling":
+                path.with_suffix(".folded").write_text(profiler.get_folded())
+                functions = profiler.get_stats()
+            else:
+                profiler.dump_stats(path.with_suffix(".prof"))
+                output = io.StringIO()
+                stats = pstats.Stats(profiler, stream=output)
+                stats.sort_stats("cumulative").print_stats(REPORT_FUNCTIONS)
+                functions = output.getvalue()
+
+            report_path = path.with_suffix(".txt")
+            report_path.write_text(
+                profile.get_report(
+                    f"{' '.join(sys.argv)}\n{datetime.now():%Y-%m-%d %H:%M:%S}",
+                    total_time,
+                    functions,
+                )
+            )
+            self.stderr.write(f"profile written to {report_path}")
@@ -0,0 +1,98 @@
+import json
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import fakeredis
+import redis
+import time_machine
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ...models import StopPoint
+from ...server_timing import TimedConnectionMixin
+
+
+class TimedFakeConnection(TimedConnectionMixin, fakeredis.FakeConnection):
+    pass
+
+
+@override_settings(DEBUG=True)
+class BenchmarkViewsTest(TestCase):
+    def patch_redis(self, redis_client):
+        for target in (
+            "busstops.management.commands.benchmark_views.redis_client",
+            "vehicles.views.redis_client",
+            "departures.avl.redis_client",
+        ):
+            patcher = patch(target, redis_client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_save_baseline(self):
+        redis_client = fakeredis.FakeStrictRedis()
+        self.patch_redis(redis_client)
+        stdout = StringIO()
+
+        with (
+            TemporaryDirectory() as directory,
+            patch(
+                "busstops.management.commands.benchmark_views.BASELINE_PATH",
+                Path(directory) / "baseline.json",
+            ) as baseline_path,
+        ):
+            options = [
+                "--services=2",
+                "--stops=3",
+                "--trips=4",
+                "--vehicles=5",
+                "--repeat=1",
+            ]
+            call_command("benchmark_views", *options, "--save-baseline", stdout=stdout)
+            baseline = json.loads(baseline_path.read_text())
+
+            # same data, so within budget
+            call_command("benchmark_views", "--repeat=1", stdout=stdout)
+
+        self.assertIn(
+            "created 5 stops, 8 trips, 24 stop times and 5 vehicles", stdout.getvalue()
+        )
+        self.assertEqual(
+            baseline["sizes"], {"services": 2, "stops": 3, "trips": 4, "vehicles": 5}
+        )
+        self.assertEqual(
+            list(baseline["views"]),
+            [
+                "stop_detail",
+                "service_detail",
+                "stop_times_json",
+                "vehicles_json",
+                "vehicles_json_bounds",
+                "vehicles_json_service",
+                "journey_json",
+            ],
+        )
+        self.assertNotIn("over budget", stdout.getvalue())
+
+        # everything cleaned up
+        self.assertFalse(StopPoint.objects.exists())
+        self.assertEqual(redis_client.keys(), [])
+
+    @time_machine.travel("2024-06-04T12:03:00+01:00")
+    def test_committed_baseline(self):
+        # count the Redis commands like the real Redis connection would
+        redis_client = redis.Redis(
+            connection_pool=redis.ConnectionPool(
+                connection_class=TimedFakeConnection, server=fakeredis.FakeServer()
+            )
+        )
+        self.patch_redis(redis_client)
+        stdout = StringIO()
+
+        # fails if a view makes more queries or Redis commands than the baseline -
+        # if that's intentional, run benchmark_views --save-baseline at this time
+        call_command("benchmark_views", "--repeat=1", stdout=stdout)
+
+        self.assertNotIn("not comparing", stdout.getvalue())
+        self.assertNotIn("over budget", stdout.getvalue())
@@ -51,7 +51,7 @@ class NaptanTest(TestCase):
             with override_settings(DATA_DIR=temp_dir_path):
                 self.assertFalse((temp_dir_path / "NaPTAN.xml").exists())
 
-                with self.assertNumQueries(24), self.assertLogs(
+                with self.assertNumQueries(11), self.assertLogs(
                     "busstops.management.commands.naptan_new", "WARNING"
                 ):
                     call_command("naptan_new")
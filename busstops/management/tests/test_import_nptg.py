@@ -28,7 +28,7 @@ class ImportNPTGTest(TestCase):
             with override_settings(DATA_DIR=temp_dir_path):
                 self.assertFalse((temp_dir_path / "nptg.xml").exists())
 
-                with self.assertNumQueries(565):
+                with self.assertNumQueries(524):
                     call_command("nptg_new")
 
                 source = DataSource.objects.get(name="NPTG")
@@ -71,7 +71,7 @@ class ImportOperatorsTest(TestCase):
                 authorised_discs=0,
             )  # First Kernow
 
-            with self.assertNumQueries(21):
+            with self.assertNumQueries(20):
                 call_command("import_noc")
 
         self.assertEqual(Operator.objects.count(), 3105)
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ...models import Postcode
+
+
+class ImportPostcodesTest(TestCase):
+    def test_import_postcodes(self):
+        path = Path(__file__).resolve().parent / "fixtures" / "ONSPD_UK.csv"
+
+        call_command("import_postcodes", path)
+
+        self.assertEqual(
+            sorted(Postcode.objects.values_list("id", flat=True)),
+            ["NR1", "NR11AA", "NR11AB", "W1A", "W1A1AA"],
+        )
+
+        postcode = Postcode.objects.get(id="W1A1AA")
+        self.assertEqual(str(postcode), "W1A 1AA")
+        self.assertEqual(postcode.latlong.coords, (-0.143799, 51.518561))
+
+        outcode = Postcode.objects.get(id="NR1")
+        self.assertEqual(str(outcode), "NR1")
+        self.assertAlmostEqual(outcode.latlong.x, 1.298004)
+        self.assertAlmostEqual(outcode.latlong.y, 52.625791)
+
+        # run again, replacing the old data
+        call_command("import_postcodes", path)
+        self.assertEqual(Postcode.objects.count(), 5)
@@ -0,0 +1,54 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import TestCase
+
+from ...models import Region
+from ..profiling import ProfileMixin, phase
+
+
+class Command(ProfileMixin, BaseCommand):
+    def handle(self, *args, **options):
+        with phase("lookup"):
+            Region.objects.count()
+            with phase("write"):
+                Region.objects.create(id="EA", name="East Anglia")
+                Region.objects.create(id="EM", name="East Midlands")
+
+
+class ProfileTest(TestCase):
+    def test_not_profiling(self):
+        with TemporaryDirectory() as temp_dir:
+            call_command(Command(), profile_dir=Path(temp_dir))
+            self.assertEqual(list(Path(temp_dir).iterdir()), [])
+
+        self.assertEqual(Region.objects.count(), 2)
+
+    def test_cprofile(self):
+        with TemporaryDirectory() as temp_dir:
+            call_command(Command(), profile="cprofile", profile_dir=Path(temp_dir))
+
+            (report,) = Path(temp_dir).glob("*.txt")
+            (prof,) = Path(temp_dir).glob("*.prof")
+
+            self.assertTrue(report.name.startswith("test_profiling-"))
+            self.assertEqual(report.stem, prof.stem)
+            report = report.read_text()
+
+        self.assertIn("3 queries", report)
+        self.assertRegex(report, r"lookup +1 +[\d.]+ +[\d.]+% +1 ")
+        self.assertRegex(report, r"write +1 +[\d.]+ +[\d.]+% +2 ")
+        self.assertIn("function calls", report)  # pstats
+
+    def test_sampling(self):
+        with TemporaryDirectory() as temp_dir:
+            call_command(Command(), profile="sampling", profile_dir=Path(temp_dir))
+
+            (report,) = Path(temp_dir).glob("*.txt")
+            self.assertTrue(report.with_suffix(".folded").exists())
+            report = report.read_text()
+
+        self.assertIn("3 queries", report)
+        self.assertIn("self   total  function", report)
@@ -1,12 +1,24 @@
+import json
 import re
+from contextlib import ExitStack
 from http import HTTPStatus
+from time import perf_counter
 
+from django.db import connections
 from django.middleware.gzip import GZipMiddleware
 from django.utils.cache import add_never_cache_headers
+from redis.exceptions import ConnectionError
 
 # from multidb.pinning import pin_this_thread, unpin_this_thread
 from whitenoise.middleware import WhiteNoiseMiddleware
 
+from vehicles.utils import redis_client
+
+from .server_timing import Timings, current_timings
+
+SERVER_TIMING_COOKIE = "server-timing"  # set for staff by the server_timings view
+SERVER_TIMING_SAMPLES = 1000  # per view
+
 
 class WhiteNoiseWithFallbackMiddleware(WhiteNoiseMiddleware):
     def immutable_file_test(self, path, url):
@@ -48,3 +60,56 @@ class GZipIfNotStreamingMiddleware(GZipMiddleware):
             return response
 
         return super().process_response(request, response)
+
+
+class ServerTimingMiddleware:
+    """Count and time database queries, Redis commands etc, and
+    - add a Server-Timing header, for staff
+    - keep the last few samples for each view, in Redis, for the server_timings view
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # (the benchmark_views command collects its own timings around each request)
+        outer_timings = current_timings.get()
+        timings = outer_timings or Timings()
+        token = current_timings.set(timings)
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.execute_wrapper)
+                    )
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total_time = perf_counter() - start
+
+        if request.get_signed_cookie(SERVER_TIMING_COOKIE, None):
+            response["Server-Timing"] = timings.get_header(total_time)
+
+        if redis_client and request.resolver_match and not outer_timings:
+            key = f"server-timing:{request.resolver_match.view_name}"
+            sample = json.dumps(
+                [
+                    round(total_time * 1000, 1),
+                    timings.db_queries,
+                    round(timings.db_time * 1000, 1),
+                    timings.redis_commands,
+                    round(timings.redis_time * 1000, 1),
+                    round(sum(seconds for _, seconds in timings.external) * 1000, 1),
+                ]
+            )
+            pipeline = redis_client.pipeline(transaction=False)
+            pipeline.sadd("server-timing-views", key)
+            pipeline.lpush(key, sample)
+            pipeline.ltrim(key, 0, SERVER_TIMING_SAMPLES - 1)
+            try:
+                pipeline.execute()
+            except ConnectionError:
+                pass
+
+        return response
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-19 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busstops', '0007_sirisource_operators_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceMap',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='busstops.service')),
+                ('service_modified_at', models.DateTimeField()),
+                ('data', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:02
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busstops', '0008_servicemap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapStop',
+            fields=[
+                ('stop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='busstops.stoppoint')),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=3857)),
+                ('name', models.CharField(max_length=255)),
+                ('indicator', models.CharField(blank=True, max_length=48)),
+                ('icon', models.CharField(blank=True, max_length=3)),
+                ('bearing', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('line_names', models.TextField(blank=True)),
+                ('services_count', models.PositiveSmallIntegerField()),
+                ('stop_type', models.CharField(blank=True, max_length=3)),
+                ('bus_stop_type', models.CharField(blank=True, max_length=3)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-19 11:40
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busstops', '0009_mapstop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Postcode',
+            fields=[
+                ('id', models.CharField(max_length=7, primary_key=True, serialize=False)),
+                ('latlong', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 "Model definitions"
 
 import datetime
+import gzip
+import json
 import logging
 import re
 from urllib.parse import urlencode
@@ -14,7 +16,7 @@ from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.cache import cache
-from django.db.models import Q
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
 from django.db.models.functions import Coalesce, Now, Upper
 from django.urls import reverse
 from django.utils.html import escape, format_html
@@ -25,6 +27,8 @@ from bustimes.models import Route, StopTime, TimetableDataSource, Trip
 from bustimes.timetables import Timetable, get_stop_usages
 from bustimes.utils import get_descriptions
 
+from .utils import get_service_map_data, simplify_service_map_data
+
 TIMING_STATUS_CHOICES = (
     ("PPT", "Principal point"),
     ("TIP", "Time info point"),
@@ -40,12 +44,24 @@ class SearchMixin:
         instance.search_vector = instance.document
         instance.save(update_fields=["search_vector"])
 
-    def save(self, *args, update_fields=None, **kwargs):
+    def save(self, *args, update_fields=None, update_search_vector=True, **kwargs):
         super().save(*args, update_fields=update_fields, **kwargs)
-        if update_fields is None or "search_vector" not in update_fields:
+        if update_search_vector and (
+            update_fields is None or "search_vector" not in update_fields
+        ):
             self.update_search_vector()
 
 
+class SearchManager(models.Manager):
+    def update_search_vectors(self, pks=None):
+        """Recompute the search vectors of some rows (or all rows) in one query"""
+        documents = self.with_documents().filter(pk=OuterRef("pk")).values("document")
+        queryset = self.get_queryset()
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        return queryset.update(search_vector=Subquery(documents))
+
+
 class Region(models.Model):
     """The largest type of geographical area"""
 
@@ -115,7 +131,7 @@ class District(models.Model):
         return reverse("district_detail", args=(self.id,))
 
 
-class LocalityManager(models.Manager):
+class LocalityManager(SearchManager):
     def with_documents(self):
         vector = SearchVector("name", weight="A", config="english")
         vector += SearchVector("qualifier_name", weight="B", config="english")
@@ -502,7 +518,7 @@ class OperatorGroup(models.Model):
         return self.name
 
 
-class OperatorManager(models.Manager):
+class OperatorManager(SearchManager):
     def with_documents(self):
         vector = SearchVector("name", weight="A", config="english")
         vector += SearchVector("noc", weight="A", config="english")
@@ -604,6 +620,19 @@ class OperatorCode(models.Model):
         return self.code
 
 
+class Postcode(models.Model):
+    """A postcode or an outcode, from the ONS Postcode Directory.
+    Outcodes are located at the average of their postcodes"""
+
+    id = models.CharField(max_length=7, primary_key=True)  # without spaces
+    latlong = models.PointField()
+
+    def __str__(self):
+        if len(self.id) > 4:
+            return f"{self.id[:-3]} {self.id[-3:]}"
+        return self.id
+
+
 class StopUsage(models.Model):
     """A link between a StopPoint and a Service,
     with an order placing it in a direction (e.g. the first outbound stop)"""
@@ -639,7 +668,7 @@ class ServiceColour(models.Model):
         )
 
 
-class ServiceManager(models.Manager):
+class ServiceManager(SearchManager):
     def with_documents(self):
         vector = SearchVector(
             StringAgg("route__line_name", delimiter=" ", distinct=True, default=""),
@@ -914,12 +943,17 @@ class Service(models.Model):
         also_services=None,
         line_names=None,
         detailed=False,
+        hour=None,
     ):
         """Given a Service, return a Timetable"""
 
         if self.region_id == "NI" or self.source and "ireland" in self.source.url:
             timetable = Timetable(
-                self.route_set, day, calendar_id=calendar_id, detailed=detailed
+                self.route_set,
+                day,
+                calendar_id=calendar_id,
+                detailed=detailed,
+                hour=hour,
             )
         else:
             routes = self.route_set.all()
@@ -945,6 +979,7 @@ class Service(models.Model):
                     calendar_id=calendar_id,
                     detailed=detailed,
                     operators=operators,
+                    hour=hour,
                 )
             except (IndexError, UnboundLocalError, AssertionError) as e:
                 logger = logging.getLogger(__name__)
@@ -959,6 +994,8 @@ class Service(models.Model):
         ]
         if line_names:
             cache_key += line_names
+        if hour is not None:
+            cache_key.append(f"hour{hour}")
         if also_services:
             cache_key += [
                 f"{s.id}:{self.modified_at.timestamp()}" for s in also_services
@@ -979,7 +1016,17 @@ class Service(models.Model):
 
         existing = self.stopusage_set.all()
 
-        stop_usages = [
+        stop_usages = self.get_stop_usages(outbound, inbound)
+
+        if self.stop_usages_changed(existing, stop_usages):
+            if existing:
+                existing.delete()
+            StopUsage.objects.bulk_create(stop_usages)
+
+        return stop_usages
+
+    def get_stop_usages(self, outbound, inbound):
+        return [
             StopUsage(
                 service=self,
                 stop_id=stop_time.stop_id,
@@ -999,23 +1046,19 @@ class Service(models.Model):
             for i, stop_time in enumerate(inbound)
         ]
 
+    @staticmethod
+    def stop_usages_changed(existing, proposed) -> bool:
         existing_hash = [
             (su.stop_id, su.timing_status, su.direction, su.order) for su in existing
         ]
         proposed_hash = [
-            (su.stop_id, su.timing_status, su.direction, su.order) for su in stop_usages
+            (su.stop_id, su.timing_status, su.direction, su.order) for su in proposed
         ]
+        return existing_hash != proposed_hash
 
-        if existing_hash != proposed_hash:
-            if existing:
-                existing.delete()
-            StopUsage.objects.bulk_create(stop_usages)
-
-        return stop_usages
-
-    def update_description(self):
-        routes = self.route_set.all()
-
+    def get_new_description(self, routes):
+        """Return a better description based on the routes' origins and destinations,
+        or None"""
         inbound_outbound_descriptions, origins_and_destinations = get_descriptions(
             routes
         )
@@ -1029,8 +1072,13 @@ class Service(models.Model):
         ):
             description = " - ".join(max(origins_and_destinations, key=len))
             if description != self.description and len(description) <= 255:
-                self.description = description
-                self.save(update_fields=["description"])
+                return description
+
+    def update_description(self):
+        description = self.get_new_description(self.route_set.all())
+        if description:
+            self.description = description
+            self.save(update_fields=["description"])
 
     def update_geometry(self, save=True):
         extent = self.stopusage_set.aggregate(Extent("stop__latlong"))
@@ -1040,6 +1088,127 @@ class Service(models.Model):
             if save:
                 self.save(update_fields=["geometry"])
 
+    def update_map(self):
+        """Store the data for the map on the service page, ready to be served"""
+        stops = self.stops.filter(latlong__isnull=False)
+        stops = stops.distinct().order_by().select_related("locality").in_bulk()
+        data = simplify_service_map_data(get_service_map_data(self, stops))
+        ServiceMap.objects.update_or_create(
+            {
+                "service_modified_at": self.modified_at,
+                "data": gzip.compress(json.dumps(data, separators=(",", ":")).encode()),
+            },
+            service=self,
+        )
+        cache.delete(f"service{self.id}map")  # cached by the service_map_data view
+
+
+class ServiceMap(models.Model):
+    """The data for the map on a service page, precomputed after importing timetables.
+    Stale if the service has been modified since"""
+
+    service = models.OneToOneField(Service, models.CASCADE, primary_key=True)
+    service_modified_at = models.DateTimeField()
+    data = models.BinaryField()  # gzip-compressed GeoJSON
+
+
+class MapStopManager(models.Manager):
+    def update_stops(self, stop_ids=None):
+        """Refresh the map stops (all of them, or just some)
+        from the StopPoint and current Service tables"""
+
+        current = Q(service__current=True)
+        served = StopPoint.objects.filter(
+            Exists(
+                StopUsage.objects.filter(stop=OuterRef("pk"), service__current=True)
+            ),
+            latlong__isnull=False,
+            active=True,
+        )
+        stops = (
+            served.annotate(
+                line_names=ArrayAgg(
+                    "service__route__line_name",
+                    filter=current,
+                    distinct=True,
+                    default=None,
+                ),
+                services_count=Count("service", filter=current, distinct=True),
+            )
+            .select_related("locality")
+            .defer("locality__latlong")
+            .order_by()
+        )
+        # stops no longer active or served by any current service
+        # (a NOT EXISTS anti-join, rather than a list of every stop updated)
+        stale = self.filter(~Exists(served.filter(atco_code=OuterRef("stop"))))
+        if stop_ids is not None:
+            stops = stops.filter(atco_code__in=stop_ids)
+            stale = stale.filter(stop__in=stop_ids)
+
+        fields = [
+            "point",
+            "name",
+            "indicator",
+            "icon",
+            "bearing",
+            "line_names",
+            "services_count",
+            "stop_type",
+            "bus_stop_type",
+        ]
+        batch = []
+        for stop in stops.iterator(chunk_size=2000):
+            batch.append(
+                MapStop(
+                    stop=stop,
+                    point=stop.latlong.transform(3857, clone=True),
+                    name=stop.get_qualified_name(),
+                    indicator=stop.indicator,
+                    icon=stop.get_icon() or "",
+                    bearing=stop.get_heading(),
+                    line_names=json.dumps(stop.get_line_names()),
+                    services_count=stop.services_count,
+                    stop_type=stop.stop_type,
+                    bus_stop_type=stop.bus_stop_type,
+                )
+            )
+            if len(batch) == 2000:
+                self.bulk_create(
+                    batch,
+                    update_conflicts=True,
+                    update_fields=fields,
+                    unique_fields=["stop"],
+                )
+                batch = []
+        if batch:
+            self.bulk_create(
+                batch,
+                update_conflicts=True,
+                update_fields=fields,
+                unique_fields=["stop"],
+            )
+
+        stale.delete()
+
+
+class MapStop(models.Model):
+    """Denormalised copy of the StopPoints served by current services,
+    for generating vector tiles for the big map"""
+
+    stop = models.OneToOneField(StopPoint, models.CASCADE, primary_key=True)
+    point = models.PointField(srid=3857)  # web mercator, as used in vector tiles
+    name = models.CharField(max_length=255)
+    indicator = models.CharField(max_length=48, blank=True)
+    icon = models.CharField(max_length=3, blank=True)
+    bearing = models.PositiveSmallIntegerField(null=True, blank=True)
+    line_names = models.TextField(blank=True)  # JSON array
+    services_count = models.PositiveSmallIntegerField()
+    stop_type = models.CharField(max_length=3, blank=True)
+    bus_stop_type = models.CharField(max_length=3, blank=True)
+
+    objects = MapStopManager()
+
 
 class ServiceCode(models.Model):
     service = models.ForeignKey(Service, models.CASCADE)
@@ -0,0 +1,112 @@
+"""Per-request counts and timings of database queries, Redis commands, cache hits
+and requests to other websites - collected by busstops.middleware.ServerTimingMiddleware
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.core.cache.backends.redis import RedisCache as BaseRedisCache
+from redis.connection import Connection, SSLConnection
+
+current_timings = ContextVar("server_timings", default=None)
+
+
+class Timings:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.redis_commands = 0
+        self.redis_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.external = []  # (name, seconds)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start
+            self.db_queries += 1
+
+    def get_header(self, total_time: float) -> str:
+        metrics = [
+            f'db;desc="{self.db_queries} queries";dur={self.db_time * 1000:.1f}',
+            f'redis;desc="{self.redis_commands} commands";dur={self.redis_time * 1000:.1f}',
+        ]
+        if self.cache_hits or self.cache_misses:
+            metrics.append(
+                f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"'
+            )
+        for name, seconds in self.external:
+            metrics.append(f'ext;desc="{name}";dur={seconds * 1000:.1f}')
+        metrics.append(f"total;dur={total_time * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def timed_request(name: str):
+    """Time a request to another website (e.g. for live departures)"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        if timings := current_timings.get():
+            timings.external.append((name, perf_counter() - start))
+
+
+class TimedConnectionMixin:
+    # one response per command, including each command in a pipeline
+    def read_response(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return super().read_response(*args, **kwargs)
+        finally:
+            if timings := current_timings.get():
+                timings.redis_time += perf_counter() - start
+                timings.redis_commands += 1
+
+
+class TimedConnection(TimedConnectionMixin, Connection):
+    pass
+
+
+class TimedSSLConnection(TimedConnectionMixin, SSLConnection):
+    pass
+
+
+class RedisCache(BaseRedisCache):
+    """Django's Redis cache backend, but counting hits and misses, and with
+    Redis commands (including from vehicles.utils.redis_client, which uses the
+    same connection pool) counted and timed"""
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self._options = {
+            "connection_class": (
+                TimedSSLConnection
+                if self._servers[0].startswith("rediss:")
+                else TimedConnection
+            ),
+            **self._options,
+        }
+
+    def _count(self, hits: int, misses: int):
+        if timings := current_timings.get():
+            timings.cache_hits += hits
+            timings.cache_misses += misses
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self, version)
+        if value is self:
+            self._count(0, 1)
+            return default
+        self._count(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        self._count(len(values), len(keys) - len(values))
+        return values
@@ -1,4 +1,11 @@
-from django.test import TestCase
+from unittest.mock import patch
+
+import fakeredis
+from django.test import TestCase, override_settings
+
+from accounts.models import User
+
+from .middleware import SERVER_TIMING_COOKIE
 
 
 class WhiteNoiseWithFallbackMiddlewareTest(TestCase):
@@ -17,3 +24,46 @@ class WhiteNoiseWithFallbackMiddlewareTest(TestCase):
             response.headers["cache-control"],
             "max-age=0, no-cache, no-store, must-revalidate, private",
         )
+
+
+class ServerTimingMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username="tim", is_staff=True)
+
+    def test_server_timing(self):
+        redis_client = fakeredis.FakeStrictRedis()
+
+        with (
+            patch("busstops.middleware.redis_client", redis_client),
+            patch("busstops.views.redis_client", redis_client),
+            override_settings(
+                CACHES={
+                    "default": {
+                        "BACKEND": "busstops.server_timing.RedisCache",
+                        "LOCATION": "redis://",
+                        "OPTIONS": {"connection_class": fakeredis.FakeConnection},
+                    }
+                }
+            ),
+        ):
+            response = self.client.get("/status")
+            self.assertNotIn("Server-Timing", response)
+
+            response = self.client.get("/status/timings")
+            self.assertEqual(response.status_code, 302)  # login required
+
+            self.client.force_login(self.staff)
+            response = self.client.get("/status/timings")
+            self.assertIn(SERVER_TIMING_COOKIE, response.cookies)
+            self.assertNotContains(response, "busstops.views.status")  # 1 sample
+
+            response = self.client.get("/status")
+            self.assertRegex(
+                response["Server-Timing"],
+                r'^db;desc="\d+ queries";dur=[\d.]+, redis;desc="\d+ commands";dur=[\d.]+, '
+                r'cache;desc="\d+ hits, \d+ misses", total;dur=[\d.]+$',
+            )
+
+            response = self.client.get("/status/timings")
+            self.assertContains(response, "<td>busstops.views.status</td>")
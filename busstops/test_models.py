@@ -1,3 +1,6 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 
 from accounts.models import User
@@ -106,6 +109,22 @@ class OperatorTests(TestCase):
             response.json(), {"results": [], "pagination": {"more": False}}
         )
 
+    def test_update_search_indexes(self):
+        Operator.objects.bulk_create(
+            [Operator(noc="SAND", name="Sanders Coaches", region=self.north)]
+        )
+        self.assertFalse(Operator.objects.filter(search_vector="sanders"))
+
+        stdout = StringIO()
+        with self.assertNumQueries(4):
+            call_command("update_search_indexes", stdout=stdout)
+        self.assertIn("Operator: 1 updated", stdout.getvalue())
+        self.assertTrue(Operator.objects.filter(search_vector="sanders"))
+
+        # nothing to do
+        with self.assertNumQueries(3):
+            call_command("update_search_indexes", stdout=stdout)
+
 
 class ServiceTests(TestCase):
     @classmethod
@@ -1,8 +1,6 @@
 from unittest.mock import patch
 
 import time_machine
-import vcr
-from django.conf import settings
 from django.contrib.gis.geos import Point
 from django.core import mail
 from django.shortcuts import render
@@ -16,8 +14,10 @@ from .models import (
     DataSource,
     District,
     Locality,
+    MapStop,
     Operator,
     PaymentMethod,
+    Postcode,
     Region,
     Service,
     StopPoint,
@@ -253,33 +253,32 @@ class ViewsTests(TestCase):
         )
 
     def test_postcode(self):
-        with vcr.use_cassette(
-            str(settings.BASE_DIR / "fixtures" / "vcr" / "postcode.yaml"),
-            decode_compressed_response=True,
-        ):
-            # postcode sufficiently near to fake locality
-            with self.assertNumQueries(2):
-                response = self.client.get("/search?q=w1a 1aa")
-
-            self.assertContains(response, "W1A 1AA")
-            self.assertContains(
-                response, """<a href="/map#16/51.5186/-0.1438">Map</a>"""
-            )
-            self.assertContains(response, "Melton Constable")
-            self.assertContains(response, "/localities/melton-constable")
-            self.assertNotContains(response, "results found for")
-
-            # outcode
-            with self.assertNumQueries(4):
-                response = self.client.get("/search?q=nr1")
-            self.assertContains(
-                response, """<a href="/map#16/52.6265/1.3067">Map</a>"""
-            )
+        Postcode.objects.bulk_create(
+            [
+                Postcode(id="W1A1AA", latlong=Point(-0.143799, 51.518561)),
+                Postcode(id="NR1", latlong=Point(1.3067441578354, 52.6264808917699)),
+            ]
+        )
 
-            # postcode looks valid but doesn't exist
-            with self.assertNumQueries(4):
-                response = self.client.get("/search?q=w1a 1aj")
-            self.assertNotContains(response, "Places near")
+        # postcode sufficiently near to fake locality
+        with self.assertNumQueries(3):
+            response = self.client.get("/search?q=w1a 1aa")
+
+        self.assertContains(response, "W1A 1AA")
+        self.assertContains(response, """<a href="/map#16/51.5186/-0.1438">Map</a>""")
+        self.assertContains(response, "Melton Constable")
+        self.assertContains(response, "/localities/melton-constable")
+        self.assertNotContains(response, "results found for")
+
+        # outcode
+        with self.assertNumQueries(5):
+            response = self.client.get("/search?q=nr1")
+        self.assertContains(response, """<a href="/map#16/52.6265/1.3067">Map</a>""")
+
+        # postcode looks valid but doesn't exist
+        with self.assertNumQueries(5):
+            response = self.client.get("/search?q=w1a 1aj")
+        self.assertNotContains(response, "Places near")
 
     def test_admin_area(self):
         """Admin area containing just one child should redirect to that child"""
@@ -334,6 +333,37 @@ class ViewsTests(TestCase):
         self.assertEqual("FeatureCollection", response.json()["type"])
         self.assertIn("features", response.json())
 
+    def test_stops_tile(self):
+        StopUsage.objects.create(service=self.service, stop=self.stop, order=0)
+        MapStop.objects.update_stops()
+        self.assertEqual(MapStop.objects.get().services_count, 1)
+
+        response = self.client.get("/stops/14/10597/8144.mvt")
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+        self.assertIn(b"Melton Constable", response.content)
+
+        # thinned out, but only one stop anyway
+        response = self.client.get("/stops/10/662/509.mvt")
+        self.assertIn(b"Melton Constable", response.content)
+
+        # too zoomed out
+        response = self.client.get("/stops/8/331/254.mvt")
+        self.assertEqual(response.status_code, 404)
+
+        # no longer active
+        StopPoint.objects.filter(pk=self.stop.pk).update(active=False)
+        MapStop.objects.update_stops([self.stop.atco_code])
+        self.assertFalse(MapStop.objects.exists())
+
+        StopPoint.objects.filter(pk=self.stop.pk).update(active=True)
+        MapStop.objects.update_stops()
+        self.assertTrue(MapStop.objects.exists())
+
+        # no longer served
+        StopUsage.objects.filter(stop=self.stop).delete()
+        MapStop.objects.update_stops([self.stop.atco_code])
+        self.assertFalse(MapStop.objects.exists())
+
     def test_stop_view(self):
         response = self.client.get("/stops/2900m114")
         self.assertFalse(response.context_data["departures"])
@@ -466,6 +496,54 @@ class ViewsTests(TestCase):
         self.assertEqual(response["Content-Type"], "application/json")
         self.assertEqual(response.status_code, 200)
 
+        # precomputed
+        self.service.update_map()
+        with self.assertNumQueries(1):
+            precomputed = self.client.get(f"/services/{self.service.id}.json")
+        self.assertEqual(precomputed.json()["stops"], response.json()["stops"])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f"/services/{self.service.id}.json", HTTP_ACCEPT_ENCODING="gzip"
+            )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["ETag"], precomputed["ETag"][:-1] + '-gz"')
+
+        response = self.client.get(
+            f"/services/{self.service.id}.json",
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            f"/services/{self.service.id}.json", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # stale
+        self.service.save(update_fields=["modified_at"])
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/services/{self.service.id}.json")
+        self.assertNotIn("Content-Encoding", response)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_service_map_data_cache(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/services/{self.service.id}.json")
+        with self.assertNumQueries(0):
+            cached = self.client.get(f"/services/{self.service.id}.json")
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(cached["ETag"], response["ETag"])
+
+        # the new map replaces the cached one
+        self.service.update_map()
+        with self.assertNumQueries(1):
+            precomputed = self.client.get(f"/services/{self.service.id}.json")
+        self.assertNotEqual(precomputed["ETag"], response["ETag"])
+
     def test_modes(self):
         """A list of transport modes is turned into English"""
         self.assertContains(
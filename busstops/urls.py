@@ -39,7 +39,9 @@ urlpatterns = [
     path("503", TemplateView.as_view(template_name="503.html")),
     path("data", TemplateView.as_view(template_name="data.html")),
     path("status", views.status),
+    path("status/timings", views.server_timings),
     path("timetable-source-stats.json", views.timetable_source_stats),
+    path("timetable-warm-up-stats.json", views.timetable_warm_up_stats),
     path("stats.json", views.stats),
     path(
         "ads.txt",
@@ -51,6 +53,7 @@ urlpatterns = [
     ),
     path("robots.txt", views.robots_txt),
     path("stops.json", views.stops_json),
+    path("stops/<int:z>/<int:x>/<int:y>.mvt", views.stops_tile),
     path(
         "regions/<pk>",
         cdn_cache_control(1800)(views.RegionDetailView.as_view()),
@@ -1,7 +1,159 @@
-from django.contrib.gis.geos import Polygon
+from time import time_ns
+
+from django.contrib.gis.geos import LineString, MultiLineString, Polygon
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.cache import cache
+from django.db.models import OuterRef
+
+from bustimes.models import StopTime, Trip
+
+SIMPLIFY_TOLERANCE = 0.00001  # degrees, about a metre
 
 
 def get_bounding_box(request):
     return Polygon.from_bbox(
         [request.GET[key] for key in ("xmin", "ymin", "xmax", "ymax")]
     )
+
+
+def round_coords(coords):
+    return [(round(x, 6), round(y, 6)) for x, y in coords]
+
+
+def get_service_map_data(service, stops: dict) -> dict:
+    """GeoJSON for the map on a service page -
+    some stops, and a line following the service's route"""
+
+    data = {
+        "stops": {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": stop.latlong.coords,
+                    },
+                    "properties": {
+                        "name": stop.get_qualified_name(),
+                        "indicator": stop.indicator,
+                        "bearing": stop.get_heading(),
+                        "url": stop.get_absolute_url(),
+                    },
+                }
+                for stop in stops.values()
+            ],
+        },
+        "geometry": {"type": "MultiLineString", "coordinates": []},
+    }
+
+    trips = (
+        Trip.objects.only("id")
+        .annotate(
+            stop_ids=ArraySubquery(
+                StopTime.objects.filter(trip=OuterRef("id")).values("stop")
+            ),
+        )
+        .filter(route__service=service)
+    )
+
+    route_links = {
+        (route_link.from_stop_id, route_link.to_stop_id): route_link
+        for route_link in service.routelink_set.all()
+    }
+
+    if not route_links and type(service.geometry) is MultiLineString:
+        multi_line_string = service.geometry.coords
+    else:
+        # build pairs of consecutive stops
+
+        pairs = set()
+
+        for trip in trips:
+            previous_stop_id = None
+            for stop_id in trip.stop_ids:
+                if previous_stop_id:
+                    pair = (previous_stop_id, stop_id)
+                    if pair not in pairs:
+                        pairs.add(pair)
+
+                previous_stop_id = stop_id
+
+        line_string = []
+        multi_line_string = [line_string]
+
+        previous_pair = None
+
+        for pair in pairs:
+            line_string = []
+            multi_line_string.append(line_string)
+
+            origin, destination = pair
+            if previous_pair and line_string and previous_pair[1] != origin:
+                line_string = []
+                multi_line_string.append(line_string)
+            if pair in route_links:
+                line_string += route_links[pair].geometry.coords
+            elif origin in stops and destination in stops:
+                origin = stops[origin]
+                destination = stops[destination]
+                if origin.latlong and destination.latlong:
+                    line_string += [
+                        origin.latlong.coords,
+                        destination.latlong.coords,
+                    ]
+
+            previous_pair = pair
+
+    data["geometry"]["coordinates"] = multi_line_string
+
+    return data
+
+
+def simplify_service_map_data(data: dict) -> dict:
+    """Remove redundant points from the line, and excess precision from all points"""
+
+    line_strings = [
+        LineString(coords)
+        for coords in data["geometry"]["coordinates"]
+        if len(coords) > 1
+    ]
+    if line_strings:
+        geometry = MultiLineString(line_strings).simplify(SIMPLIFY_TOLERANCE)
+        if type(geometry) is LineString:
+            geometry = MultiLineString(geometry)
+        data["geometry"]["coordinates"] = [
+            round_coords(line_string) for line_string in geometry.coords
+        ]
+
+    for feature in data["stops"]["features"]:
+        feature["geometry"]["coordinates"] = round_coords(
+            [feature["geometry"]["coordinates"]]
+        )[0]
+
+    return data
+
+
+# Generation stamps, changed whenever a table changes, so that cached responses
+# built from that table (see api.views.CachedViewSetMixin) can be recognised as stale.
+# A stamp is just the time it was last changed - if one is evicted from the cache,
+# it will be replaced with a new value that can't have been used before
+
+
+def get_generation_key(model) -> str:
+    return f"generation:{model._meta.label_lower}"
+
+
+def get_generations(*models) -> str:
+    keys = [get_generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            generations[key] = time_ns()
+            cache.add(key, generations[key], None)
+    return ":".join(str(generations[key]) for key in keys)
+
+
+def bump_generations(*models):
+    now = time_ns()
+    cache.set_many({get_generation_key(model): now for model in models}, None)
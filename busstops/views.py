@@ -2,25 +2,29 @@
 
 import csv
 import datetime
+import gzip
+import hashlib
+import json
 import os
 import sys
 import traceback
 from http import HTTPStatus
+from statistics import median, quantiles
 
-import requests
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.gis.db.models.functions import Distance
-from django.contrib.gis.geos import MultiLineString, Point
 from django.contrib.postgres.aggregates import ArrayAgg
-from django.contrib.postgres.expressions import ArraySubquery
 from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
 from django.contrib.sitemaps import Sitemap
 from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.mail import EmailMessage
 from django.core.paginator import Paginator
-from django.db.models import F, OuterRef, Prefetch, Q, When, Case, Value
-from django.db.models.functions import Coalesce, Now
+from django.db import connection
+from django.db.models import F, OuterRef, Q, When, Case, Value
+from django.db.models.functions import Coalesce
 from django.http import (
     Http404,
     HttpResponse,
@@ -32,7 +36,11 @@ from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import get_template
 from django.urls import resolve, reverse
 from django.utils import timezone
-from django.utils.cache import patch_response_headers
+from django.utils.cache import (
+    get_conditional_response,
+    patch_response_headers,
+    patch_vary_headers,
+)
 from django.utils.functional import SimpleLazyObject
 from django.views.decorators.cache import cache_control
 from django.views.generic.detail import DetailView
@@ -40,10 +48,10 @@ from redis.exceptions import ConnectionError
 from sql_util.utils import Exists, SubqueryMax, SubqueryMin
 from ukpostcodeutils import validation
 
-from buses.utils import cache_page
-from bustimes.models import StopTime, Trip
+from buses.utils import cache_page, cdn_cache_control
+from bustimes.models import StopTime
 from departures import live
-from disruptions.models import Consequence, Situation
+from disruptions.models import Situation, SituationSummary
 from fares.models import FareTable
 from vehicles.models import Vehicle
 from vehicles.utils import redis_client
@@ -63,7 +71,8 @@ from .models import (
     StopArea,
     StopPoint,
 )
-from .utils import get_bounding_box
+from .middleware import SERVER_TIMING_COOKIE
+from .utils import get_bounding_box, get_service_map_data
 
 operator_has_current_services = Exists("service", filter=Q(service__current=True))
 operator_has_current_services_or_vehicles = operator_has_current_services | Exists(
@@ -277,6 +286,8 @@ def status(request):
         ]
     ).items()
 
+    context["timetable_warm_up"] = cache.get("timetable-warm-up-stats", [])[-10:]
+
     return render(
         request,
         "status.html",
@@ -284,6 +295,53 @@ def status(request):
     )
 
 
+@staff_member_required
+def server_timings(request):
+    """Percentiles of how long each view has taken recently,
+    from the samples kept by ServerTimingMiddleware"""
+    views = []
+    if redis_client:
+        keys = sorted(
+            key.decode() for key in redis_client.smembers("server-timing-views")
+        )
+        pipeline = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.lrange(key, 0, -1)
+        for key, samples in zip(keys, pipeline.execute()):
+            if len(samples) < 2:
+                continue
+            samples = [json.loads(sample) for sample in samples]
+            times = [sample[0] for sample in samples]
+            percentiles = quantiles(times, n=100, method="inclusive")
+            views.append(
+                {
+                    "name": key.removeprefix("server-timing:"),
+                    "samples": len(samples),
+                    "p50": percentiles[49],
+                    "p90": percentiles[89],
+                    "p99": percentiles[98],
+                    "db_queries": median(sample[1] for sample in samples),
+                    "db_time": median(sample[2] for sample in samples),
+                    "redis_commands": median(sample[3] for sample in samples),
+                    "redis_time": median(sample[4] for sample in samples),
+                    "external_time": median(sample[5] for sample in samples),
+                }
+            )
+        views.sort(key=lambda view: view["p90"], reverse=True)
+
+    response = render(request, "server_timings.html", {"views": views})
+    # so that ServerTimingMiddleware will add Server-Timing headers to this
+    # browser's responses from now on
+    response.set_signed_cookie(
+        SERVER_TIMING_COOKIE,
+        "1",
+        max_age=86400 * 30,
+        httponly=True,
+        secure=request.is_secure(),
+    )
+    return response
+
+
 def stats(request):
     return JsonResponse(cache.get("vehicle-tracking-stats", []), safe=False)
 
@@ -292,6 +350,10 @@ def timetable_source_stats(request):
     return JsonResponse(cache.get("timetable-source-stats", []), safe=False)
 
 
+def timetable_warm_up_stats(request):
+    return JsonResponse(cache.get("timetable-warm-up-stats", []), safe=False)
+
+
 @cache_page(3600)
 def stops_json(request):
     """JSON endpoint accessed by the JavaScript map,
@@ -347,6 +409,51 @@ def stops_json(request):
     )
 
 
+MIN_TILE_ZOOM = 9  # below this, tiles would have too many stops to be useful
+FULL_TILE_ZOOM = 14  # at and above this, every stop is included
+TILE_GRID_CELLS = 32  # at lower zooms, one stop per cell of a 32x32 grid
+WEB_MERCATOR_WIDTH = 40075016.68557849  # metres
+
+
+@cache_control(max_age=3600)
+@cdn_cache_control(86400)
+def stops_tile(request, z, x, y):
+    """Mapbox Vector Tile of the stops served by current services, thinned out at
+    lower zoom levels by keeping the stop with the most services in each grid cell
+    """
+    if z < MIN_TILE_ZOOM or z > 22 or x >= 2**z or y >= 2**z:
+        raise Http404
+
+    stops = "SELECT * FROM busstops_mapstop WHERE point && ST_TileEnvelope(%s, %s, %s)"
+    params = [z, x, y]
+    if z < FULL_TILE_ZOOM:
+        grid_size = WEB_MERCATOR_WIDTH / 2**z / TILE_GRID_CELLS
+        stops = f"""SELECT DISTINCT ON (ST_SnapToGrid(point, %s)) * FROM ({stops}) s
+            ORDER BY ST_SnapToGrid(point, %s), services_count DESC"""
+        params = [grid_size, *params, grid_size]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""SELECT ST_AsMVT(tile, 'stops') FROM (
+                SELECT
+                    ST_AsMVTGeom(point, ST_TileEnvelope(%s, %s, %s)) AS geom,
+                    stop_id AS atco_code,
+                    name,
+                    indicator,
+                    icon,
+                    bearing,
+                    line_names AS services,
+                    stop_type,
+                    bus_stop_type
+                FROM ({stops}) stops
+            ) tile""",
+            [z, x, y, *params],
+        )
+        (tile,) = cursor.fetchone()
+
+    return HttpResponse(bytes(tile), content_type="application/vnd.mapbox-vector-tile")
+
+
 class UppercasePrimaryKeyMixin:
     """Normalises the primary key argument to uppercase"""
 
@@ -731,21 +838,8 @@ class StopPointDetailView(DetailView):
                 # stop area (if it is not an on-street pair)
                 context["breadcrumb"].append(self.object.stop_area)
 
-        consequences = Consequence.objects.filter(stops=self.object)
-        context["situations"] = (
-            Situation.objects.filter(
-                publication_window__contains=Now(),
-                consequence__stops=self.object,
-                current=True,
-            )
-            .distinct()
-            .prefetch_related(
-                Prefetch(
-                    "consequence_set", queryset=consequences, to_attr="consequences"
-                ),
-                "link_set",
-                "validityperiod_set",
-            )
+        context["situations"] = SituationSummary.objects.active(
+            f"stop:{self.object.atco_code}"
         )
 
         return context
@@ -914,7 +1008,7 @@ class OperatorDetailView(DetailView):
         ):
             try:
                 context["map"] = redis_client.exists(
-                    f"operator{self.object.noc}vehicles"
+                    f"operator{self.object.noc}vehicles:z"
                 )
             except ConnectionError:
                 pass
@@ -1116,25 +1210,9 @@ class ServiceDetailView(DetailView):
 
         # disruptions
 
-        consequences = Consequence.objects.filter(
-            Q(services=self.object) | (Q(operators__in=operators, services=None))
-        )
-        context["situations"] = (
-            Situation.objects.filter(
-                Exists(consequences.filter(situation=OuterRef("id"))),
-                publication_window__contains=Now(),
-                current=True,
-            )
-            .prefetch_related(
-                Prefetch(
-                    "consequence_set",
-                    queryset=consequences.prefetch_related("stops"),
-                    to_attr="consequences",
-                ),
-                "link_set",
-                "validityperiod_set",
-            )
-            .defer("data")
+        context["situations"] = SituationSummary.objects.active(
+            f"service:{self.object.id}",
+            *(f"operator:{operator.noc}" for operator in operators),
         )
         # stop_situations = {}
         # for situation in context["situations"]:
@@ -1315,12 +1393,36 @@ def service_timetable_csv(request, service_id):
     return response
 
 
-@cache_page(max_age=7200)
-def service_map_data(request, service_id):
+def get_service_map_data_and_etag(service_id):
     service = get_object_or_404(
-        Service.objects.only("geometry", "line_name", "service_code"),
+        Service.objects.only(
+            "geometry",
+            "line_name",
+            "service_code",
+            "modified_at",
+            "servicemap__service_modified_at",
+            "servicemap__data",
+        )
+        .select_related("servicemap")
+        .annotate(
+            has_suspended_stops=Exists(
+                Situation.objects.filter(
+                    summary="Does not stop here", consequence__services=OuterRef("id")
+                )
+            )
+        ),
         id=service_id,
     )
+
+    service_map = getattr(service, "servicemap", None)
+    if (
+        service_map
+        and service_map.service_modified_at == service.modified_at
+        and not service.has_suspended_stops
+    ):
+        # precomputed by Service.update_map after the timetable data was imported
+        return bytes(service_map.data), str(service.modified_at.timestamp())
+
     stops = service.stops.filter(
         ~Exists(
             Situation.objects.filter(
@@ -1332,90 +1434,39 @@ def service_map_data(request, service_id):
         latlong__isnull=False,
     )
     stops = stops.distinct().order_by().select_related("locality").in_bulk()
-    data = {
-        "stops": {
-            "type": "FeatureCollection",
-            "features": [
-                {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": stop.latlong.coords,
-                    },
-                    "properties": {
-                        "name": stop.get_qualified_name(),
-                        "indicator": stop.indicator,
-                        "bearing": stop.get_heading(),
-                        "url": stop.get_absolute_url(),
-                    },
-                }
-                for stop in stops.values()
-            ],
-        },
-        "geometry": {"type": "MultiLineString", "coordinates": []},
-    }
-
-    trips = (
-        Trip.objects.only("id")
-        .annotate(
-            stop_ids=ArraySubquery(
-                StopTime.objects.filter(trip=OuterRef("id")).values("stop")
-            ),
-        )
-        .filter(route__service=service)
-    )
-
-    route_links = {
-        (route_link.from_stop_id, route_link.to_stop_id): route_link
-        for route_link in service.routelink_set.all()
-    }
-
-    if not route_links and type(service.geometry) is MultiLineString:
-        multi_line_string = service.geometry.coords
-    else:
-        # build pairs of consecutive stops
 
-        pairs = set()
+    data = json.dumps(get_service_map_data(service, stops), cls=DjangoJSONEncoder)
+    data = data.encode()
+    return gzip.compress(data, mtime=0), hashlib.sha1(data).hexdigest()
 
-        for trip in trips:
-            previous_stop_id = None
-            for stop_id in trip.stop_ids:
-                if previous_stop_id:
-                    pair = (previous_stop_id, stop_id)
-                    if pair not in pairs:
-                        pairs.add(pair)
 
-                previous_stop_id = stop_id
-
-        line_string = []
-        multi_line_string = [line_string]
-
-        previous_pair = None
-
-        for pair in pairs:
-            line_string = []
-            multi_line_string.append(line_string)
-
-            origin, destination = pair
-            if previous_pair and line_string and previous_pair[1] != origin:
-                line_string = []
-                multi_line_string.append(line_string)
-            if pair in route_links:
-                line_string += route_links[pair].geometry.coords
-            elif origin in stops and destination in stops:
-                origin = stops[origin]
-                destination = stops[destination]
-                if origin.latlong and destination.latlong:
-                    line_string += [
-                        origin.latlong.coords,
-                        destination.latlong.coords,
-                    ]
-
-            previous_pair = pair
-
-    data["geometry"]["coordinates"] = multi_line_string
-
-    return JsonResponse(data)
+def service_map_data(request, service_id):
+    # cached (for as long as browsers may cache the response anyway), so that
+    # most requests need no queries at all
+    cache_key = f"service{service_id}map"
+    data_and_etag = cache.get(cache_key)
+    if data_and_etag is None:
+        data_and_etag = get_service_map_data_and_etag(service_id)
+        cache.set(cache_key, data_and_etag, 7200)
+    data, etag = data_and_etag
+
+    # the gzip-compressed and uncompressed responses are different representations
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = f'"{etag}-gz"' if gzipped else f'"{etag}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if gzipped:
+            response = HttpResponse(data, content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(
+                gzip.decompress(data), content_type="application/json"
+            )
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Accept-Encoding"])
+    patch_response_headers(response, 7200)
+    return response
 
 
 class OperatorSitemap(Sitemap):
@@ -1461,40 +1512,33 @@ def search(request):
         context["query"] = query_text
 
         postcode = "".join(query_text.split()).upper()
-        if validation.is_valid_postcode(postcode):
-            res = requests.get(
-                "https://api.postcodes.io/postcodes/" + postcode, timeout=1
-            )
-        elif validation.is_valid_partial_postcode(postcode):
-            res = requests.get(
-                "https://api.postcodes.io/outcodes/" + postcode, timeout=1
-            )
+        if validation.is_valid_postcode(postcode) or (
+            validation.is_valid_partial_postcode(postcode)
+        ):
+            postcode = Postcode.objects.filter(id=postcode).first()
         else:
             postcode = None
 
-        if postcode and res.ok:
-            result = res.json()["result"]
+        if postcode:
+            point = postcode.latlong
 
-            if result["longitude"] is not None:
-                point = Point(result["longitude"], result["latitude"], srid=4326)
-
-                context["postcode"] = {
-                    "postcode": result.get("postcode") or result.get("outcode"),
-                    "latlong": point,
-                    "localities": (
-                        Locality.objects.filter(latlong__bboverlaps=point.buffer(0.05))
-                        .filter(
-                            Q(stoppoint__active=True)
-                            | Q(locality__stoppoint__active=True)
-                        )
-                        .distinct()
-                        .annotate(distance=Distance("latlong", point))
-                        .order_by("distance")
-                        .defer("latlong")[:20]
-                    ),
-                }
+            context["postcode"] = {
+                "postcode": str(postcode),
+                "latlong": point,
+                "localities": (
+                    Locality.objects.filter(latlong__bboverlaps=point.buffer(0.05))
+                    .filter(
+                        Q(stoppoint__active=True) | Q(locality__stoppoint__active=True)
+                    )
+                    .distinct()
+                    .annotate(distance=Distance("latlong", point))
+                    .order_by("distance")
+                    .defer("latlong")[:20]
+                ),
+            }
 
-        if "postcode" not in context or not result.get("postcode"):
+        # an outcode like "NR1" might be meant as something else
+        if not postcode or len(postcode.id) <= 4:
             query = SearchQuery(query_text, search_type="websearch", config="english")
             rank = SearchRank(F("search_vector"), query)
 
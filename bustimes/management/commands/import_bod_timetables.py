@@ -15,6 +15,7 @@ from django.db import DataError
 from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
 
+from busstops.management.profiling import ProfileMixin, phase
 from busstops.models import DataSource, Operator, Service
 
 from ...download_utils import download, download_if_modified
@@ -241,7 +242,8 @@ def bus_open_data(api_key, specific_operator):
                 command.source.datetime = dataset["modified"]
 
                 with log_time_taken(logger):
-                    download(path, command.source.url)
+                    with phase("download"):
+                        download(path, command.source.url)
 
                     handle_file(command, path)
 
@@ -326,7 +328,8 @@ def ticketer(specific_operator=None):
             sleep(2)
             need_to_sleep = False
 
-        modified, last_modified = download_if_modified(path, command.source)
+        with phase("download"):
+            modified, last_modified = download_if_modified(path, command.source)
 
         if (
             specific_operator
@@ -424,7 +427,8 @@ def stagecoach(specific_operator=None):
             {"name": source.name}, url=source.url
         )
 
-        modified, last_modified = download_if_modified(path, command.source)
+        with phase("download"):
+            modified, last_modified = download_if_modified(path, command.source)
         sha1 = get_sha1(path)
 
         if command.source.datetime != last_modified:
@@ -448,7 +452,7 @@ def stagecoach(specific_operator=None):
         command.finish_services()
 
 
-class Command(BaseCommand):
+class Command(ProfileMixin, BaseCommand):
     @staticmethod
     def add_arguments(parser):
         parser.add_argument("api_key", type=str)
@@ -1,13 +1,16 @@
 import logging
+from datetime import timedelta
 from pathlib import Path
 
 import gtfs_kit
+import numpy as np
 import pandas as pd
 from shapely.errors import EmptyPartError, GEOSException
 from zipfile import BadZipFile
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django.db.models import Count, Exists, OuterRef, Q
 from django.db.models.functions import Now
 
@@ -19,6 +22,8 @@ from .import_gtfs_ember import get_calendars
 
 logger = logging.getLogger(__name__)
 
+COPY_BATCH_SIZE = 10000
+
 MODES = {
     0: "tram",
     2: "rail",
@@ -28,6 +33,29 @@ MODES = {
 }
 
 
+def get_seconds(times: pd.Series) -> pd.Series:
+    """Convert GTFS "H:MM:SS" times (which can be later than 24:00:00) to seconds"""
+    parts = times.str.extract(r"(\d+):(\d\d):(\d\d)").astype(float)
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]).astype("Int64")
+
+
+def copy_stop_times(stop_times: pd.DataFrame):
+    """Stream stop times straight into the database, serialising a batch at a time"""
+    with (
+        connection.cursor() as cursor,
+        cursor.copy(
+            f"""COPY {StopTime._meta.db_table} ({", ".join(stop_times.columns)})
+            FROM STDIN (FORMAT csv, FORCE_NOT_NULL (stop_code))"""
+        ) as copy,
+    ):
+        for start in range(0, len(stop_times), COPY_BATCH_SIZE):
+            copy.write(
+                stop_times.iloc[start : start + COPY_BATCH_SIZE].to_csv(
+                    header=False, index=False
+                )
+            )
+
+
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
@@ -195,82 +223,96 @@ class Command(BaseCommand):
 
         calendars = get_calendars(feed, source=self.source)
 
-        trips = {}
-        headsigns = {}
-
-        for line in feed.trips.itertuples():
-            route = self.routes[line.route_id]
-            trips[line.trip_id] = Trip(
-                route=route,
-                calendar=calendars[line.service_id],
-                inbound=line.direction_id == 1,
-                ticket_machine_code=line.trip_id,
-                block=getattr(line, "block_id", ""),
-                vehicle_journey_code=getattr(line, "trip_short_name", ""),
-                operator=self.route_operators[line.route_id],
+        stop_times = feed.stop_times.sort_values(["trip_id", "stop_sequence"])
+        stop_times["arrival"] = get_seconds(stop_times.arrival_time)
+        stop_times["departure"] = get_seconds(stop_times.departure_time)
+
+        # use the first and last stop times to calculate trips' start times, end times and destinations:
+
+        first = stop_times.drop_duplicates("trip_id").set_index("trip_id")
+        last = stop_times.drop_duplicates("trip_id", keep="last").set_index("trip_id")
+
+        trips = feed.trips.set_index("trip_id")
+        for column in ("block_id", "trip_short_name"):
+            if column not in trips:
+                trips[column] = ""
+        trips = trips.fillna({"block_id": "", "trip_short_name": ""})
+        trips["start"] = first.departure.fillna(first.arrival)
+        trips["end"] = last.arrival.fillna(last.departure)
+        trips["destination"] = last.stop_id[last.stop_id.isin(list(stops))]
+
+        no_stop_times = trips.start.isna()
+        for trip_id in trips.index[no_stop_times]:
+            logger.warning(f"trip {trip_id} has no stop times")
+        trips = trips[~no_stop_times]
+
+        trip_objects = [
+            Trip(
+                route=self.routes[route_id],
+                calendar=calendars[service_id],
+                inbound=direction_id == 1,
+                ticket_machine_code=trip_id,
+                block=block,
+                vehicle_journey_code=vehicle_journey_code,
+                operator=self.route_operators[route_id],
+                start=timedelta(seconds=int(start)),
+                end=timedelta(seconds=int(end)),
+                destination_id=destination if type(destination) is str else None,
             )
-
-            if pd.notna(headsign := line.trip_headsign):
-                if headsign.endswith(" -"):
-                    headsign = None
-                elif headsign.startswith("- "):
-                    headsign = headsign[2:]
-                if headsign:
-                    if line.route_id not in headsigns:
-                        headsigns[line.route_id] = {
-                            0: set(),
-                            1: set(),
-                        }
-                    headsigns[line.route_id][line.direction_id].add(headsign)
-
-        # use stop_times.txt to calculate trips' start times, end times and destinations:
-
-        trip = None
-        previous_line = None
-
-        for line in feed.stop_times.itertuples():
-            if not previous_line or previous_line.trip_id != line.trip_id:
-                if trip:
-                    trip.destination = stops.get(previous_line.stop_id)
-                    trip.end = previous_line.arrival_time
-
-                trip = trips[line.trip_id]
-                trip.start = line.departure_time
-                # if line["stop_headsign"]:
-                #     if not trip["trip_headsign"]:
-                #         trip["trip_headsign"] = line["stop_headsign"]
-
-            previous_line = line
-
-        if previous_line:
-            # last trip:
-            trip.destination = stops.get(line.stop_id)
-            trip.end = line.arrival_time
-
-        for trip_id in trips:
-            trip = trips[trip_id]
-            if trip.start is None:
-                logger.warning(f"trip {trip_id} has no stop times")
-                trips[trip_id] = None
-
-        Trip.objects.bulk_create(
-            [trip for trip in trips.values() if isinstance(trip, Trip)],
-            batch_size=1000,
-        )
+            for (
+                trip_id,
+                route_id,
+                service_id,
+                direction_id,
+                block,
+                vehicle_journey_code,
+                start,
+                end,
+                destination,
+            ) in zip(
+                trips.index,
+                trips.route_id,
+                trips.service_id,
+                trips.direction_id,
+                trips.block_id,
+                trips.trip_short_name,
+                trips.start,
+                trips.end,
+                trips.destination,
+            )
+        ]
+        Trip.objects.bulk_create(trip_objects, batch_size=1000)
+        trip_ids = pd.Series([trip.id for trip in trip_objects], index=trips.index)
 
         # headsigns - origins and destinations:
 
-        for route_id in headsigns:
+        headsigns = feed.trips[["route_id", "direction_id", "trip_headsign"]]
+        headsign = headsigns.trip_headsign
+        headsign = headsign.mask(headsign.str.endswith(" -").fillna(False))
+        headsigns = headsigns.assign(trip_headsign=headsign.str.removeprefix("- "))
+        headsigns = headsigns[headsigns.trip_headsign.fillna("") != ""]
+
+        route_headsigns = {}
+        for (route_id, direction_id), values in (
+            headsigns.groupby(["route_id", "direction_id"])
+            .trip_headsign.unique()
+            .items()
+        ):
+            if route_id not in route_headsigns:
+                route_headsigns[route_id] = {0: [], 1: []}
+            route_headsigns[route_id][direction_id] = values
+
+        for route_id in route_headsigns:
             route = self.routes[route_id]
-            origins = headsigns[route_id][1]  # inbound destinations
-            destinations = headsigns[route_id][0]  # outbound destinations
+            origins = route_headsigns[route_id][1]  # inbound destinations
+            destinations = route_headsigns[route_id][0]  # outbound destinations
             origin = ""
             destination = ""
             if len(origins) <= 1 and len(destinations) <= 1:
-                if origins:
-                    origin = list(origins)[0]
-                if destinations:
-                    destination = list(destinations)[0]
+                if len(origins):
+                    origin = origins[0]
+                if len(destinations):
+                    destination = destinations[0]
 
                 # if headsign contains ' - ' assume it's 'origin - destination', not just destination
                 if origin and " - " in origin:
@@ -298,52 +340,47 @@ class Command(BaseCommand):
                     )
                     route.service.save(update_fields=["description"])
 
-        i = 0
-        stop_times = []
+        # stop times:
 
-        for line in feed.stop_times.itertuples():
-            stop_time = StopTime(
-                arrival=line.arrival_time,
-                departure=line.departure_time,
-                sequence=line.stop_sequence,
-                trip=trips[line.trip_id],
-                timing_status="PTP" if getattr(line, "timepoint", 1) == 1 else "OTH",
-            )
-            match line.pickup_type:
-                case 0:  # Regularly scheduled pickup
-                    stop_time.pick_up = True
-                case 1:  # "No pickup available"
-                    stop_time.pick_up = False
-                case _:
-                    assert False
-            match line.drop_off_type:
-                case 0:  # Regularly scheduled drop off
-                    stop_time.set_down = True
-                case 1:  # "No drop off available"
-                    stop_time.set_down = False
-                case _:
-                    assert False
-
-            if stop := stops.get(line.stop_id):
-                stop_time.stop = stop
-            elif stop := stops_not_created.ge(line.stop_id):
-                stop_time.stop_code = stop.stop_name
-            else:
-                stop_time.stop_code = line.stop_id
-
-            if stop_time.arrival == stop_time.departure:
-                stop_time.arrival = None
+        stop_times = stop_times[stop_times.trip_id.isin(trip_ids.index)]
 
-            stop_times.append(stop_time)
+        # 0: regularly scheduled, 1: not available
+        assert stop_times.pickup_type.isin((0, 1)).all()
+        assert stop_times.drop_off_type.isin((0, 1)).all()
 
-            if i == 999:
-                StopTime.objects.bulk_create(stop_times)
-                stop_times = []
-                i = 0
-            else:
-                i += 1
-
-        StopTime.objects.bulk_create(stop_times)
+        is_stop = stop_times.stop_id.isin(list(stops))
+        stop_names = pd.Series(
+            {
+                stop_id: line.stop_name
+                for stop_id, line in stops_not_created.items()
+                if type(line.stop_name) is str
+            },
+            dtype=object,
+        )
+        arrival = stop_times.arrival
+        departure = stop_times.departure
+
+        copy_stop_times(
+            pd.DataFrame(
+                {
+                    "trip_id": stop_times.trip_id.map(trip_ids),
+                    "stop_id": stop_times.stop_id.where(is_stop),
+                    "stop_code": stop_times.stop_id.map(stop_names)
+                    .fillna(stop_times.stop_id)
+                    .where(~is_stop, ""),
+                    "arrival": arrival.mask((arrival == departure).fillna(False)),
+                    "departure": departure,
+                    "sequence": stop_times.stop_sequence,
+                    "timing_status": (
+                        np.where(stop_times.timepoint == 1, "PTP", "OTH")
+                        if "timepoint" in stop_times
+                        else "PTP"
+                    ),
+                    "pick_up": stop_times.pickup_type == 0,
+                    "set_down": stop_times.drop_off_type == 0,
+                }
+            )
+        )
 
         services = Service.objects.filter(id__in=self.services.keys())
 
@@ -7,18 +7,24 @@ Usage:
 import csv
 import datetime
 import logging
+import multiprocessing
 import os
 from pathlib import Path
 import re
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from functools import cache
 
+from django.conf import settings
+from django.contrib.gis.db.models import Extent
+from django.contrib.gis.geos import Polygon
 from django.core.management.base import BaseCommand
-from django.db import IntegrityError
-from django.db.models import Count, Exists, OuterRef, Q
+from django.db import IntegrityError, connections
+from django.db.models import Count, Exists, F, OuterRef, Q
 from django.db.models.functions import Now, Upper
 from titlecase import titlecase
 
+from busstops.management.profiling import ProfileMixin, phase
 from busstops.models import (
     DataSource,
     Operator,
@@ -28,6 +34,7 @@ from busstops.models import (
     StopPoint,
     StopUsage,
 )
+from busstops.utils import bump_generations
 from transxchange.txc import TransXChange
 from vehicles.models import get_text_colour
 from vosa.models import Registration
@@ -46,6 +53,8 @@ from ...models import (
     Trip,
     VehicleType,
 )
+from ...tasks import update_map_stops, update_service_maps, warm_up_timetables
+from ...timetables import get_stop_times_prefetch, merge_stop_usages
 
 logger = logging.getLogger(__name__)
 
@@ -190,13 +199,113 @@ def get_registration(service_code):
             pass
 
 
-class Command(BaseCommand):
+FINISH_SERVICES_BATCH_SIZE = 200
+
+
+def finish_services(service_ids):
+    """For a batch of services, update/create StopUsages and update the
+    search_vector, geometry and description fields - in a few queries for the
+    whole batch, with the same results as doing each service one at a time"""
+
+    services = Service.objects.filter(id__in=service_ids)
+    services = services.annotate(operator_count=Count("operator")).in_bulk()
+    if not services:
+        return
+
+    # stop usages
+    trips = (
+        Trip.objects.filter(route__service__in=service_ids)
+        .annotate(service_id=F("route__service"))
+        .prefetch_related(get_stop_times_prefetch())
+        .order_by("id")
+    )
+    trips_by_service = {service_id: [] for service_id in services}
+    for trip in trips:
+        trips_by_service[trip.service_id].append(trip)
+
+    existing = {service_id: [] for service_id in services}
+    for stop_usage in StopUsage.objects.filter(service__in=service_ids):
+        existing[stop_usage.service_id].append(stop_usage)
+
+    to_delete = []
+    to_create = []
+    for service_id, service in services.items():
+        outbound, inbound = merge_stop_usages(trips_by_service[service_id])
+        stop_usages = service.get_stop_usages(outbound, inbound)
+        if Service.stop_usages_changed(existing[service_id], stop_usages):
+            if existing[service_id]:
+                to_delete.append(service_id)
+            to_create += stop_usages
+    if to_delete:
+        StopUsage.objects.filter(service__in=to_delete).delete()
+    StopUsage.objects.bulk_create(to_create)
+
+    # geometry, using StopUsages
+    extents = (
+        StopUsage.objects.filter(service__in=service_ids)
+        .values_list("service")
+        .annotate(extent=Extent("stop__latlong"))
+        .order_by()
+    )
+    to_update = []
+    for service_id, extent in extents:
+        if extent:
+            services[service_id].geometry = Polygon.from_bbox(extent)
+            to_update.append(services[service_id])
+    Service.objects.bulk_update(to_update, ["geometry"])
+
+    # description, using routes
+    routes_by_service = {service_id: [] for service_id in services}
+    for route in Route.objects.filter(service__in=service_ids).order_by("id"):
+        routes_by_service[route.service_id].append(route)
+    to_update = []
+    for service_id, service in services.items():
+        description = service.get_new_description(routes_by_service[service_id])
+        if description:
+            service.description = description
+            to_update.append(service)
+    Service.objects.bulk_update(to_update, ["description"])
+
+    # operators, for services with more than one
+    multi_operator = [
+        service_id
+        for service_id, service in services.items()
+        if service.operator_count > 1
+    ]
+    if multi_operator:
+        operators = {service_id: set() for service_id in multi_operator}
+        for service_id, operator_id in (
+            Trip.objects.filter(
+                route__service__in=multi_operator, operator__isnull=False
+            )
+            .values_list("route__service", "operator")
+            .distinct()
+        ):
+            operators[service_id].add(operator_id)
+        current = {service_id: set() for service_id in multi_operator}
+        for service_id, operator_id in Service.operator.through.objects.filter(
+            service__in=multi_operator
+        ).values_list("service", "operator"):
+            current[service_id].add(operator_id)
+        for service_id in multi_operator:
+            if operators[service_id] and operators[service_id] != current[service_id]:
+                services[service_id].operator.set(operators[service_id])
+
+    # using StopUsages and operators
+    Service.objects.update_search_vectors(service_ids)
+
+    Service.objects.filter(id__in=service_ids).update(modified_at=Now())
+
+
+class Command(ProfileMixin, BaseCommand):
     bank_holidays = None
+    workers = 1  # processes for finish_services
 
     @staticmethod
     def add_arguments(parser):
         parser.add_argument("archives", nargs=1, type=str)
         parser.add_argument("files", nargs="*", type=str)
+        parser.add_argument("--workers", type=int, default=1)
 
     def set_up(self):
         self.service_descriptions = {}
@@ -207,6 +316,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         self.set_up()
+        self.workers = options["workers"]
 
         self.open_data_operators, self.incomplete_operators = get_open_data_operators()
 
@@ -339,6 +449,7 @@ class Command(BaseCommand):
         inbound = self.service_descriptions.get(f"{key}I", "")
         return outbound, inbound
 
+    @phase("post-process")
     def mark_old_services_as_not_current(self):
         old_routes = self.source.route_set.filter(
             ~Q(id__in=self.route_ids)
@@ -442,31 +553,34 @@ class Command(BaseCommand):
             )
             client.upload_file(archive_path, "bustimes-data", "TNDS/" + basename)
 
+    @phase("post-process")
     def finish_services(self):
         """update/create StopUsages, search_vector and geometry fields"""
 
-        services = Service.objects.filter(id__in=self.service_ids)
-        services = services.annotate(operator_count=Count("operator"))
-
-        for service in services:
-            service.do_stop_usages()
-
-            # using StopUsages
-            service.update_search_vector()
-
-            # using routes
-            service.update_geometry()
-
-            service.update_description()
+        service_ids = sorted(self.service_ids)
+        batches = [
+            service_ids[i : i + FINISH_SERVICES_BATCH_SIZE]
+            for i in range(0, len(service_ids), FINISH_SERVICES_BATCH_SIZE)
+        ]
+        if self.workers > 1 and len(batches) > 1:
+            # each process will open its own database connection
+            connections.close_all()
+            with ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                list(executor.map(finish_services, batches))
+        else:
+            for batch in batches:
+                finish_services(batch)
 
-            if service.operator_count > 1:
-                operators = Operator.objects.filter(
-                    trip__route__service=service
-                ).distinct()
-                if operators and list(operators) != list(service.operator.all()):
-                    service.operator.set(operators)
+        if self.service_ids:
+            bump_generations(Service)
 
-        services.update(modified_at=Now())
+        if self.service_ids and not settings.TEST:
+            # render the new timetables and maps in the background
+            warm_up_timetables(list(self.service_ids))
+            update_service_maps(list(self.service_ids))
+            update_map_stops(list(self.service_ids))
 
     def get_bank_holiday(self, bank_holiday_name: str):
         if self.bank_holidays is None:
@@ -1482,7 +1596,8 @@ class Command(BaseCommand):
                 self.garages[garage_code] = garage
 
     def handle_file(self, open_file, filename: str):
-        transxchange = TransXChange(open_file)
+        with phase("parse"):
+            transxchange = TransXChange(open_file)
 
         if not transxchange.journeys:
             logger.warning(f"{filename or open_file} has no journeys")
@@ -1492,9 +1607,11 @@ class Command(BaseCommand):
 
         today = self.source.datetime.date()
 
-        stops = self.do_stops(transxchange.stops)
+        with phase("lookup"):
+            stops = self.do_stops(transxchange.stops)
 
-        self.do_garages(transxchange.garages)
+            self.do_garages(transxchange.garages)
 
-        for txc_service in transxchange.services.values():
-            self.handle_service(filename, transxchange, txc_service, today, stops)
+        with phase("write"):
+            for txc_service in transxchange.services.values():
+                self.handle_service(filename, transxchange, txc_service, today, stops)
@@ -0,0 +1,131 @@
+import logging
+from time import perf_counter
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils import timezone
+from huey import crontab
+from huey.contrib.djhuey import db_periodic_task, db_task
+
+from busstops.forms import TimetableForm
+from busstops.models import MapStop, Service, StopPoint
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_DAYS = 3  # dates to render, after the default timetable
+WARM_UP_TIMEOUT = 90000  # 25 hours - until after the next midnight warm-up
+WARM_UP_BATCH_SIZE = 100  # services per task
+
+
+def warm_up_timetable(service):
+    """Render a service's default timetable, and the timetables for the next few
+    dates, into the same fragment cache used by the service page"""
+
+    template = get_template("timetable.html")
+    related = service.get_similar_services()
+
+    form = TimetableForm(None, service=service, related=related)
+    timetable = form.get_timetable(service)
+    if not timetable:
+        return
+    context = {
+        "object": service,
+        "timetable": timetable,
+        "related": related,
+        "form": form,
+        "timetable_cache_timeout": WARM_UP_TIMEOUT,
+    }
+    template.render(context)
+
+    date_options = getattr(timetable, "date_options", None)
+    if not date_options:
+        return  # no date picker on the page
+
+    # as submitted by the date picker
+    data = {}
+    if "service" in form.fields:
+        data["service"] = form.fields["service"].initial
+
+    for date in date_options[:WARM_UP_DAYS]:
+        data["date"] = date
+        form = TimetableForm(data, service=service, related=related)
+        context["form"] = form
+        context["timetable"] = form.get_timetable(service)
+        template.render(context)
+
+
+@db_task()
+def warm_up_timetables(service_ids):
+    services = (
+        Service.objects.with_line_names()
+        .filter(id__in=service_ids, current=True, timetable_wrong=False)
+        .select_related("source")
+        .defer("geometry", "search_vector")
+    )
+
+    start = perf_counter()
+    timings = []
+
+    for service in services:
+        service_start = perf_counter()
+        try:
+            warm_up_timetable(service)
+        except Exception as e:
+            logger.exception(e)
+            continue
+        timings.append((service.id, perf_counter() - service_start))
+
+    total = perf_counter() - start
+    if not timings:
+        return
+
+    logger.info(f"warmed up {len(timings)} timetables in {total:.1f}s")
+
+    timings.sort(key=lambda item: item[1], reverse=True)
+    stats = {
+        "datetime": timezone.now(),
+        "services": len(timings),
+        "total": total,
+        "mean": sum(seconds for _, seconds in timings) / len(timings),
+        "slowest": timings[:10],
+    }
+
+    history = cache.get("timetable-warm-up-stats", [])
+    history = history[-99:]
+    history.append(stats)
+
+    cache.set("timetable-warm-up-stats", history, None)
+
+
+@db_periodic_task(crontab(minute=1, hour=0))
+def warm_up_all_timetables():
+    # the default date (and so the default timetable) changes at midnight
+    # in batches, to be shared between the workers
+    service_ids = Service.objects.filter(current=True, timetable_wrong=False)
+    service_ids = list(service_ids.order_by("id").values_list("id", flat=True))
+    for i in range(0, len(service_ids), WARM_UP_BATCH_SIZE):
+        warm_up_timetables(service_ids[i : i + WARM_UP_BATCH_SIZE])
+
+
+@db_task()
+def update_service_maps(service_ids):
+    services = Service.objects.filter(id__in=service_ids, current=True).only(
+        "geometry", "line_name", "service_code", "modified_at"
+    )
+    for service in services:
+        try:
+            service.update_map()
+        except Exception as e:
+            logger.exception(e)
+
+
+@db_task()
+def update_map_stops(service_ids):
+    stops = StopPoint.objects.filter(service__in=service_ids).distinct()
+    MapStop.objects.update_stops(list(stops.values_list("atco_code", flat=True)))
+
+
+@db_periodic_task(crontab(minute=30, hour=0))
+def update_all_map_stops():
+    # catch stops no longer served by a service, and changes to NaPTAN data
+    MapStop.objects.update_stops()
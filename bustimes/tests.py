@@ -1,13 +1,20 @@
 import os
 from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
 
-from django.test import TestCase
+import fakeredis
+import time_machine
+from django.http import QueryDict
+from django.test import TestCase, override_settings
 from vcr import use_cassette
 
+from busstops.forms import TimetableForm
 from busstops.models import DataSource, Service
 from vehicles.models import Livery, Vehicle, VehicleCode
 
+from . import tasks
 from .models import Calendar, CalendarDate, Garage, Route, StopTime, Trip
+from .timetables import get_windows
 from .utils import get_routes
 
 
@@ -395,3 +402,116 @@ class BusTimesTest(TestCase):
         self.assertEqual(str(garage), "Lowestoft Town")
         garage.name = "LOW"
         self.assertEqual(str(garage), "LOW")
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://",
+            "OPTIONS": {"connection_class": fakeredis.FakeConnection},
+        }
+    }
+)
+@time_machine.travel("2023-10-20", tick=False)
+class WarmUpTimetablesTest(TestCase):
+    def test_warm_up_timetables(self):
+        source = DataSource.objects.create(name="Top Mops Limited")
+        service = Service.objects.create(source=source, slug="31", line_name="31")
+        route = Route.objects.create(source=source, service=service, line_name="31")
+        calendar = Calendar.objects.create(
+            mon=True,
+            tue=True,
+            wed=True,
+            thu=True,
+            fri=True,
+            sat=False,
+            sun=False,
+            start_date=date(2023, 10, 1),
+        )
+        trip = Trip.objects.create(
+            route=route, calendar=calendar, start="09:00", end="09:30"
+        )
+        StopTime.objects.create(trip=trip, arrival="09:00", stop_code="a")
+        StopTime.objects.create(trip=trip, arrival="09:30", stop_code="b")
+
+        with self.assertLogs("bustimes.tasks") as logs:
+            tasks.warm_up_timetables([service.id])
+        self.assertEqual(logs.output[0][:33], "INFO:bustimes.tasks:warmed up 1 t")
+
+        response = self.client.get("/timetable-warm-up-stats.json")
+        stats = response.json()
+        self.assertEqual(stats[0]["services"], 1)
+        self.assertEqual(stats[0]["slowest"][0][0], service.id)
+
+        response = self.client.get(f"/services/{service.id}/timetable")
+        self.assertContains(response, "09:00")
+
+    def test_warm_up_all_timetables(self):
+        services = [
+            Service.objects.create(line_name=str(i), current=True) for i in range(3)
+        ]
+        Service.objects.create(line_name="4", current=True, timetable_wrong=True)
+
+        with (
+            patch("bustimes.tasks.WARM_UP_BATCH_SIZE", 2),
+            patch("bustimes.tasks.warm_up_timetables") as warm_up_timetables,
+        ):
+            tasks.warm_up_all_timetables.call_local()
+
+        self.assertEqual(
+            [call.args[0] for call in warm_up_timetables.call_args_list],
+            [[services[0].id, services[1].id], [services[2].id]],
+        )
+
+
+class TimetableWindowTest(TestCase):
+    def test_get_windows(self):
+        self.assertEqual(
+            get_windows(
+                [
+                    timedelta(hours=6, minutes=30),
+                    timedelta(hours=7),
+                    timedelta(hours=10),
+                    timedelta(hours=25),
+                ]
+            ),
+            [6, 9, 24],
+        )
+
+    def test_windowed_timetable(self):
+        source = DataSource.objects.create(name="London")
+        service = Service.objects.create(line_name="25")
+        route = Route.objects.create(source=source, service=service, line_name="25")
+        for start in ("06:00", "07:00", "10:00", "13:00"):
+            trip = Trip.objects.create(route=route, start=start, end=start)
+            StopTime.objects.create(trip=trip, departure=start, stop_code="a")
+            StopTime.objects.create(trip=trip, arrival=start, stop_code="b")
+
+        timetable = service.get_timetable(date(2023, 10, 20)).render()
+        self.assertIsNone(timetable.window)
+        self.assertEqual(len(timetable.groupings[0].trips), 4)
+
+        with patch("bustimes.timetables.MAX_TRIPS", 2):
+            timetable = service.get_timetable(date(2023, 10, 20)).render()
+            self.assertEqual(timetable.windows, [6, 9, 12])
+            self.assertEqual(
+                [str(trip) for trip in timetable.groupings[0].trips],
+                ["06:00", "07:00"],
+            )
+
+            timetable = service.get_timetable(date(2023, 10, 20), hour=9).render()
+            self.assertEqual(
+                [str(trip) for trip in timetable.groupings[0].trips], ["10:00"]
+            )
+            self.assertEqual(
+                list(timetable.get_window_options()),
+                [(6, "06:00", False), (9, "09:00", True), (12, "12:00", False)],
+            )
+
+        form = TimetableForm(
+            QueryDict("date=2023-10-20&detailed=on&hour=9"), service=service, related=[]
+        )
+        self.assertEqual(
+            form.get_window_query(12), "date=2023-10-20&detailed=on&hour=12"
+        )
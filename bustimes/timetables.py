@@ -6,7 +6,7 @@ from functools import cached_property, cmp_to_key, partial
 
 from django.conf import settings
 from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Prefetch, Q
+from django.db.models import Prefetch, Q, prefetch_related_objects
 from django.utils.html import format_html
 from django.utils.timezone import localdate
 from sql_util.utils import Exists
@@ -17,19 +17,40 @@ from .utils import get_calendars, get_descriptions, get_routes
 
 differ = Differ(charjunk=lambda _: True)
 
+MAX_TRIPS = 1500  # more than this, and only show a window of a few hours
+WINDOW_HOURS = 3
+MAX_TOPOLOGICAL_SORT_TRIPS = 250  # more than this, and use a comparison sort
 
-def get_stop_usages(trips):
-    groupings = [[], []]
 
-    trips = trips.prefetch_related(
-        Prefetch(
-            "stoptime_set",
-            queryset=StopTime.objects.filter(stop__isnull=False).order_by(
-                "trip_id", "id"
-            ),
-        )
+def get_windows(starts) -> list:
+    """Given some trip start times, return the start hours of windows of
+    WINDOW_HOURS hours containing at least one trip"""
+    hours = {int(start.total_seconds() // 3600) for start in starts}
+    first = min(hours)
+    return sorted(
+        {first + (hour - first) // WINDOW_HOURS * WINDOW_HOURS for hour in hours}
     )
 
+
+def get_stop_times_prefetch():
+    return Prefetch(
+        "stoptime_set",
+        queryset=StopTime.objects.filter(stop__isnull=False).order_by("trip_id", "id"),
+    )
+
+
+def get_stop_usages(trips):
+    trips = trips.prefetch_related(get_stop_times_prefetch())
+
+    return merge_stop_usages(trips)
+
+
+def merge_stop_usages(trips):
+    """Given some trips (with stop times prefetched),
+    return lists of outbound and inbound stop times in a sensible order"""
+
+    groupings = [[], []]
+
     for trip in trips:
         if trip.inbound:
             grouping_id = 1
@@ -81,19 +102,20 @@ def get_stop_usages(trips):
     return groupings
 
 
-def compare_trips(rows, trip_ids, a, b):
+def compare_trips(rows, row_indices, trip_indices, a, b):
     a_time = None
     b_time = None
 
-    a_top = rows.index(a.top)
-    a_bottom = rows.index(a.bottom)
-    b_top = rows.index(b.top)
-    b_bottom = rows.index(b.bottom)
+    a_top = row_indices[a.top]
+    a_bottom = row_indices[a.bottom]
+    b_top = row_indices[b.top]
+    b_bottom = row_indices[b.bottom]
 
-    a_index = trip_ids.index(a.id)
-    b_index = trip_ids.index(b.id)
+    a_index = trip_indices[a.id]
+    b_index = trip_indices[b.id]
 
-    for row in rows[max(a_top, b_top) : min(a_bottom, b_bottom) + 1]:
+    for y in range(max(a_top, b_top), min(a_bottom, b_bottom) + 1):
+        row = rows[y]
         if row.times[a_index] and row.times[b_index]:
             a_time = row.times[a_index].departure_or_arrival()
             b_time = row.times[b_index].departure_or_arrival()
@@ -116,11 +138,24 @@ def compare_trips(rows, trip_ids, a, b):
 
 
 class Timetable:
-    def __init__(self, routes, date, calendar_id=None, detailed=False, operators=None):
+    def __init__(
+        self,
+        routes,
+        date,
+        calendar_id=None,
+        detailed=False,
+        operators=None,
+        hour=None,
+    ):
         self.today = localdate()
 
         self.operators = operators
 
+        # for services with very many trips
+        self.hour = hour
+        self.window = None  # (start, end) timedeltas
+        self.windows = None  # start hours of windows, for navigation
+
         routes = list(routes.order_by("id").select_related("source"))
         self.routes = self.current_routes = routes
         # self.current_routes is a subset of self.routes
@@ -248,7 +283,29 @@ class Timetable:
         elif self.calendar_options:
             trips = trips.filter(calendar=self.calendar)
 
-        trips = trips.prefetch_related(
+        if self.detailed:
+            trips = trips.select_related("garage", "vehicle_type")
+
+        if self.hour is not None:
+            # only fetch trips in the requested window (using the route/start index)
+            starts = trips.values_list("start", flat=True)
+            if len(starts) > MAX_TRIPS:
+                self.set_window(starts)
+                trips = trips.filter(
+                    start__gte=self.window[0], start__lt=self.window[1]
+                )
+
+        trips = list(trips)
+
+        if self.window is None and len(trips) > MAX_TRIPS:
+            self.set_window([trip.start for trip in trips])
+            trips = [
+                trip for trip in trips if self.window[0] <= trip.start < self.window[1]
+            ]
+
+        # only now fetch stop times, for the trips we're going to show
+        prefetch_related_objects(
+            trips,
             Prefetch(
                 "stoptime_set",
                 queryset=StopTime.objects.annotate(note_ids=ArrayAgg("notes"))
@@ -261,13 +318,6 @@ class Timetable:
             ),
         )
 
-        if self.detailed:
-            trips = trips.select_related("garage", "vehicle_type")
-
-        if len(trips) > 1500:
-            self.date = None
-            return
-
         routes = {route.id: route for route in self.current_routes}
 
         for trip in trips:
@@ -348,6 +398,26 @@ class Timetable:
 
         return self
 
+    def set_window(self, starts):
+        self.windows = get_windows(starts)
+        if self.hour is None:
+            hour = self.windows[0]
+        else:
+            hour = self.hour
+        self.window = (
+            datetime.timedelta(hours=hour),
+            datetime.timedelta(hours=hour + WINDOW_HOURS),
+        )
+
+    def get_window_options(self):
+        for hour in self.windows:
+            start = datetime.timedelta(hours=hour)
+            yield (
+                hour,
+                format_timedelta(start),
+                start == self.window[0],
+            )
+
     def any_trip_has(self, attr: str) -> bool:
         for grouping in self.groupings:
             for trip in grouping.trips:
@@ -697,40 +767,55 @@ class Grouping:
 
     def sort_columns(self):
         rows = self.rows
-
-        sorter = graphlib.TopologicalSorter()
-        for a_index, a in enumerate(self.trips):
-            a_top = rows.index(a.top)
-            a_bottom = rows.index(a.bottom)
-
-            for b_index, b in enumerate(self.trips):
-                if a_index == b_index:
-                    continue
-
-                b_top = rows.index(b.top)
-                b_bottom = rows.index(b.bottom)
-
-                for row in rows[max(a_top, b_top) : min(a_bottom, b_bottom) + 1]:
-                    if row.times[a_index] and row.times[b_index]:
-                        a_time = row.times[a_index].departure_or_arrival()
-                        b_time = row.times[b_index].departure_or_arrival()
-                        if a_time > b_time:  # a after b
-                            sorter.add(a.id, b.id)
-                        elif a_time < b_time:  # a before b
-                            sorter.add(b.id, a.id)
-                        elif b.top is a.bottom:
-                            sorter.add(b.id, a.id)
-                        break
-
-        trip_ids = [trip.id for trip in self.trips]
-        try:
-            indices = [trip_ids.index(trip_id) for trip_id in sorter.static_order()]
-            assert len(trip_ids) == len(indices)
-            self.trips = [self.trips[i] for i in indices]
-        except (graphlib.CycleError, AssertionError):
-            self.trips.sort(key=cmp_to_key(partial(compare_trips, self.rows, trip_ids)))
-            new_trip_ids = [trip.id for trip in self.trips]
-            indices = [trip_ids.index(trip_id) for trip_id in new_trip_ids]
+        trips = self.trips
+
+        # precompute positions, to avoid lots of list.index() calls
+        row_indices = {row: y for y, row in enumerate(rows)}
+        trip_indices = {}
+        for i, trip in enumerate(trips):
+            trip_indices.setdefault(trip.id, i)
+        tops = [row_indices[trip.top] for trip in trips]
+        bottoms = [row_indices[trip.bottom] for trip in trips]
+
+        indices = None
+
+        # comparing every pair of trips would be too slow if there are lots
+        if len(trips) <= MAX_TOPOLOGICAL_SORT_TRIPS:
+            sorter = graphlib.TopologicalSorter()
+            for a_index, a in enumerate(trips):
+                a_top = tops[a_index]
+                a_bottom = bottoms[a_index]
+
+                for b_index, b in enumerate(trips):
+                    if a_index == b_index:
+                        continue
+
+                    for y in range(
+                        max(a_top, tops[b_index]), min(a_bottom, bottoms[b_index]) + 1
+                    ):
+                        row = rows[y]
+                        if row.times[a_index] and row.times[b_index]:
+                            a_time = row.times[a_index].departure_or_arrival()
+                            b_time = row.times[b_index].departure_or_arrival()
+                            if a_time > b_time:  # a after b
+                                sorter.add(a.id, b.id)
+                            elif a_time < b_time:  # a before b
+                                sorter.add(b.id, a.id)
+                            elif b.top is a.bottom:
+                                sorter.add(b.id, a.id)
+                            break
+
+            try:
+                indices = [trip_indices[trip_id] for trip_id in sorter.static_order()]
+                assert len(trips) == len(indices)
+            except (graphlib.CycleError, AssertionError):
+                indices = None
+
+        if indices is None:
+            key = cmp_to_key(partial(compare_trips, rows, row_indices, trip_indices))
+            indices = sorted(range(len(trips)), key=lambda i: key(trips[i]))
+
+        self.trips = [trips[i] for i in indices]
 
         for row in rows:
             # reassemble in order
@@ -1,6 +1,6 @@
 import json
 
-from vehicles.utils import redis_client
+from vehicles.utils import get_recent_vehicle_ids, redis_client
 
 
 def get_tracking(stop, services):
@@ -8,15 +8,17 @@ def get_tracking(stop, services):
         return
 
     set_names = [
-        f"service{service.pk}vehicles" for service in services if service.tracking
+        f"service{service.pk}vehicles:z" for service in services if service.tracking
     ]
     if not set_names:
         return
 
-    vehicle_ids = list(redis_client.sunion(set_names))
+    vehicle_ids = get_recent_vehicle_ids(redis_client, set_names)
+    if not vehicle_ids:
+        return []
 
     vehicle_locations = redis_client.mget(
-        [f"vehicle{int(vehicle_id)}" for vehicle_id in vehicle_ids]
+        [f"vehicle{vehicle_id}" for vehicle_id in vehicle_ids]
     )
     vehicle_locations = [json.loads(item) for item in vehicle_locations if item]
 
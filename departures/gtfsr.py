@@ -7,6 +7,7 @@ from django.core.cache import cache
 from google.protobuf import json_format
 from google.transit import gtfs_realtime_pb2
 
+from busstops.server_timing import timed_request
 from bustimes.formatting import format_timedelta
 from vehicles.utils import redis_client
 
@@ -16,9 +17,10 @@ def _get_feed():
         if not redis_client.set("ntaie_lock", 1, ex=60, nx=True):
             return
         url = "https://api.nationaltransport.ie/gtfsr/v2/TripUpdates"
-        response = requests.get(
-            url, headers={"x-api-key": settings.NTA_API_KEY}, timeout=10
-        )
+        with timed_request("NTA GTFS-R"):
+            response = requests.get(
+                url, headers={"x-api-key": settings.NTA_API_KEY}, timeout=10
+            )
         if response.ok:
             feed = gtfs_realtime_pb2.FeedMessage()
             feed.ParseFromString(response.content)
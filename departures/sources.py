@@ -12,6 +12,7 @@ from django.core.cache import cache
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from busstops.server_timing import timed_request
 from bustimes.utils import get_stop_times
 from vehicles.models import Vehicle
 
@@ -133,7 +134,8 @@ class RemoteDepartures(Departures):
 
         if not response:
             try:
-                response = self.get_response()
+                with timed_request(self.__class__.__name__):
+                    response = self.get_response()
             except requests.exceptions.ReadTimeout:
                 self.set_poorly(60)  # back off for 1 minute
                 return
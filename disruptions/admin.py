@@ -1,7 +1,7 @@
 from django.contrib import admin
 from sql_util.utils import SubqueryCount
 
-from .models import Consequence, Link, Situation, ValidityPeriod
+from .models import Consequence, Link, Situation, SituationSummary, ValidityPeriod
 
 
 class ConsequenceInline(admin.StackedInline):
@@ -48,3 +48,18 @@ class SituationAdmin(admin.ModelAdmin):
         if "changelist" in request.resolver_match.view_name:
             queryset = queryset.annotate(stops=SubqueryCount("consequence__stops"))
         return queryset
+
+    # the importers keep the summaries shown on stop and service pages up to date,
+    # but not for situations entered or edited here
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        SituationSummary.objects.update_situations([form.instance.id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        SituationSummary.objects.update_situations([])
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        SituationSummary.objects.update_situations([])
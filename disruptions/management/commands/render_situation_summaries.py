@@ -0,0 +1,27 @@
+"""Render the summaries shown on stop and service pages for all current situations -
+including ones entered in the admin, which the importers never touch.
+
+Run after deploying the SituationSummary table, or after changing the
+situation_summary.html template:
+
+    ./manage.py render_situation_summaries
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Now
+
+from ...models import Situation, SituationSummary
+
+
+class Command(BaseCommand):
+    def handle(self, **options):
+        situation_ids = list(
+            Situation.objects.filter(current=True)
+            .exclude(publication_window__endswith__lt=Now())
+            .values_list("id", flat=True)
+        )
+        SituationSummary.objects.update_situations(situation_ids)
+        self.stdout.write(
+            f"{SituationSummary.objects.count()} summaries"
+            f" of {len(situation_ids)} situations"
+        )
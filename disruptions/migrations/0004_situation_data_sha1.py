@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disruptions', '0003_alter_situation_created_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='situation',
+            name='data_sha1',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-19 15:20
+
+import django.contrib.postgres.fields.ranges
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disruptions', '0004_situation_data_sha1'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SituationSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=64)),
+                ('publication_window', django.contrib.postgres.fields.ranges.DateTimeRangeField()),
+                ('summary', models.CharField(blank=True, max_length=255)),
+                ('expanded', models.BooleanField(default=False)),
+                ('html', models.TextField()),
+                ('situation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='disruptions.situation')),
+            ],
+        ),
+    ]
@@ -1,5 +1,10 @@
+from collections import defaultdict
+
 from django.contrib.postgres.fields import DateTimeRangeField
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Now
+from django.template import engines
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import camel_case_to_spaces
@@ -30,6 +35,7 @@ class Situation(models.Model):
     participant_ref = models.CharField(max_length=36, blank=True)
     text = models.TextField(blank=True)
     data = models.TextField(blank=True)
+    data_sha1 = models.CharField(max_length=40, blank=True)
     created = models.DateTimeField(auto_now_add=True)
     publication_window = DateTimeRangeField(default=from_now)
     current = models.BooleanField(default=True)
@@ -128,3 +134,111 @@ class Consequence(models.Model):
         if service:
             return service.get_absolute_url()
         return ""
+
+
+class SituationSummaryManager(models.Manager):
+    def active(self, *keys):
+        """Summaries of situations currently affecting any of the given keys -
+        one per situation, the most specific if there's more than one (a service's
+        consequences rather than the operator-wide ones)"""
+        return (
+            self.filter(key__in=keys, publication_window__contains=Now())
+            .order_by(
+                "situation_id",
+                models.Case(
+                    models.When(key__startswith="service:", then=0),
+                    models.When(key__startswith="stop:", then=1),
+                    default=2,
+                ),
+            )
+            .distinct("situation_id")
+        )
+
+    def update_situations(self, situation_ids):
+        """Delete summaries of situations that have ended or been withdrawn,
+        and render new summaries of the given (new or changed) situations"""
+        self.filter(
+            Q(situation__current=False) | Q(publication_window__endswith__lt=Now())
+        ).delete()
+
+        if not situation_ids:
+            return
+        self.filter(situation__in=situation_ids).delete()
+
+        situations = (
+            Situation.objects.filter(id__in=situation_ids, current=True)
+            .exclude(summary="Does not stop here")
+            .prefetch_related(
+                models.Prefetch("consequence_set", to_attr="consequences"),
+                "link_set",
+                "validityperiod_set",
+            )
+        )
+
+        consequences = Consequence.objects.filter(situation__in=situation_ids)
+        stops = defaultdict(list)
+        for consequence_id, stop_id in Consequence.stops.through.objects.filter(
+            consequence__in=consequences
+        ).values_list("consequence", "stoppoint"):
+            stops[consequence_id].append(f"stop:{stop_id}")
+        services = defaultdict(list)
+        for consequence_id, service_id in Consequence.services.through.objects.filter(
+            consequence__in=consequences
+        ).values_list("consequence", "service"):
+            services[consequence_id].append(f"service:{service_id}")
+        operators = defaultdict(list)
+        for consequence_id, noc in Consequence.operators.through.objects.filter(
+            consequence__in=consequences
+        ).values_list("consequence", "operator"):
+            operators[consequence_id].append(f"operator:{noc}")
+
+        template = engines["jinja2"].get_template("situation_summary.html")
+
+        summaries = []
+        for situation in situations:
+            keys = defaultdict(list)
+            for consequence in situation.consequences:
+                for key in stops[consequence.id] + (
+                    # operator-wide consequences only apply to services without their own
+                    services[consequence.id] or operators[consequence.id]
+                ):
+                    keys[key].append(consequence)
+
+            rendered = {}  # the same consequences often affect many stops
+            for key, consequences in keys.items():
+                consequence_ids = tuple(consequence.id for consequence in consequences)
+                if consequence_ids not in rendered:
+                    rendered[consequence_ids] = template.render(
+                        {"situation": situation, "consequences": consequences}
+                    )
+                summaries.append(
+                    SituationSummary(
+                        key=key,
+                        situation=situation,
+                        publication_window=situation.publication_window,
+                        summary=situation.summary,
+                        expanded=len(situation.text) < 100,
+                        html=rendered[consequence_ids],
+                    )
+                )
+
+        self.bulk_create(summaries, batch_size=1000)
+
+
+class SituationSummary(models.Model):
+    """A situation pre-rendered for the page of a stop ("stop:<ATCO code>"),
+    service ("service:<id>") or operator ("operator:<NOC>") that it affects,
+    maintained by the importers so the page can show it with one query
+    """
+
+    key = models.CharField(max_length=64, db_index=True)
+    situation = models.ForeignKey(Situation, models.CASCADE)
+    publication_window = DateTimeRangeField()
+    summary = models.CharField(max_length=255, blank=True)
+    expanded = models.BooleanField(default=False)
+    html = models.TextField()
+
+    objects = SituationSummaryManager()
+
+    def __str__(self):
+        return self.key
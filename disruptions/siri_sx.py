@@ -7,11 +7,12 @@ from django.db.models import Q
 import io
 import xml.etree.cElementTree as ET
 import zipfile
+from hashlib import sha1
 
 import requests
 
 from busstops.models import DataSource, Operator, Service, StopPoint
-from .models import Consequence, Link, Situation, ValidityPeriod
+from .models import Consequence, Link, Situation, SituationSummary, ValidityPeriod
 
 
 logger = logging.getLogger(__name__)
@@ -30,31 +31,29 @@ def get_operators(operator_ref):
     )
 
 
-def handle_item(item, source):
+def handle_item(item, source, existing):
+    """Returns a Situation and its (unsaved) links, validity periods and consequences,
+    or just the Situation if it hasn't changed since last time
+    """
     situation_number = item.findtext("SituationNumber")
 
     item.find("Source/TimeOfCommunication").text = None
 
     xml = ET.tostring(item, encoding="unicode")
+    data_sha1 = sha1(xml.encode()).hexdigest()
 
-    created_time = parse_datetime(item.find("CreationTime").text)
+    situation = existing.get(situation_number)
+    if situation and situation.data_sha1 == data_sha1:
+        return situation, None  # hasn't changed
+    if not situation:
+        situation = Situation(source=source, situation_number=situation_number)
+        # in case the same situation appears again later in the feed
+        existing[situation_number] = situation
 
-    try:
-        situation = Situation.objects.get(
-            source=source, situation_number=situation_number
-        )
-        if situation.data == xml and situation.current:
-            return situation.id  # hasn't changed
-        created = False
-        if not situation.current:
-            situation.current = True
-    except Situation.DoesNotExist:
-        situation = Situation(
-            source=source, situation_number=situation_number, current=True
-        )
-        created = True
+    situation.current = True
     situation.data = xml
-    situation.created = created_time
+    situation.data_sha1 = data_sha1
+    situation.created = parse_datetime(item.find("CreationTime").text)
     situation.publication_window = get_period(item.find("PublicationWindow"))
 
     assert item.findtext("Progress") == "open"
@@ -66,89 +65,153 @@ def handle_item(item, source):
     situation.participant_ref = item.find("ParticipantRef").text
     situation.summary = item.find("Summary").text
     situation.text = item.find("Description").text
-    situation.save()
-
-    for i, link_element in enumerate(item.findall("InfoLinks/InfoLink/Uri")):
-        link = Link(situation=situation)
-        if not created and i == 0:
-            try:
-                link = situation.link_set.get()
-            except Link.MultipleObjectsReturned:
-                situation.link_set.all().delete()
-            except Link.DoesNotExist:
-                pass
-        if link_element.text:
-            link.url = link_element.text
-            link.save()
-
-    for i, period_element in enumerate(item.findall("ValidityPeriod")):
-        period = ValidityPeriod(situation=situation)
-        if not created and i == 0:
-            try:
-                period = situation.validityperiod_set.get()
-            except ValidityPeriod.MultipleObjectsReturned:
-                situation.validityperiod_set.all().delete()
-            except ValidityPeriod.DoesNotExist:
-                pass
-        period.period = get_period(period_element)
-        period.save()
-
-    for i, consequence_element in enumerate(item.find("Consequences")):
-        consequence = Consequence(situation=situation)
-        if not created and i == 0:
-            try:
-                consequence = situation.consequence_set.get()
-            except Consequence.MultipleObjectsReturned:
-                situation.consequence_set.all().delete()
-            except Consequence.DoesNotExist:
-                pass
-
-        consequence.text = consequence_element.find("Advice/Details").text
-        consequence.data = ET.tostring(consequence_element, encoding="unicode")
-        consequence.save()
 
+    links = [
+        Link(situation=situation, url=link_element.text)
+        for link_element in item.findall("InfoLinks/InfoLink/Uri")
+        if link_element.text
+    ]
+
+    periods = [
+        ValidityPeriod(situation=situation, period=get_period(period_element))
+        for period_element in item.findall("ValidityPeriod")
+    ]
+
+    consequences = []
+    for consequence_element in item.find("Consequences"):
+        consequence = Consequence(
+            situation=situation,
+            text=consequence_element.find("Advice/Details").text,
+            data=ET.tostring(consequence_element, encoding="unicode"),
+        )
         stops = consequence_element.findall("Affects/StopPoints/AffectedStopPoint")
         stops = [stop.find("StopPointRef").text for stop in stops]
-        stops = StopPoint.objects.filter(atco_code__in=stops)
-        consequence.stops.set(stops)
-
-        consequence.services.clear()
-
-        services = Service.objects.filter(current=True)
-        stops_filter = Q(stops__in=stops)
-
+        lines = []
         for line in consequence_element.findall(
             "Affects/Networks/AffectedNetwork/AffectedLine"
         ):
             line_name = line.findtext("PublishedLineName") or line.findtext("LineRef")
             line_name = line_name.replace("_", " ")
-            line_filter = Q(route__line_name__iexact=line_name) | Q(
-                line_name__iexact=line_name
-            )
             for operator_ref in line.findall("AffectedOperator/OperatorRef"):
-                operator_ref = operator_ref.text
-
-                matching_services = services.filter(
-                    line_filter, operator__in=get_operators(operator_ref)
-                ).distinct()
-                if len(matching_services) > 1:
-                    matching_services = matching_services.filter(stops_filter)
-
-                if matching_services:
-                    consequence.services.add(*matching_services)
-                else:
-                    logger.info(f"{situation_number=} {operator_ref=} {line_name=}")
+                lines.append((line_name, operator_ref.text))
+        operators = [
+            operator.findtext("OperatorRef")
+            for operator in consequence_element.findall(
+                "Affects/Operators/AffectedOperator"
+            )
+        ]
+        consequences.append((consequence, stops, lines, operators))
+
+    return situation, (links, periods, consequences)
+
+
+def save_situations(changed):
+    """Save new and changed situations, replacing any old links, validity periods
+    and consequences with a fixed number of bulk queries
+    """
+    situations = [situation for situation, _ in changed]
+    old_situations = [situation for situation in situations if situation.id]
+    new_situations = [situation for situation in situations if not situation.id]
+
+    if old_situations:
+        Link.objects.filter(situation__in=old_situations).delete()
+        ValidityPeriod.objects.filter(situation__in=old_situations).delete()
+        Consequence.objects.filter(situation__in=old_situations).delete()
+        Situation.objects.bulk_update(
+            old_situations,
+            [
+                "current",
+                "data",
+                "data_sha1",
+                "created",
+                "publication_window",
+                "reason",
+                "participant_ref",
+                "summary",
+                "text",
+            ],
+            batch_size=100,
+        )
+    Situation.objects.bulk_create(new_situations)
 
-        for operator in consequence_element.findall(
-            "Affects/Operators/AffectedOperator"
-        ):
-            operator_ref = operator.findtext("OperatorRef")
-            try:
-                consequence.operators.add(*get_operators(operator_ref))
-            except Operator.DoesNotExist as e:
-                logger.exception(e)
+    Link.objects.bulk_create([link for _, (links, _, _) in changed for link in links])
+    ValidityPeriod.objects.bulk_create(
+        [period for _, (_, periods, _) in changed for period in periods]
+    )
+    consequences = [item for _, (_, _, items) in changed for item in items]
+    Consequence.objects.bulk_create([consequence for consequence, *_ in consequences])
+
+    known_stops = {stop for _, stops, _, _ in consequences for stop in stops}
+    if known_stops:
+        known_stops = set(
+            StopPoint.objects.filter(atco_code__in=known_stops).values_list(
+                "atco_code", flat=True
+            )
+        )
 
-    return situation.id
+    operator_refs = {ref for *_, operators in consequences for ref in operators}
+    operators = {}
+    if operator_refs:
+        for code, noc in Operator.objects.filter(
+            operatorcode__code__in=operator_refs,
+            operatorcode__source__name="National Operator Codes",
+        ).values_list("operatorcode__code", "noc"):
+            operators.setdefault(code, set()).add(noc)
+
+    services = Service.objects.filter(current=True)
+    matching_services = {}  # (line_name, operator_ref): [service ids]
+
+    consequence_stops = []
+    consequence_services = []
+    consequence_operators = []
+
+    for consequence, stops, lines, operator_refs in consequences:
+        stops = [stop for stop in stops if stop in known_stops]
+        consequence_stops += [
+            Consequence.stops.through(consequence=consequence, stoppoint_id=stop)
+            for stop in set(stops)
+        ]
+
+        service_ids = set()
+        for line_name, operator_ref in lines:
+            key = (line_name, operator_ref)
+            if key not in matching_services:
+                line_filter = Q(route__line_name__iexact=line_name) | Q(
+                    line_name__iexact=line_name
+                )
+                matching_services[key] = list(
+                    services.filter(
+                        line_filter, operator__in=get_operators(operator_ref)
+                    )
+                    .distinct()
+                    .values_list("id", flat=True)
+                )
+            ids = matching_services[key]
+            if len(ids) > 1:
+                ids = services.filter(id__in=ids, stops__in=stops).values_list(
+                    "id", flat=True
+                )
+
+            if ids:
+                service_ids.update(ids)
+            else:
+                logger.info(
+                    f"situation_number={consequence.situation.situation_number!r} "
+                    f"{operator_ref=} {line_name=}"
+                )
+        consequence_services += [
+            Consequence.services.through(consequence=consequence, service_id=service_id)
+            for service_id in service_ids
+        ]
+
+        consequence_operators += [
+            Consequence.operators.through(consequence=consequence, operator_id=noc)
+            for noc in set().union(*(operators.get(ref, ()) for ref in operator_refs))
+        ]
+
+    Consequence.stops.through.objects.bulk_create(consequence_stops)
+    Consequence.services.through.objects.bulk_create(consequence_services)
+    Consequence.operators.through.objects.bulk_create(consequence_operators)
 
 
 def bods_disruptions():
@@ -156,7 +219,15 @@ def bods_disruptions():
 
     source = DataSource.objects.get_or_create(name="Bus Open Data")[0]
 
+    existing = {
+        situation.situation_number: situation
+        for situation in source.situation_set.only(
+            "situation_number", "data_sha1", "current"
+        )
+    }
+
     situations = []
+    changed = {}  # by situation number - the last version wins, if one appears twice
 
     response = requests.get(url, timeout=61)
     assert response.ok
@@ -171,9 +242,27 @@ def bods_disruptions():
             element.tag = element.tag[29:]
 
         if element.tag.endswith("PtSituationElement"):
-            situations.append(handle_item(element, source))
+            situation, children = handle_item(element, source, existing)
+            if children is None:
+                situations.append(situation)
+            else:
+                changed[situation.situation_number] = (situation, children)
             element.clear()
 
-    source.situation_set.filter(current=True).exclude(id__in=situations).update(
-        current=False
+    # unchanged, but no longer current - reinstate
+    reinstated = [situation.id for situation in situations if not situation.current]
+    if reinstated:
+        Situation.objects.filter(id__in=reinstated).update(current=True)
+
+    changed = list(changed.values())
+    if changed:
+        save_situations(changed)
+        situations += [situation for situation, _ in changed]
+
+    source.situation_set.filter(current=True).exclude(
+        id__in=[situation.id for situation in situations]
+    ).update(current=False)
+
+    SituationSummary.objects.update_situations(
+        reinstated + [situation.id for situation, _ in changed]
     )
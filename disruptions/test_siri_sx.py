@@ -1,3 +1,5 @@
+import xml.etree.cElementTree as ET
+
 from django.conf import settings
 from django.test import TestCase
 from vcr import use_cassette
@@ -12,7 +14,7 @@ from busstops.models import (
     StopUsage,
 )
 
-from .siri_sx import bods_disruptions
+from .siri_sx import bods_disruptions, handle_item
 from .models import Situation
 
 VCR_DIR = settings.BASE_DIR / "fixtures" / "vcr"
@@ -100,18 +102,18 @@ class SiriSXTest(TestCase):
 
     def test_siri_sx_request(self):
         with use_cassette(str(VCR_DIR / "siri_sx.yaml")) as cassette:
-            with self.assertNumQueries(123):
+            with self.assertNumQueries(42):
                 bods_disruptions()
 
             cassette.rewind()
 
-            with self.assertNumQueries(11):
+            with self.assertNumQueries(4):
                 bods_disruptions()
 
             cassette.rewind()
-            Situation.objects.all().update(data="")
+            Situation.objects.all().update(data_sha1="")
 
-            with self.assertNumQueries(151):
+            with self.assertNumQueries(46):
                 bods_disruptions()
 
         situation = Situation.objects.first()
@@ -147,7 +149,7 @@ class SiriSXTest(TestCase):
             "Towards Manchester the 142 service will begin outside Didsbury Cricket club . ",
         )
 
-        with self.assertNumQueries(13):
+        with self.assertNumQueries(9):
             response = self.client.get("/services/156")
 
         self.assertContains(
@@ -169,9 +171,42 @@ class SiriSXTest(TestCase):
             "-(haydock)/</a>",
         )
 
-        with self.assertNumQueries(7):
+        with self.assertNumQueries(4):
             response = self.client.get("/stops/2800S11031B")
         self.assertContains(
             response,
             "subjected to restrictions, at Liverpool Road, from Monday 17 February 2020",
         )
+
+    def test_repeated_situation(self):
+        xml = """<PtSituationElement>
+            <CreationTime>2020-02-17T09:00:00Z</CreationTime>
+            <ParticipantRef>ATCO</ParticipantRef>
+            <SituationNumber>beef</SituationNumber>
+            <Source><TimeOfCommunication>2020-02-17T09:00:00Z</TimeOfCommunication></Source>
+            <Progress>open</Progress>
+            <PublicationWindow><StartTime>2020-02-17T09:00:00Z</StartTime></PublicationWindow>
+            <Summary>Road closed</Summary>
+            <Description>{}</Description>
+            <Consequences/>
+        </PtSituationElement>"""
+        source = DataSource.objects.create(name="Bus Open Data")
+        existing = {}
+
+        first, children = handle_item(ET.fromstring(xml.format("")), source, existing)
+        self.assertIsNotNone(children)
+        self.assertIs(existing["beef"], first)
+
+        # same again - unchanged
+        situation, children = handle_item(
+            ET.fromstring(xml.format("")), source, existing
+        )
+        self.assertIs(situation, first)
+        self.assertIsNone(children)
+
+        # changed - the same Situation, not a second one
+        situation, children = handle_item(
+            ET.fromstring(xml.format("Diversion")), source, existing
+        )
+        self.assertIs(situation, first)
+        self.assertEqual(situation.text, "Diversion")
@@ -27,12 +27,12 @@ class TfLDisruptionsTest(TestCase):
         with use_cassette(
             str(vcr_dir / "tfl_disruptions.yaml"), decode_compressed_response=True
         ) as cassette:
-            with self.assertNumQueries(109):
+            with self.assertNumQueries(119):
                 tfl_disruptions()
 
             cassette.rewind()
 
-            with self.assertNumQueries(105):
+            with self.assertNumQueries(104):
                 tfl_disruptions()
 
         response = self.client.get("/situations")
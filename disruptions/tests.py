@@ -1,7 +1,15 @@
+from io import StringIO
+from unittest.mock import Mock
+
+from django.contrib.admin import site
+from django.core.management import call_command
 from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
 from django.test import TestCase
 
-from .models import Situation, ValidityPeriod
+from busstops.models import Operator, Region, Service, StopPoint
+
+from .admin import SituationAdmin
+from .models import Consequence, Situation, SituationSummary, ValidityPeriod
 
 
 class DisruptionsTest(TestCase):
@@ -67,3 +75,56 @@ class DisruptionsTest(TestCase):
                 "21:00\u2009\u2013\u200907:00,\nMonday 10\u2009\u2013\u2009Wednesday 12 May 2021"
             ],
         )
+
+    def test_admin_summaries(self):
+        situation = Situation.objects.create(
+            source=self.situation.source, summary="Road closed"
+        )
+        consequence = Consequence.objects.create(situation=situation)
+        consequence.stops.add(StopPoint.objects.create(atco_code="2900A181"))
+
+        admin = SituationAdmin(Situation, site)
+        admin.save_related(None, Mock(instance=situation), [], False)
+
+        summary = SituationSummary.objects.active("stop:2900A181").get()
+        self.assertEqual(summary.situation, situation)
+        self.assertIn("Road closed", summary.html)
+
+        admin.delete_model(None, situation)
+        self.assertFalse(SituationSummary.objects.all())
+
+    def test_render_situation_summaries(self):
+        situation = Situation.objects.create(
+            source=self.situation.source, summary="Bridge strike"
+        )
+        consequence = Consequence.objects.create(situation=situation)
+        consequence.stops.add(StopPoint.objects.create(atco_code="2900A181"))
+
+        stdout = StringIO()
+        call_command("render_situation_summaries", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "1 summaries of 1 situations\n")
+
+        summary = SituationSummary.objects.active("stop:2900A181").get()
+        self.assertIn("Bridge strike", summary.html)
+
+    def test_active_summary_priority(self):
+        operator = Operator.objects.create(
+            noc="LYNX", name="Lynx", region=Region.objects.create(id="EA")
+        )
+        service = Service.objects.create(line_name="35")
+        situation = Situation.objects.create(source=self.situation.source)
+        consequence = Consequence.objects.create(
+            situation=situation, text="The 35 is diverted"
+        )
+        consequence.services.add(service)
+        consequence = Consequence.objects.create(
+            situation=situation, text="All Lynx services are diverted"
+        )
+        consequence.operators.add(operator)
+        SituationSummary.objects.update_situations([situation.id])
+
+        summary = SituationSummary.objects.active(
+            f"operator:{operator.noc}", f"service:{service.id}"
+        ).get()
+        self.assertEqual(summary.key, f"service:{service.id}")
+        self.assertIn("The 35 is diverted", summary.html)
@@ -2,13 +2,14 @@ import logging
 from hashlib import sha256
 
 import requests
+from ciso8601 import parse_datetime
 from django.conf import settings
 from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
 from django.db.models import Q
 
 from busstops.models import DataSource, Service, StopPoint
 
-from .models import Consequence, Situation, ValidityPeriod
+from .models import Consequence, Situation, SituationSummary, ValidityPeriod
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +18,24 @@ def get_hash(text):
     return sha256(text.encode()).hexdigest()[:36]
 
 
+def get_bound(value):
+    # a window read from the API has strings, one from the database has datetimes
+    return parse_datetime(value) if isinstance(value, str) else value
+
+
+def get_values(situation):
+    # the fields that affect a situation's rendered summaries
+    window = situation.publication_window
+    return (
+        situation.id,
+        situation.current,
+        situation.summary,
+        situation.text,
+        situation.reason,
+        window and (get_bound(window.lower), get_bound(window.upper)),
+    )
+
+
 def tfl_disruptions():
     session = requests.Session()
     session.headers.update({"User-Agent": "bustimes.org"})
@@ -24,6 +43,7 @@ def tfl_disruptions():
     source = DataSource.objects.get_or_create(name="TfL")[0]
 
     situations = set()
+    changed = set()  # situations to re-render the summaries of
 
     response = session.get(
         "https://api.tfl.gov.uk/StopPoint/Mode/bus/Disruption",
@@ -57,6 +77,7 @@ def tfl_disruptions():
                 created=item["fromDate"],
                 source=source,
             )
+        old_values = get_values(situation)
         situation.current = True
         situation.text = item["description"].replace("\\n", "\n").strip()
         if ": " in situation.text:
@@ -66,7 +87,9 @@ def tfl_disruptions():
         situation.text = situation.text.replace(". ", ".\n\n")
         situation.publication_window = window
         situation.reason = item["type"]
-        situation.save()
+        if get_values(situation) != old_values:
+            situation.save()
+            changed.add(situation.id)
 
         try:
             consequence = situation.consequence_set.get()
@@ -74,7 +97,14 @@ def tfl_disruptions():
             consequence = Consequence(situation=situation)
             consequence.save()
 
-        consequence.stops.add(*stops)
+        if situation.id in changed:
+            consequence.stops.add(*stops)
+        else:
+            existing = set(consequence.stops.values_list("atco_code", flat=True))
+            stops = [stop for stop in stops if stop.atco_code not in existing]
+            if stops:
+                consequence.stops.add(*stops)
+                changed.add(situation.id)
 
         try:
             period = situation.validityperiod_set.get()
@@ -130,6 +160,7 @@ def tfl_disruptions():
                 created = True
             else:
                 created = False
+            old_values = get_values(situation)
 
             if ": " in situation.text and situation.text.index(": ") < 255:
                 situation.summary, situation.text = situation.text.split(": ", 1)
@@ -137,7 +168,9 @@ def tfl_disruptions():
             situation.text = situation.text.replace(". ", ".\n\n")
 
             situation.current = True
-            situation.save()
+            if get_values(situation) != old_values:
+                situation.save()
+                changed.add(situation.id)
 
             if created:
                 for period in validity_periods:
@@ -153,9 +186,20 @@ def tfl_disruptions():
                 consequence = Consequence(situation=situation)
                 consequence.save()
 
-            consequence.services.add(*services)
+            if situation.id in changed:
+                consequence.services.add(*services)
+            else:
+                existing = set(consequence.services.values_list("id", flat=True))
+                new_services = [
+                    service for service in services if service.id not in existing
+                ]
+                if new_services:
+                    consequence.services.add(*new_services)
+                    changed.add(situation.id)
 
             situations.add(situation.id)
 
     old_situations = source.situation_set.filter(Q(current=True), ~Q(id__in=situations))
     old_situations.update(current=False)
+
+    SituationSummary.objects.update_situations(changed)
@@ -1,20 +1,26 @@
 import io
 import logging
+import multiprocessing
 import xml.etree.cElementTree as ET
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from decimal import Decimal
 from functools import cache
+from itertools import repeat
+from pathlib import Path
 
 import requests
 from ciso8601 import parse_datetime
 from django.core.management.base import BaseCommand
-from django.db import DataError, IntegrityError
+from django.db import DataError, IntegrityError, connections
 from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
 from django.db.models import Q
 from django.utils.http import http_date, parse_http_date
 from sql_util.utils import Exists
 
-from busstops.models import Operator, Service
+from busstops.management.profiling import ProfileMixin, phase
+from busstops.models import Operator, Service, StopPoint
 from bustimes.utils import log_time_taken
 
 from ... import models
@@ -22,23 +28,41 @@ from ... import models
 logger = logging.getLogger(__name__)
 
 
-def get_user_profile(element, user_profiles):
-    code = element.attrib["id"]
-    if code in user_profiles:
-        return user_profiles[code], False
+@phase("lookup")
+def get_or_create_all(model, objects, lookup_fields):
+    """Like get_or_create, but for lots of objects in (at most) two queries.
+    The first lookup field should be "code".
+    Returns the existing or newly created objects, by code
+    """
+    unique_objects = {}
+    for obj in objects:
+        key = tuple(getattr(obj, field) for field in lookup_fields)
+        if key not in unique_objects:
+            unique_objects[key] = obj
+
+    if unique_objects:
+        for obj in model.objects.filter(code__in={key[0] for key in unique_objects}):
+            key = tuple(getattr(obj, field) for field in lookup_fields)
+            if key in unique_objects:
+                unique_objects[key] = obj
+        model.objects.bulk_create(
+            [obj for obj in unique_objects.values() if obj.pk is None]
+        )
+
+    return {obj.code: obj for obj in unique_objects.values()}
 
-    return models.UserProfile.objects.get_or_create(
-        {
-            "name": element.findtext("Name"),
-            "min_age": element.findtext("MinimumAge"),
-            "max_age": element.findtext("MaximumAge"),
-        },
-        code=code,
+
+def get_user_profile(element):
+    return models.UserProfile(
+        code=element.attrib["id"],
+        name=element.findtext("Name"),
+        min_age=element.findtext("MinimumAge"),
+        max_age=element.findtext("MaximumAge"),
     )
 
 
 def get_sales_offer_package(element):
-    return models.SalesOfferPackage.objects.get_or_create(
+    return models.SalesOfferPackage(
         code=element.attrib["id"],
         name=element.findtext("Name", ""),
         description=element.findtext("Description", ""),
@@ -46,7 +70,7 @@ def get_sales_offer_package(element):
 
 
 def get_fare_product(element):
-    return models.PreassignedFareProduct.objects.get_or_create(
+    return models.PreassignedFareProduct(
         code=element.attrib["id"],
         name=element.findtext("Name", ""),
         charging_moment=element.findtext("ChargingMomentType", ""),
@@ -54,11 +78,20 @@ def get_fare_product(element):
     )
 
 
+def get_time_interval(element):
+    return models.TimeInterval(
+        code=element.attrib["id"],
+        name=element.findtext("Name"),
+        description=element.findtext("Description", ""),
+    )
+
+
 def get_existing_fare_zones(source):
     return {f"{zone.code} {zone.name}": zone for zone in source.farezone_set.all()}
 
 
-def get_fare_zones(source, existing_zones, fare_zone_elements):
+@phase("lookup")
+def get_fare_zones(source, existing_zones, fare_zone_elements, zone_stops):
     zones = {}
     for fare_zone_element in fare_zone_elements:
         code = fare_zone_element.attrib["id"]
@@ -77,21 +110,18 @@ def get_fare_zones(source, existing_zones, fare_zone_elements):
             existing_zones[key] = zone
         zones[code] = zone
 
-        # stop_refs = [stop.attrib['ref'] for stop in fare_zone_element.findall('members/ScheduledStopPointRef')]
-        # if stop_refs:
-        #     try:
-        #         if stop_refs[0].startswith('atco'):
-        #             fare_zone.stops.set(StopPoint.objects.filter(
-        #                 atco_code__in=[stop_ref.removeprefix('atco:') for stop_ref in stop_refs]
-        #             ))
-        #         # elif stop_refs[0].startswith('naptStop'):
-        #         #     fare_zone.stops.set(StopPoint.objects.filter(
-        #         #         naptan_code__iexact__in=[stop_ref.removeprefix('naptStop:') for stop_ref in stop_refs]
-        #         #     ))
-        #         else:
-        #             print(stop_refs[0])
-        #     except IntegrityError as e:
-        #         print(e)
+        stop_refs = [
+            stop.attrib["ref"]
+            for stop in fare_zone_element.findall("members/ScheduledStopPointRef")
+        ]
+        if stop_refs:
+            if key not in zone_stops:
+                zone_stops[key] = set()
+            zone_stops[key].update(
+                stop_ref.removeprefix("atco:")
+                for stop_ref in stop_refs
+                if stop_ref.startswith("atco:")
+            )
 
     models.FareZone.objects.bulk_create(
         [zone for zone in zones.values() if not zone.id]
@@ -99,6 +129,28 @@ def get_fare_zones(source, existing_zones, fare_zone_elements):
     return zones
 
 
+def update_fare_zone_stops(existing_zones, zone_stops):
+    """Replace the stops of each fare zone with ones from the NeTEx ScheduledStopPointRefs"""
+    zones = [existing_zones[key] for key in zone_stops]
+    through = models.FareZone.stops.through
+    through.objects.filter(farezone__in=zones).delete()
+
+    stop_ids = set(
+        StopPoint.objects.filter(
+            atco_code__in=set().union(*zone_stops.values())
+        ).values_list("atco_code", flat=True)
+    )
+    through.objects.bulk_create(
+        [
+            through(farezone=existing_zones[key], stoppoint_id=stop_id)
+            for key, stops in zone_stops.items()
+            for stop_id in stops
+            if stop_id in stop_ids
+        ],
+        batch_size=1000,
+    )
+
+
 @cache
 def get_service(operator, line_name):
     try:
@@ -111,8 +163,16 @@ def get_service(operator, line_name):
         logger.warning(f"{e} {operator} {line_name}")
 
 
-class Command(BaseCommand):
+def call_in_worker(method, arg):
+    # a new Command, so as not to share the parent process's HTTP connections
+    command = Command()
+    command.session = requests.Session()
+    return method(command, arg)
+
+
+class Command(ProfileMixin, BaseCommand):
     base_url = "https://data.bus-data.dft.gov.uk"
+    workers = 1  # processes for importing datasets in parallel
 
     def handle_file(self, source, open_file, filename=None):
         iterator = ET.iterparse(open_file)
@@ -121,44 +181,87 @@ class Command(BaseCommand):
             filename = open_file.name
 
         try:
-            for _, element in iterator:
-                # remove NeTEx namespace for simplicity's sake:
-                if element.tag[:31] == "{http://www.netex.org.uk/netex}":
-                    element.tag = element.tag[31:]
+            with phase("parse"):
+                for _, element in iterator:
+                    # remove NeTEx namespace for simplicity's sake:
+                    if element.tag[:31] == "{http://www.netex.org.uk/netex}":
+                        element.tag = element.tag[31:]
         except ET.ParseError as e:
             logger.exception(e)
             return
 
-        operators = element.findall(
-            "dataObjects/CompositeFrame/frames/ResourceFrame/organisations/Operator"
-        )
-        operators = {operator.attrib["id"]: operator for operator in operators}
-
         lines = element.findall(
             "dataObjects/CompositeFrame/frames/ServiceFrame/lines/Line"
         )
         lines = {line.attrib["id"]: line for line in lines}
 
-        user_profiles = {**self.user_profiles}
-        for usage_parameter in element.findall(
+        tariff_elements = element.findall(
+            "dataObjects/CompositeFrame/frames/FareFrame/tariffs/Tariff"
+        )
+
+        # resolve references to user profiles, sales offer packages, fare products and operators
+        # up front, with a query or two for each type of object
+
+        user_profile_elements = element.findall(
             "dataObjects/CompositeFrame/frames/FareFrame/usageParameters/UserProfile"
-        ):
-            user_profile, created = get_user_profile(usage_parameter, user_profiles)
-            user_profiles[user_profile.code] = user_profile
+        )
+        for tariff_element in tariff_elements:
+            user_profile = tariff_element.find(
+                "fareStructureElements/FareStructureElement/GenericParameterAssignment/limitations/UserProfile"
+            )
+            if user_profile is not None:
+                user_profile_elements.append(user_profile)
+        user_profiles = {**self.user_profiles}
+        user_profiles.update(
+            get_or_create_all(
+                models.UserProfile,
+                [
+                    get_user_profile(user_profile)
+                    for user_profile in user_profile_elements
+                    if user_profile.attrib["id"] not in user_profiles
+                ],
+                ("code",),
+            )
+        )
 
         sales_offer_packages = {**self.sales_offer_packages}
-        for sales_offer_package in element.findall(
-            "dataObjects/CompositeFrame/frames/FareFrame/salesOfferPackages/SalesOfferPackage"
-        ):
-            sales_offer_package, created = get_sales_offer_package(sales_offer_package)
-            sales_offer_packages[sales_offer_package.code] = sales_offer_package
+        sales_offer_packages.update(
+            get_or_create_all(
+                models.SalesOfferPackage,
+                [
+                    get_sales_offer_package(sales_offer_package)
+                    for sales_offer_package in element.findall(
+                        "dataObjects/CompositeFrame/frames/FareFrame/salesOfferPackages/SalesOfferPackage"
+                    )
+                ],
+                ("code", "name", "description"),
+            )
+        )
 
         fare_products = {**self.fare_products}
-        for fare_product in element.findall(
-            "dataObjects/CompositeFrame/frames/FareFrame/fareProducts/PreassignedFareProduct"
-        ):
-            fare_product, created = get_fare_product(fare_product)
-            fare_products[fare_product.code] = fare_product
+        fare_products.update(
+            get_or_create_all(
+                models.PreassignedFareProduct,
+                [
+                    get_fare_product(fare_product)
+                    for fare_product in element.findall(
+                        "dataObjects/CompositeFrame/frames/FareFrame/fareProducts/PreassignedFareProduct"
+                    )
+                ],
+                ("code", "name", "charging_moment", "tariff_basis"),
+            )
+        )
+
+        operators = Operator.objects.in_bulk(
+            {
+                operator_ref.attrib["ref"].removeprefix("noc:")
+                for operator_ref in (
+                    tariff_element.find("OperatorRef")
+                    for tariff_element in tariff_elements
+                )
+                if operator_ref is not None
+            }
+        )
 
         price_groups = {}
         price_group_prices = {}
@@ -172,7 +275,7 @@ class Command(BaseCommand):
                 price = models.Price(amount=price_element.findtext("Amount"))
                 price_groups[price_group_element.attrib["id"]] = price
                 price_group_prices[price_element.attrib["id"]] = price
-        models.Price.objects.bulk_create(price_groups.values())
+        models.Price.objects.bulk_create(price_groups.values(), batch_size=1000)
 
         fare_zones = get_fare_zones(
             source,
@@ -180,15 +283,19 @@ class Command(BaseCommand):
             element.findall(
                 "dataObjects/CompositeFrame/frames/FareFrame/fareZones/FareZone"
             ),
+            self.fare_zone_stops,
         )
 
-        prices = {}
+        # build all the tariffs (and related objects) in memory, then bulk insert them
 
-        tariffs = {}
-        time_intervals = {}
-        for tariff_element in element.findall(
-            "dataObjects/CompositeFrame/frames/FareFrame/tariffs/Tariff"
-        ):
+        all_tariffs = []
+        tariffs = {}  # by code - if a code is repeated, fare tables refer to the last one
+        tariff_operators = []
+        tariff_services = []
+        tariff_access_zones = []
+        all_distance_matrix_elements = []
+        time_intervals = []
+        for tariff_element in tariff_elements:
             tariff_code = tariff_element.attrib["id"]
 
             fare_structure_elements = tariff_element.find("fareStructureElements")
@@ -200,10 +307,7 @@ class Command(BaseCommand):
                     "FareStructureElement/GenericParameterAssignment/limitations/UserProfile"
                 )
                 if user_profile is not None:
-                    user_profile, created = get_user_profile(
-                        user_profile, user_profiles
-                    )
-                    user_profiles[user_profile.code] = user_profile
+                    user_profile = user_profiles[user_profile.attrib["id"]]
 
                 trip_type = fare_structure_elements.findtext(
                     "FareStructureElement/GenericParameterAssignment/limitations/RoundTrip/TripType",
@@ -223,7 +327,7 @@ class Command(BaseCommand):
                 logger.error(f"{filename} {valid_between}")
                 valid_between = None
 
-            tariff = models.Tariff.objects.create(
+            tariff = models.Tariff(
                 code=tariff_code,
                 name=tariff_element.findtext("Name"),
                 source=source,
@@ -233,18 +337,20 @@ class Command(BaseCommand):
                 type_of_tariff=type_of_tariff or "",
                 valid_between=valid_between,
             )
+            all_tariffs.append(tariff)
             tariffs[tariff.code] = tariff
 
             operator_ref = tariff_element.find("OperatorRef")
             if operator_ref is not None:
-                try:
-                    operator = Operator.objects.get(
-                        noc=operator_ref.attrib["ref"].removeprefix("noc:")
+                operator = operators.get(
+                    operator_ref.attrib["ref"].removeprefix("noc:")
+                )
+                if operator:
+                    tariff_operators.append(
+                        models.Tariff.operators.through(
+                            tariff=tariff, operator=operator
+                        )
                     )
-                except Operator.DoesNotExist:
-                    pass
-                else:
-                    tariff.operators.add(operator)
 
                     line_ref = tariff_element.find("LineRef")
                     if line_ref is not None:
@@ -252,7 +358,11 @@ class Command(BaseCommand):
                         line_name = line.findtext("PublicCode")
                         service = get_service(operator, line_name)
                         if service:
-                            tariff.services.add(service)
+                            tariff_services.append(
+                                models.Tariff.services.through(
+                                    tariff=tariff, service=service
+                                )
+                            )
 
             distance_matrix_elements = {}
             if fare_structure_elements is not None:
@@ -285,26 +395,39 @@ class Command(BaseCommand):
                         distance_matrix_elements[distance_matrix_element.code] = (
                             distance_matrix_element
                         )
-                models.DistanceMatrixElement.objects.bulk_create(
-                    distance_matrix_elements.values()
-                )
+                all_distance_matrix_elements += distance_matrix_elements.values()
 
-            if fare_structure_elements is not None:
                 access_zones = fare_structure_elements.find(
                     "FareStructureElement/GenericParameterAssignment/validityParameters/FareZoneRef"
                 )
                 if access_zones is not None:
-                    tariff.access_zones.add(fare_zones[access_zones.attrib["ref"]])
+                    tariff_access_zones.append(
+                        models.Tariff.access_zones.through(
+                            tariff=tariff,
+                            farezone=fare_zones[access_zones.attrib["ref"]],
+                        )
+                    )
 
             time_intervals_element = tariff_element.find("timeIntervals")
             if time_intervals_element is not None:
-                for time_interval in time_intervals_element:
-                    time_interval, _ = models.TimeInterval.objects.get_or_create(
-                        code=time_interval.attrib["id"],
-                        name=time_interval.findtext("Name"),
-                        description=time_interval.findtext("Description", ""),
-                    )
-                    time_intervals[time_interval.code] = time_interval
+                time_intervals += [
+                    get_time_interval(time_interval)
+                    for time_interval in time_intervals_element
+                ]
+
+        with phase("write"):
+            models.Tariff.objects.bulk_create(all_tariffs)
+            models.Tariff.operators.through.objects.bulk_create(tariff_operators)
+            models.Tariff.services.through.objects.bulk_create(tariff_services)
+            models.Tariff.access_zones.through.objects.bulk_create(tariff_access_zones)
+
+        time_intervals = get_or_create_all(
+            models.TimeInterval, time_intervals, ("code", "name", "description")
+        )
+
+        fare_tables = []
+        prices = {}  # Stagecoach distance matrix element prices, by amount
+        time_interval_prices = {}
 
         for fare_table_element in element.findall(
             "dataObjects/CompositeFrame/frames/FareFrame/fareTables/FareTable"
@@ -349,50 +472,32 @@ class Command(BaseCommand):
             rows_element = fare_table_element.find("rows")
 
             if columns_element is not None and rows_element is not None:
-                table, created = models.FareTable.objects.update_or_create(
-                    {
-                        "user_profile": user_profile,
-                        "sales_offer_package": sales_offer_package,
-                        "preassigned_fare_product": preassigned_fare_product,
-                        "description": fare_table_element.findtext("Description", ""),
-                    },
-                    tariff=tariff,
-                    code=fare_table_element.attrib["id"],
-                    name=fare_table_element.findtext("Name", ""),
+                columns = {
+                    column.attrib["id"]: i for i, column in enumerate(columns_element)
+                }
+                rows = {row.attrib["id"]: i for i, row in enumerate(rows_element)}
+                matrix_prices = [[None] * len(columns) for row in rows]
+                fare_tables.append(
+                    models.FareTable(
+                        tariff=tariff,
+                        code=fare_table_element.attrib["id"],
+                        name=fare_table_element.findtext("Name", ""),
+                        user_profile=user_profile,
+                        sales_offer_package=sales_offer_package,
+                        preassigned_fare_product=preassigned_fare_product,
+                        description=fare_table_element.findtext("Description", ""),
+                        matrix={
+                            "columns": [
+                                column.findtext("Name") for column in columns_element
+                            ],
+                            "rows": [row.findtext("Name") for row in rows_element],
+                            "prices": matrix_prices,
+                        },
+                    )
                 )
 
-                assert created
-
-                if not created:
-                    table.column_set.all().delete()
-                    table.row_set.all().delete()
-
-                columns = {}
-                if columns_element is not None:
-                    for column in columns_element:
-                        column = models.Column(
-                            table=table,
-                            code=column.attrib["id"],
-                            name=column.findtext("Name"),
-                            order=column.attrib.get("order"),
-                        )
-                        columns[column.code] = column
-                models.Column.objects.bulk_create(columns.values())
-
-                rows = {}
-                if rows_element is not None:
-                    for row in rows_element:
-                        row = models.Row(
-                            table=table,
-                            code=row.attrib["id"],
-                            name=row.findtext("Name"),
-                            order=row.attrib.get("order"),
-                        )
-                        rows[row.code] = row
-                models.Row.objects.bulk_create(rows.values())
-
             else:
-                table = None
+                columns = rows = {}
 
                 # Stagecoach
                 distance_matrix_elements = tariff_element.find("distanceMatrixElements")
@@ -413,22 +518,22 @@ class Command(BaseCommand):
                         ]
                         amount = price.findtext("Amount")
                         if amount not in prices:
-                            prices[amount] = models.Price.objects.create(amount=amount)
+                            prices[amount] = models.Price(amount=amount)
                         start_zone = distance_matrix_element.find(
                             "StartTariffZoneRef"
                         ).attrib["ref"]
                         end_zone = distance_matrix_element.find(
                             "EndTariffZoneRef"
                         ).attrib["ref"]
-                        models.DistanceMatrixElement.objects.create(
-                            tariff=tariff,
-                            start_zone=fare_zones[start_zone],
-                            end_zone=fare_zones[end_zone],
-                            price=prices[amount],
+                        all_distance_matrix_elements.append(
+                            models.DistanceMatrixElement(
+                                tariff=tariff,
+                                start_zone=fare_zones[start_zone],
+                                end_zone=fare_zones[end_zone],
+                                price=prices[amount],
+                            )
                         )
 
-            cells = []
-
             for sub_fare_table_element in fare_table_element.findall(
                 "includes/FareTable"
             ):
@@ -448,15 +553,6 @@ class Command(BaseCommand):
                         if price_ref is None:
                             continue
 
-                        distance_matrix_element_ref = (
-                            distance_matrix_element_price.find(
-                                "DistanceMatrixElementRef"
-                            )
-                        )
-                        distance_matrix_element = distance_matrix_elements[
-                            distance_matrix_element_ref.attrib["ref"]
-                        ]
-
                         column_ref = cell_element.find("ColumnRef").attrib["ref"]
                         column = columns.get(column_ref)
 
@@ -466,14 +562,8 @@ class Command(BaseCommand):
                         if row is None or column is None:
                             continue
 
-                        cells.append(
-                            models.Cell(
-                                column=column,
-                                row=row,
-                                price=price_group_prices[price_ref.attrib["ref"]],
-                                distance_matrix_element=distance_matrix_element,
-                            )
-                        )
+                        amount = price_group_prices[price_ref.attrib["ref"]].amount
+                        matrix_prices[row][column] = f"{Decimal(amount):.2f}"
 
                 sales_offer_package_ref = sub_fare_table_element.find(
                     "pricesFor/SalesOfferPackageRef"
@@ -501,15 +591,31 @@ class Command(BaseCommand):
                                         time_interval = time_intervals[
                                             time_interval.attrib["ref"]
                                         ]
-                                    price, created = models.Price.objects.get_or_create(
-                                        amount=time_interval_price.findtext("Amount"),
-                                        time_interval=time_interval,
-                                        tariff=tariff,
-                                        sales_offer_package=sales_offer_package,
-                                        user_profile=user_profile,
+                                    amount = time_interval_price.findtext("Amount")
+                                    key = (
+                                        amount,
+                                        time_interval,
+                                        tariff,
+                                        sales_offer_package,
+                                        user_profile,
                                     )
-
-            models.Cell.objects.bulk_create(cells)
+                                    if key not in time_interval_prices:
+                                        time_interval_prices[key] = models.Price(
+                                            amount=amount,
+                                            time_interval=time_interval,
+                                            tariff=tariff,
+                                            sales_offer_package=sales_offer_package,
+                                            user_profile=user_profile,
+                                        )
+
+        with phase("write"):
+            models.Price.objects.bulk_create(
+                [*prices.values(), *time_interval_prices.values()], batch_size=1000
+            )
+            models.DistanceMatrixElement.objects.bulk_create(
+                all_distance_matrix_elements, batch_size=1000
+            )
+            models.FareTable.objects.bulk_create(fare_tables)
 
         # Stagecoach has user profiles and sales offer packages defined separately
         if "_COMMON_" in filename:
@@ -520,9 +626,25 @@ class Command(BaseCommand):
             if fare_products:
                 self.fare_products = fare_products
 
+    @phase("post-process")
+    def update_stops(self, dataset):
+        update_fare_zone_stops(self.fare_zones, self.fare_zone_stops)
+        models.TariffStop.objects.rebuild(dataset)
+
     @staticmethod
     def add_arguments(parser):
-        parser.add_argument("api_key", type=str)
+        parser.add_argument(
+            "api_key",
+            nargs="+",
+            help='a BODS API key, "ticketer", or paths of local NeTEx files'
+            " (XML files, zip archives or directories of them)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of datasets to import in parallel processes",
+        )
 
     def handle_archive(self, dataset, file):
         filenames = set()
@@ -570,6 +692,7 @@ class Command(BaseCommand):
             self.sales_offer_packages = {}
             self.fare_products = {}
             self.fare_zones = get_existing_fare_zones(dataset)
+            self.fare_zone_stops = {}
 
             if (
                 content_type := response.headers["Content-Type"]
@@ -587,6 +710,8 @@ class Command(BaseCommand):
                     # don't update timestamp field, try re-importing next time
                     return dataset
 
+            self.update_stops(dataset)
+
         dataset.datetime = modified
         dataset.save(update_fields=["datetime"])
         return dataset
@@ -624,15 +749,69 @@ class Command(BaseCommand):
             self.sales_offer_packages = {}
             self.fare_products = {}
             self.fare_zones = get_existing_fare_zones(dataset)
+            self.fare_zone_stops = {}
 
             self.handle_archive(dataset, io.BytesIO(response.content))
 
+            self.update_stops(dataset)
+
         dataset.datetime = last_modified
         dataset.save(update_fields=["datetime"])
         return dataset
 
+    def import_local_dataset(self, path):
+        """Import a local file, archive or directory of files as one dataset -
+        for timing an import (with --profile) against the same data every time"""
+        dataset, created = models.DataSet.objects.get_or_create(name=path.name, url="")
+
+        logger.info(path)
+
+        with log_time_taken(logger):
+            dataset.tariff_set.all().delete()
+
+            self.user_profiles = {}
+            self.sales_offer_packages = {}
+            self.fare_products = {}
+            self.fare_zones = get_existing_fare_zones(dataset)
+            self.fare_zone_stops = {}
+
+            if path.is_dir():
+                paths = sorted(path.iterdir())
+            else:
+                paths = [path]
+            for path in paths:
+                if path.suffix == ".zip":
+                    self.handle_archive(dataset, path)
+                elif path.suffix == ".xml":
+                    with path.open("rb") as open_file:
+                        self.handle_file(dataset, open_file, path.name)
+
+            self.update_stops(dataset)
+
+        return dataset.id
+
+    def import_bods_dataset(self, item):
+        try:
+            dataset = self.handle_bods_dataset(item)
+        except (TypeError, IntegrityError) as e:
+            print(e)
+        else:
+            if dataset:
+                return dataset.id
+
+    def map(self, method, args):
+        """Call a method for each arg, in parallel processes if --workers > 1"""
+        if self.workers > 1 and len(args) > 1:
+            # each process will open its own database connection
+            connections.close_all()
+            with ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                return list(executor.map(call_in_worker, repeat(method), args))
+        return [method(self, arg) for arg in args]
+
     def bod(self, api_key):
-        datasets = []
+        items = []
         url = f"{self.base_url}/api/v1/fares/dataset/"
         params = {
             "api_key": api_key,
@@ -644,39 +823,32 @@ class Command(BaseCommand):
 
             data = response.json()
 
-            for item in data["results"]:
-                try:
-                    dataset = self.handle_bods_dataset(item)
-                    if dataset:
-                        datasets.append(dataset.id)
-                except (TypeError, IntegrityError) as e:
-                    print(e)
+            items += data["results"]
 
             url = data["next"]
             params = None
 
+        datasets = self.map(Command.import_bods_dataset, items)
+
         # remove removed datasets
         old = models.DataSet.objects.filter(url__startswith=self.base_url).exclude(
-            id__in=datasets
+            id__in=[dataset_id for dataset_id in datasets if dataset_id]
         )
         if old:
             logger.info(f"deleting {old}")
             logger.info(f"deleted {old.delete()}")
 
-    def handle(self, api_key, **options):
+    def handle(self, api_key, workers=1, **options):
         self.session = requests.Session()
+        self.workers = workers
 
-        if api_key == "ticketer":
-            for noc in (
-                "FECS",
-                "FESX",
-                "FCWL",
-                "FGLA",
-                "FSYO",
-                "FWYO",
-                "FYOR",
-            ):
-                self.ticketer(noc)
+        if api_key == ["ticketer"]:
+            self.map(
+                Command.ticketer,
+                ["FECS", "FESX", "FCWL", "FGLA", "FSYO", "FWYO", "FYOR"],
+            )
+        elif len(api_key) == 1 and not Path(api_key[0]).exists():
+            assert len(api_key[0]) == 40
+            self.bod(api_key[0])
         else:
-            assert len(api_key) == 40
-            self.bod(api_key)
+            self.map(Command.import_local_dataset, [Path(path) for path in api_key])
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.5 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+def populate_matrices(apps, schema_editor):
+    FareTable = apps.get_model('fares', 'FareTable')
+
+    tables = FareTable.objects.prefetch_related(
+        models.Prefetch('column_set', apps.get_model('fares', 'Column').objects.order_by('id')),
+        models.Prefetch('row_set', apps.get_model('fares', 'Row').objects.order_by('id')),
+        'row_set__cell_set__price',
+    )
+    for table in tables.iterator(chunk_size=100):
+        columns = {column.id: i for i, column in enumerate(table.column_set.all())}
+        prices = []
+        for row in table.row_set.all():
+            amounts = [None] * len(columns)
+            for cell in row.cell_set.all():
+                if cell.price:
+                    amounts[columns[cell.column_id]] = str(cell.price.amount)
+            prices.append(amounts)
+        table.matrix = {
+            'columns': [column.name for column in table.column_set.all()],
+            'rows': [row.name for row in table.row_set.all()],
+            'prices': prices,
+        }
+        table.save(update_fields=['matrix'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fares', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faretable',
+            name='matrix',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_matrices, migrations.RunPython.noop),
+    ]
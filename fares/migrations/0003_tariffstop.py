@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-19 13:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busstops', '0010_postcode'),
+        ('fares', '0002_faretable_matrix'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='distancematrixelement',
+            index=models.Index(fields=['tariff', 'start_zone', 'end_zone'], name='fares_dista_tariff__f630ef_idx'),
+        ),
+        migrations.CreateModel(
+            name='TariffStop',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fare_zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fares.farezone')),
+                ('stop', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='busstops.stoppoint')),
+                ('tariff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='fares.tariff')),
+            ],
+            options={
+                'unique_together': {('stop', 'tariff', 'fare_zone')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-19 15:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fares', '0003_tariffstop'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Cell',
+        ),
+        migrations.DeleteModel(
+            name='Row',
+        ),
+        migrations.DeleteModel(
+            name='Column',
+        ),
+    ]
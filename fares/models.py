@@ -1,7 +1,9 @@
+from decimal import Decimal
 from functools import cached_property
 
 from django.contrib.postgres.fields import DateTimeRangeField
-from django.db import models
+from django.db import connection, models
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
@@ -155,6 +157,9 @@ class FareTable(models.Model):
         PreassignedFareProduct, models.CASCADE, null=True, blank=True
     )
     tariff = models.ForeignKey(Tariff, models.CASCADE)
+    # {"columns": [name, ...], "rows": [name, ...], "prices": [[amount or null, ...], ...]}
+    # with a price for each column of each row
+    matrix = models.JSONField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -164,33 +169,57 @@ class FareTable(models.Model):
 
     @cached_property
     def is_triangular(self):
-        cols = [col.name for col in self.column_set.all()]
-        rows = [row.name for row in self.row_set.all()]
-        rows.reverse()
+        if not self.matrix:
+            return False
+        cols = self.matrix["columns"]
+        rows = self.matrix["rows"][::-1]
         if len(cols) == len(rows):
             if cols[1:] == rows[:-1]:
                 return True
 
     def columns(self):
-        return self.column_set.all()
+        if not self.matrix:
+            return []
+        return self.matrix["columns"]
 
     def rows(self):
-        cols = {col.id: col for col in self.column_set.all()}
+        if not self.matrix:
+            return []
+
+        count = len(self.matrix["rows"])
+
+        rows = []
+        for i, (name, amounts) in enumerate(
+            zip(self.matrix["rows"], self.matrix["prices"]), 1
+        ):
+            cells = [
+                None if amount is None else Price(amount=Decimal(amount))
+                for amount in amounts
+            ]
+            while cells and cells[-1] is None:
+                cells.pop()
+            # pad the "staircase" of a triangular table
+            cells += [None] * (count - i + 1 - len(cells))
+            rows.append(FareTableRow(name, cells))
 
-        rows = list(self.row_set.all())
-        for row in rows:
-            for cell in row.cell_set.all():
-                cell.column = cols[cell.column_id]
         if self.is_triangular:
-            i = 0
-            for row in rows:
-                i += 1
+            for i, row in enumerate(rows, 1):
                 row.colspan = i
             rows.reverse()
 
         return rows
 
 
+class FareTableRow:
+    def __init__(self, name, cells):
+        self.name = name
+        self.cells = cells
+        self.colspan = None
+
+    def __str__(self):
+        return self.name
+
+
 class FareZone(models.Model):
     code = models.CharField(max_length=255)
     name = models.CharField(max_length=255)
@@ -201,6 +230,42 @@ class FareZone(models.Model):
         return self.name
 
 
+class DistanceMatrixElementManager(models.Manager):
+    def between_stops(self, origin, destination):
+        """Prices between two stops (ATCO codes), in either direction,
+        found via the TariffStop index"""
+        zones = {}
+        for stop_id, tariff_id, fare_zone_id in TariffStop.objects.filter(
+            stop__in=(origin, destination)
+        ).values_list("stop_id", "tariff_id", "fare_zone_id"):
+            if tariff_id not in zones:
+                zones[tariff_id] = {origin: set(), destination: set()}
+            zones[tariff_id][stop_id].add(fare_zone_id)
+
+        q = Q()
+        for tariff_id, tariff_zones in zones.items():
+            origin_zones = tariff_zones[origin]
+            destination_zones = tariff_zones[destination]
+            if origin_zones and destination_zones:
+                q |= Q(
+                    tariff=tariff_id,
+                    start_zone__in=origin_zones,
+                    end_zone__in=destination_zones,
+                ) | Q(
+                    tariff=tariff_id,
+                    start_zone__in=destination_zones,
+                    end_zone__in=origin_zones,
+                )
+        if not q:
+            return self.none()
+
+        return (
+            self.filter(q)
+            .select_related("price", "tariff__user_profile", "start_zone", "end_zone")
+            .order_by("tariff", "start_zone")
+        )
+
+
 class DistanceMatrixElement(models.Model):
     code = models.CharField(max_length=255)
     price = models.ForeignKey(Price, models.CASCADE)
@@ -208,6 +273,11 @@ class DistanceMatrixElement(models.Model):
     end_zone = models.ForeignKey(FareZone, models.CASCADE, related_name="ending")
     tariff = models.ForeignKey(Tariff, models.CASCADE)
 
+    objects = DistanceMatrixElementManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["tariff", "start_zone", "end_zone"])]
+
     def html(self):
         if self.tariff.user_profile:
             tariff = self.tariff.user_profile
@@ -222,43 +292,34 @@ class DistanceMatrixElement(models.Model):
         return self.code
 
 
-class Column(models.Model):
-    table = models.ForeignKey(FareTable, models.CASCADE)
-    code = models.CharField(max_length=255, blank=True)
-    name = models.CharField(max_length=255)
-    order = models.PositiveSmallIntegerField(null=True, blank=True)
+class TariffStopManager(models.Manager):
+    def rebuild(self, source):
+        """Work out which fare zones each stop is in, for each of a DataSet's tariffs
+        (only zones with prices to or from them)"""
+        self.filter(tariff__source=source).delete()
 
-    def __str__(self):
-        return self.name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""INSERT INTO {self.model._meta.db_table} (stop_id, tariff_id, fare_zone_id)
+                SELECT DISTINCT zone_stop.stoppoint_id, element.tariff_id, zone_stop.farezone_id
+                FROM {DistanceMatrixElement._meta.db_table} element
+                INNER JOIN {Tariff._meta.db_table} tariff ON tariff.id = element.tariff_id
+                INNER JOIN {FareZone.stops.through._meta.db_table} zone_stop
+                ON zone_stop.farezone_id IN (element.start_zone_id, element.end_zone_id)
+                WHERE tariff.source_id = %s""",
+                [source.id],
+            )
+            return cursor.rowcount
 
 
-class Row(models.Model):
-    table = models.ForeignKey(FareTable, models.CASCADE)
-    code = models.CharField(max_length=255, blank=True)
-    name = models.CharField(max_length=255)
-    order = models.PositiveSmallIntegerField(null=True, blank=True)
-
-    def cells(self):
-        prev_order = 0
-        for cell in self.cell_set.all():
-            while cell.column.order - prev_order > 1:
-                yield None
-                prev_order += 1
-            yield cell
-            prev_order = cell.column.order
-        while prev_order <= (len(self.table.row_set.all()) - self.order):
-            yield None
-            prev_order += 1
-        # return self.cell_set.all()
+class TariffStop(models.Model):
+    """Index of the fare zones that each stop is in, for each tariff"""
 
-    def __str__(self):
-        return self.name
+    stop = models.ForeignKey("busstops.StopPoint", models.CASCADE, db_index=False)
+    tariff = models.ForeignKey(Tariff, models.CASCADE)
+    fare_zone = models.ForeignKey(FareZone, models.CASCADE)
 
+    objects = TariffStopManager()
 
-class Cell(models.Model):
-    column = models.ForeignKey(Column, models.CASCADE)
-    row = models.ForeignKey(Row, models.CASCADE)
-    distance_matrix_element = models.ForeignKey(
-        DistanceMatrixElement, models.CASCADE, null=True
-    )
-    price = models.ForeignKey(Price, models.CASCADE, null=True)
+    class Meta:
+        unique_together = ("stop", "tariff", "fare_zone")
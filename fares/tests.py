@@ -6,11 +6,19 @@ from django.core.management import call_command
 from django.test import TestCase
 from vcr import use_cassette
 
-from busstops.models import DataSource, Operator, Service
+from busstops.models import DataSource, Operator, Service, StopPoint
 from bustimes.models import Route
 
 from .management.commands.import_netex_fares import Command
-from .models import DataSet, FareZone, Tariff, TimeInterval
+from .models import (
+    DataSet,
+    DistanceMatrixElement,
+    FareZone,
+    Price,
+    Tariff,
+    TariffStop,
+    TimeInterval,
+)
 
 
 class FaresTest(TestCase):
@@ -101,13 +109,89 @@ class FaresTest(TestCase):
         self.assertContains(response, '<th colspan="1">Ancaster</th')
 
         # fare table
-        response = self.client.get(
-            response.context["tariffs"][0].faretable_set.all()[0].get_absolute_url()
-        )
+        url = response.context["tariffs"][0].faretable_set.all()[0].get_absolute_url()
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
         self.assertContains(response, '<th colspan="8">Welbourn</th>')
         self.assertContains(response, '<th colspan="2">Greylees</th>')
         self.assertContains(response, '<th colspan="1">Ancaster</th')
 
+        # fare table without a matrix
+        table = response.context["object"]
+        table.matrix = None
+        table.save(update_fields=["matrix"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotContains(response, "Ancaster")
+
+    def test_local_dataset(self):
+        path = Path(__file__).resolve().parent / "data" / "LYNX Coast.xml"
+
+        with self.assertLogs("fares.management.commands.import_netex_fares"):
+            call_command("import_netex_fares", str(path))
+            tariffs = Tariff.objects.count()
+            call_command("import_netex_fares", str(path))
+
+        dataset = DataSet.objects.get(name="LYNX Coast.xml")
+        self.assertTrue(tariffs)
+        self.assertEqual(dataset.tariff_set.count(), tariffs)
+
+    def test_stop_fares(self):
+        source = DataSet.objects.create(name="Sleaford")
+        tariff = Tariff.objects.create(name="Adult single", source=source)
+        welbourn = FareZone.objects.create(name="Welbourn", source=source)
+        cranwell = FareZone.objects.create(name="Cranwell", source=source)
+        StopPoint.objects.bulk_create(
+            [
+                StopPoint(atco_code="270002700155", active=True),
+                StopPoint(atco_code="270002700156", active=True),
+                StopPoint(atco_code="270002700157", active=True),
+            ]
+        )
+        welbourn.stops.add("270002700155")
+        cranwell.stops.add("270002700156", "270002700157")
+        DistanceMatrixElement.objects.create(
+            start_zone=cranwell,
+            end_zone=welbourn,
+            price=Price.objects.create(amount="1.50"),
+            tariff=tariff,
+        )
+
+        self.assertEqual(TariffStop.objects.rebuild(source), 3)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/fares/stops?origin=270002700155&destination=270002700157"
+            )
+        self.assertEqual(
+            response.json(),
+            {
+                "fares": [
+                    {
+                        "tariff": {
+                            "id": tariff.id,
+                            "name": "Adult single",
+                            "user_profile": None,
+                            "trip_type": "",
+                        },
+                        "start_zone": "Cranwell",
+                        "end_zone": "Welbourn",
+                        "price": "1.50",
+                    }
+                ]
+            },
+        )
+
+        # stop not in any fare zone
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/fares/stops?origin=270002700156&destination=270002700158"
+            )
+        self.assertEqual(response.json(), {"fares": []})
+
+        response = self.client.get("/fares/stops?origin=270002700155")
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
     def test_service_fares_not_found(self):
         response = self.client.get(f"{self.wm06.get_absolute_url()}/fares")
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
@@ -118,24 +202,25 @@ class FaresTest(TestCase):
         command.sales_offer_packages = {}
         command.fare_products = {}
         command.fare_zones = {}
+        command.fare_zone_stops = {}
 
         source = DataSet.objects.create()
 
         base_path = Path(__file__).resolve().parent / "data"
 
         for filename, number in (
-            ("connexions_Harrogate_Coa_16.286Z_IOpbaMX.xml", 42),
-            ("FLDSa0eb4e10_1605250801329.xml", 22),
+            ("connexions_Harrogate_Coa_16.286Z_IOpbaMX.xml", 12),
+            ("FLDSa0eb4e10_1605250801329.xml", 8),
             (
                 "KBUS_FF_ArrivaAdd-on_2Multi_6d7e341a-0680-4397-9b3f-90a290087494_637613495098903655.xml",
-                12,
+                7,
             ),
             (
                 "FECS_23A_Outbound_YPSingle_6764fa3b-4b05-4331-9bea-c7bb90212531_637829447220443476.xml",
-                30,
+                12,
             ),
-            ("LYNX 39 single.xml", 27),
-            ("LYNX Coast.xml", 75),
+            ("LYNX 39 single.xml", 11),
+            ("LYNX Coast.xml", 11),
             ("LYNX Townrider.xml", None),
             (
                 "NADS_103A_Inbound_AdultReturn_aae41d08-15c5-4fef-bf58-e8188410605e_637503825593765582.xml",
@@ -1,11 +1,11 @@
-from django.http import Http404
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.views.generic.detail import DetailView
 
 from busstops.models import Service
 
 from .forms import FaresForm
-from .models import DataSet, FareTable, Tariff
+from .models import DataSet, DistanceMatrixElement, FareTable, Tariff
 
 
 def index(request):
@@ -41,8 +41,6 @@ class DataSetDetailView(DetailView):
 class TariffDetailView(DetailView):
     model = Tariff
     queryset = model.objects.prefetch_related(
-        "faretable_set__row_set__cell_set__price",
-        "faretable_set__column_set",
         "faretable_set__user_profile",
         "faretable_set__sales_offer_package",
         "price_set__time_interval",
@@ -67,10 +65,6 @@ class TariffDetailView(DetailView):
 
 class FareTableDetailView(DetailView):
     model = FareTable
-    queryset = model.objects.prefetch_related(
-        "row_set__cell_set__price",
-        "column_set",
-    )
 
 
 def service_fares(request, slug):
@@ -78,8 +72,6 @@ def service_fares(request, slug):
     tariffs = Tariff.objects.filter(services=service).order_by("name", "valid_between")
 
     tariffs = tariffs.prefetch_related(
-        "faretable_set__row_set__cell_set__price",
-        "faretable_set__column_set",
         "faretable_set__user_profile",
         "faretable_set__sales_offer_package",
         "faretable_set__preassigned_fare_product",
@@ -97,3 +89,32 @@ def service_fares(request, slug):
             "tariffs": tariffs,
         },
     )
+
+
+def stop_fares(request):
+    origin = request.GET.get("origin")
+    destination = request.GET.get("destination")
+    if not origin or not destination:
+        return HttpResponseBadRequest()
+
+    elements = DistanceMatrixElement.objects.between_stops(origin, destination)
+
+    return JsonResponse(
+        {
+            "fares": [
+                {
+                    "tariff": {
+                        "id": element.tariff_id,
+                        "name": element.tariff.name,
+                        "user_profile": element.tariff.user_profile
+                        and str(element.tariff.user_profile),
+                        "trip_type": element.tariff.trip_type,
+                    },
+                    "start_zone": element.start_zone.name,
+                    "end_zone": element.end_zone.name,
+                    "price": element.price.amount,
+                }
+                for element in elements
+            ]
+        }
+    )
@@ -69,6 +69,7 @@ fi
 
 ./manage.py import_gtfs
 
-./manage.py update_search_indexes
+# recompute every vector, to correct any drift (e.g. after renamed stops)
+./manage.py update_search_indexes --full
 
 finish
@@ -96,6 +96,7 @@ class Command(ImportLiveVehiclesCommand):
                 destination_ref=item["stops"][-1]["atcocode"],
             )
             journey.save()
+            self.journeys_to_count.append(journey)
 
         if vehicle.latest_journey != journey:
             vehicle.latest_journey = journey
@@ -0,0 +1,37 @@
+"""Recount journeys for the VehicleJourneyDay table - e.g. to backfill it:
+
+./manage.py rebuild_vehicle_journey_days --since 2020-01-01
+"""
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from ...models import VehicleJourney, VehicleJourneyDay
+
+
+class Command(BaseCommand):
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument(
+            "--since", type=date.fromisoformat, help="default: the first journey"
+        )
+        parser.add_argument("--until", type=date.fromisoformat, help="default: today")
+
+    def handle(self, since, until, **options):
+        if not since:
+            first = VehicleJourney.objects.aggregate(Min("datetime"))["datetime__min"]
+            if not first:
+                return
+            since = timezone.localdate(first)
+        if not until:
+            until = timezone.localdate()
+
+        # most recent first, so the most useful dates are filled in soonest
+        day = until
+        while day >= since:
+            rows = VehicleJourneyDay.objects.rebuild(day)
+            self.stdout.write(f"{day}: {rows}")
+            day -= timedelta(days=1)
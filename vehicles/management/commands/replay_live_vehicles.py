@@ -0,0 +1,224 @@
+"""Record responses from a live vehicle location feed to disk, and replay them later
+through the same import command - to measure the effect of changes to the import
+code without waiting for (or depending on) the real feed.
+
+    ./manage.py replay_live_vehicles record import_bod_avl recordings/bod --cycles 30
+    ./manage.py replay_live_vehicles replay import_bod_avl recordings/bod --speed 10
+
+Works with any ImportLiveVehiclesCommand that fetches its data using `self.session`.
+Replay against a local database and Redis - the vehicles, journeys and locations
+will be saved just like in production.
+"""
+
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+from time import perf_counter, sleep
+
+import requests
+from django.core.management import get_commands, load_command_class
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from requests.structures import CaseInsensitiveDict
+
+from busstops.server_timing import Timings, current_timings
+
+from ..import_live_vehicles import ImportLiveVehiclesCommand
+
+
+class EndOfRecording(BaseException):
+    # not an Exception, so it isn't caught and retried by
+    # ImportLiveVehiclesCommand.get_items or similar
+    pass
+
+
+class RecordingSession(requests.Session):
+    def __init__(self, directory: Path):
+        super().__init__()
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index = (directory / "index.jsonl").open("a")
+        self.count = sum(1 for _ in directory.glob("*.body"))
+
+    def request(self, method, url, *args, **kwargs):
+        fetched_at = datetime.now(timezone.utc)
+        response = super().request(method, url, *args, **kwargs)
+
+        self.count += 1
+        filename = f"{self.count:06}.body"
+        (self.directory / filename).write_bytes(response.content)
+        self.index.write(
+            json.dumps(
+                {
+                    "file": filename,
+                    "url": response.url,
+                    "status": response.status_code,
+                    "headers": dict(response.headers),
+                    "fetched_at": fetched_at.isoformat(),
+                }
+            )
+            + "\n"
+        )
+        self.index.flush()
+        return response
+
+
+class ReplaySession(requests.Session):
+    def __init__(self, directory: Path):
+        super().__init__()
+        self.directory = directory
+        with (directory / "index.jsonl").open() as open_file:
+            self.recordings = [json.loads(line) for line in open_file]
+        self.position = 0
+        self.current = None
+
+    def request(self, method, url, *args, **kwargs):
+        if self.position == len(self.recordings):
+            raise EndOfRecording
+        self.current = self.recordings[self.position]
+        self.position += 1
+
+        response = requests.Response()
+        response.url = self.current["url"]
+        response.status_code = self.current["status"]
+        response.headers = CaseInsensitiveDict(self.current["headers"])
+        response._content = (self.directory / self.current["file"]).read_bytes()
+        return response
+
+
+class ReplayMixin:
+    """Counts the items in each update, and how old each saved location was"""
+
+    def get_items(self):
+        items = super().get_items()
+        self.cycle_items += len(items) if items else 0
+        return items
+
+    def save(self):
+        if self.session.current:
+            fetched_at = datetime.fromisoformat(self.session.current["fetched_at"])
+            self.cycle_ages += [
+                (fetched_at - location.datetime).total_seconds()
+                for location, _ in self.to_save
+                if getattr(location, "datetime", None)
+            ]
+        super().save()
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["record", "replay"])
+        parser.add_argument("command_name", help="e.g. import_bod_avl")
+        parser.add_argument("directory", type=Path)
+        parser.add_argument("--source-name", help="for commands that need one")
+        parser.add_argument(
+            "--cycles", type=int, default=10, help="number of updates to record"
+        )
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=0,
+            help="replay this many times faster than recorded (0: as fast as possible)",
+        )
+
+    def get_import_command(self, command_name, source_name, replay):
+        try:
+            app_name = get_commands()[command_name]
+        except KeyError:
+            raise CommandError(f"unknown command {command_name}")
+        command_class = type(load_command_class(app_name, command_name))
+        if not issubclass(command_class, ImportLiveVehiclesCommand):
+            raise CommandError(f"{command_name} isn't a live vehicles import command")
+        if replay:
+            command_class = type(
+                f"Replay{command_class.__name__}", (ReplayMixin, command_class), {}
+            )
+
+        command = command_class(stdout=self.stdout, stderr=self.stderr)
+        if source_name:
+            command.source_name = source_name
+        command.status_key = "replay_live_vehicles_status"
+        return command
+
+    def handle(self, action, command_name, directory, source_name, **options):
+        if action == "record":
+            self.record(command_name, directory, source_name, options["cycles"])
+        else:
+            self.replay(command_name, directory, source_name, options["speed"])
+
+    def record(self, command_name, directory, source_name, cycles):
+        command = self.get_import_command(command_name, source_name, False)
+        command.session = RecordingSession(directory)
+        command.do_source()
+
+        for i in range(cycles):
+            wait = command.update()
+            self.stdout.write(f"{i + 1}/{cycles}: {command.session.count} responses")
+            if i + 1 < cycles:
+                sleep(wait)
+
+    def replay(self, command_name, directory, source_name, speed):
+        command = self.get_import_command(command_name, source_name, True)
+        command.session = ReplaySession(directory)
+        command.do_source()
+
+        previous_fetched_at = None
+        totals = {"items": 0, "queries": 0, "redis_commands": 0, "time": 0.0}
+        ages = []
+
+        while True:
+            if speed and previous_fetched_at:
+                # wait for the (scaled) interval between the recorded responses
+                upcoming = command.session.recordings[command.session.position :]
+                if upcoming:
+                    fetched_at = datetime.fromisoformat(upcoming[0]["fetched_at"])
+                    sleep(
+                        max((fetched_at - previous_fetched_at).total_seconds(), 0)
+                        / speed
+                    )
+
+            command.cycle_items = 0
+            command.cycle_ages = []
+            timings = Timings()
+            token = current_timings.set(timings)
+            start = perf_counter()
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    command.update()
+            except EndOfRecording:
+                break
+            finally:
+                time_taken = perf_counter() - start
+                current_timings.reset(token)
+
+            if not command.session.current:
+                raise CommandError(f"{command_name} doesn't use self.session")
+            previous_fetched_at = datetime.fromisoformat(
+                command.session.current["fetched_at"]
+            )
+            # how old each location was by the time it was saved
+            cycle_ages = [age + time_taken for age in command.cycle_ages]
+            ages += cycle_ages
+
+            totals["items"] += command.cycle_items
+            totals["queries"] += len(queries)
+            totals["redis_commands"] += timings.redis_commands
+            totals["time"] += time_taken
+
+            self.stdout.write(
+                f"{command.session.position}/{len(command.session.recordings)}:"
+                f" {command.cycle_items} items in {time_taken:.2f}s,"
+                f" {len(queries)} queries, {timings.redis_commands} Redis commands"
+                + (f", median age {median(cycle_ages):.1f}s" if cycle_ages else "")
+            )
+
+        items = totals["items"]
+        self.stdout.write(
+            f"\n{items} items in {totals['time']:.2f}s"
+            f" ({items / totals['time'] if totals['time'] else 0:.0f} items/s),"
+            f" {totals['queries'] / items if items else 0:.2f} queries per item,"
+            f" {totals['redis_commands']} Redis commands"
+            + (f", median age {median(ages):.1f}s" if ages else "")
+        )
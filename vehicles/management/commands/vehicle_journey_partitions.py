@@ -0,0 +1,168 @@
+"""The vehicles_vehiclejourney table is partitioned by month (of the journey's datetime).
+This creates partitions for the next few months, and (with --keep) detaches old ones,
+archives them to gzipped CSV files and drops them.
+
+    ./manage.py vehicle_journey_partitions
+    ./manage.py vehicle_journey_partitions --keep 24 --archive-dir /mnt/archive
+
+Runs every night (without --keep) as the vehicles.tasks.create_vehicle_journey_partitions
+periodic task, so there's always a partition for new journeys to go in.
+"""
+
+import datetime
+import gzip
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ...models import Vehicle, VehicleJourney, VehicleJourneyDay
+
+TABLE = VehicleJourney._meta.db_table
+MONTHS_AHEAD = 3
+
+
+def get_month_start(year, month):
+    while month > 12:
+        year += 1
+        month -= 12
+    while month < 1:
+        year -= 1
+        month += 12
+    return timezone.make_aware(datetime.datetime(year, month, 1))
+
+
+def parse_bound(bound):
+    if bound in ("MINVALUE", "MAXVALUE"):
+        return None
+    return timezone.localtime(datetime.datetime.fromisoformat(bound.strip("'")))
+
+
+def get_partitions():
+    """(name, start, end, estimated rows) for each partition, in order.
+    start is None for the first partition (which has everything before end)"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """SELECT child.relname, pg_get_expr(child.relpartbound, child.oid), child.reltuples
+            FROM pg_inherits
+            INNER JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass""",
+            [TABLE],
+        )
+        results = cursor.fetchall()
+
+    partitions = []
+    for name, bounds, rows in results:
+        # e.g. "FOR VALUES FROM ('2026-11-01 00:00:00+00') TO ('2026-12-01 00:00:00+00')"
+        start, end = re.match(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", bounds).groups()
+        partitions.append((name, parse_bound(start), parse_bound(end), max(rows, 0)))
+    partitions.sort(key=lambda partition: partition[1] or partition[2])
+    return partitions
+
+
+def create_partitions(months_ahead=MONTHS_AHEAD) -> list:
+    """Create any missing partitions for this month and the next few"""
+    now = timezone.localtime()
+    partitions = get_partitions()
+    created = []
+
+    for i in range(months_ahead + 1):
+        start = get_month_start(now.year, now.month + i)
+        if any(
+            (partition_start is None or partition_start <= start)
+            and (partition_end is None or partition_end > start)
+            for _, partition_start, partition_end, _ in partitions
+        ):
+            continue
+        end = get_month_start(now.year, now.month + i + 1)
+        name = f"{TABLE}_{start:%Y_%m}"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""CREATE TABLE {name} PARTITION OF {TABLE}
+                FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"""
+            )
+        created.append(name)
+
+    return created
+
+
+def archive_partition(name, start, end, archive_dir: Path) -> Path:
+    """Copy a partition's rows to a gzipped CSV file, then detach and drop it"""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+
+    # straight from the partition, so it doesn't lock the parent table for ages
+    with (
+        gzip.open(path, "wb") as open_file,
+        connection.cursor() as cursor,
+        cursor.copy(f"COPY {name} TO STDOUT (FORMAT csv, HEADER)") as copy,
+    ):
+        for data in copy:
+            open_file.write(data)
+
+    # no foreign key constraint to do this for us
+    Vehicle.objects.filter(
+        latest_journey__in=VehicleJourney.objects.filter(
+            datetime__lt=end,
+            **({"datetime__gte": start} if start else {}),
+        ).values("id")
+    ).update(latest_journey=None)
+
+    # so the history pages' date pickers don't offer dates with no journeys
+    days = VehicleJourneyDay.objects.filter(date__lt=timezone.localdate(end))
+    if start:
+        days = days.filter(date__gte=timezone.localdate(start))
+    days.delete()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+        cursor.execute(f"DROP TABLE {name}")
+
+    return path
+
+
+class Command(BaseCommand):
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=MONTHS_AHEAD,
+            help="create partitions for this many months after this one",
+        )
+        parser.add_argument(
+            "--keep",
+            type=int,
+            help="keep this many months before this one, and archive and drop older partitions",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            type=Path,
+            help="default: DATA_DIR/vehicle_journeys",
+        )
+
+    def handle(self, months_ahead, keep, archive_dir, **options):
+        for name in create_partitions(months_ahead):
+            self.stdout.write(f"created {name}")
+
+        if keep is not None:
+            now = timezone.localtime()
+            cutoff = get_month_start(now.year, now.month - keep)
+            for name, start, end, _ in get_partitions():
+                if end and end <= cutoff:
+                    path = archive_partition(
+                        name,
+                        start,
+                        end,
+                        archive_dir or settings.DATA_DIR / "vehicle_journeys",
+                    )
+                    self.stdout.write(f"archived {name} to {path}")
+
+        for name, start, end, rows in get_partitions():
+            self.stdout.write(
+                f"{name}: {start and f'{start:%Y-%m-%d}'} to {end and f'{end:%Y-%m-%d}'},"
+                f" ~{rows:.0f} rows"
+            )
@@ -19,8 +19,8 @@ from tenacity import before_sleep_log, retry, wait_exponential
 from busstops.models import DataSource
 from bustimes.models import Route, Trip
 
-from ..models import Vehicle, VehicleJourney
-from ..utils import calculate_bearing, redis_client
+from ..models import Vehicle, VehicleJourney, VehicleJourneyDay
+from ..utils import VEHICLE_LOCATION_EXPIRY, calculate_bearing, redis_client
 
 logger = logging.getLogger(__name__)
 fifteen_minutes = timedelta(minutes=15)
@@ -84,6 +84,8 @@ class ImportLiveVehiclesCommand(BaseCommand):
         self.session = requests.Session()
         self.to_save = []
         self.vehicles_to_update = []
+        self.journeys_to_count = []  # for VehicleJourneyDay
+        self.journeys_to_uncount = []
 
     @staticmethod
     def get_datetime(self):
@@ -172,6 +174,8 @@ class ImportLiveVehiclesCommand(BaseCommand):
             # cos get_journey() might return same object
             original_service_id = latest_journey.service_id
             original_destination = latest_journey.destination
+            original_datetime = latest_journey.datetime
+            original_trip_id = latest_journey.trip_id
 
         if keep_journey:
             journey = latest_journey
@@ -244,6 +248,20 @@ class ImportLiveVehiclesCommand(BaseCommand):
                 latest_journey.save(update_fields=changed)
                 if changed != ["source"]:
                     cache.delete(f"journey{latest_journey.id}")
+                if "service" in changed or (
+                    "datetime" in changed
+                    and timezone.localdate(original_datetime)
+                    != timezone.localdate(latest_journey.datetime)
+                ):
+                    self.journeys_to_uncount.append(
+                        VehicleJourney(
+                            vehicle_id=latest_journey.vehicle_id,
+                            service_id=original_service_id,
+                            datetime=original_datetime,
+                            trip_id=original_trip_id,
+                        )
+                    )
+                    self.journeys_to_count.append(latest_journey)
 
             journey = latest_journey
 
@@ -260,6 +278,8 @@ class ImportLiveVehiclesCommand(BaseCommand):
                     )
                 except VehicleJourney.DoesNotExist:
                     logger.exception(e)
+            else:
+                self.journeys_to_count.append(journey)
 
             if journey.service_id and VehicleJourney.service.is_cached(journey):
                 if not journey.service.tracking:
@@ -295,12 +315,26 @@ class ImportLiveVehiclesCommand(BaseCommand):
                 logger.exception(e)
             self.vehicles_to_update = []
 
+        # update journey counts for the history pages' date pickers
+
+        if self.journeys_to_count:
+            VehicleJourneyDay.objects.add(self.journeys_to_count)
+            self.journeys_to_count = []
+        if self.journeys_to_uncount:
+            VehicleJourneyDay.objects.remove(self.journeys_to_uncount)
+            self.journeys_to_uncount = []
+
         # update locations in Redis
 
         pipeline = redis_client.pipeline(transaction=False)
 
+        # when the vehicles were last seen, for the time-sorted indexes
+        # ("service{id}vehicles:z" etc - named so as not to clash with the plain sets
+        # previously kept at "service{id}vehicles")
+        now = timezone.now().timestamp()
+
         geoadd = []
-        sadd = {}
+        zadd = {}
 
         for location, vehicle in self.to_save:
             if not location.latlong or (
@@ -314,40 +348,41 @@ class ImportLiveVehiclesCommand(BaseCommand):
             geoadd += [location.latlong.x, location.latlong.y, vehicle.id]
 
             if location.journey.service_id:
-                key = f"service{location.journey.service_id}vehicles"
-                if key in sadd:
-                    sadd[key].append(vehicle.id)
+                key = f"service{location.journey.service_id}vehicles:z"
+                if key in zadd:
+                    zadd[key][vehicle.id] = now
                 else:
-                    sadd[key] = [vehicle.id]
+                    zadd[key] = {vehicle.id: now}
             if vehicle.operator_id:
-                key = f"operator{vehicle.operator_id}vehicles"
-                if key in sadd:
-                    sadd[key].append(vehicle.id)
+                key = f"operator{vehicle.operator_id}vehicles:z"
+                if key in zadd:
+                    zadd[key][vehicle.id] = now
                 else:
-                    sadd[key] = [vehicle.id]
+                    zadd[key] = {vehicle.id: now}
             try:
                 if (
                     location.journey.trip
                     and location.journey.trip.operator_id
                     and location.journey.trip.operator_id != vehicle.operator_id
                 ):
-                    key = f"operator{location.journey.trip.operator_id}vehicles"
-                    if key in sadd:
-                        sadd[key].append(vehicle.id)
+                    key = f"operator{location.journey.trip.operator_id}vehicles:z"
+                    if key in zadd:
+                        zadd[key][vehicle.id] = now
                     else:
-                        sadd[key] = [vehicle.id]
+                        zadd[key] = {vehicle.id: now}
             except Trip.DoesNotExist:
                 location.journey.trip = None
 
             redis_json = location.get_redis_json()
             redis_json = json.dumps(redis_json, cls=DjangoJSONEncoder)
-            pipeline.set(f"vehicle{vehicle.id}", redis_json, ex=900)
-            # can't use 'mset' cos it doesn't let us specify an expiry (900 secs = 15 min)
+            pipeline.set(f"vehicle{vehicle.id}", redis_json, ex=VEHICLE_LOCATION_EXPIRY)
+            # can't use 'mset' cos it doesn't let us specify an expiry
 
         if geoadd:
             pipeline.geoadd("vehicle_location_locations", geoadd)
-        for key in sadd:
-            pipeline.sadd(key, *sadd[key])
+            pipeline.zadd("vehicle_location_times", dict.fromkeys(geoadd[2::3], now))
+        for key in zadd:
+            pipeline.zadd(key, zadd[key])
 
         try:
             pipeline.execute()
@@ -428,7 +463,7 @@ class ImportLiveVehiclesCommand(BaseCommand):
 
     def handle(self, immediate=False, *args, **options):
         if self.source_name:
-            self.status_key = f'{self.source_name.replace(" ", "_")}_status'
+            self.status_key = f"{self.source_name.replace(' ', '_')}_status"
             self.status = cache.get(self.status_key, [])
 
         if not immediate:
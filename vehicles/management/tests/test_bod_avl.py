@@ -286,7 +286,7 @@ class BusOpenDataVehicleLocationsTest(TestCase):
                 return_value=items,
             ),
         ):
-            with self.assertNumQueries(43):
+            with self.assertNumQueries(44):
                 wait = command.update()
             self.assertEqual(11, wait)
 
@@ -407,7 +407,7 @@ class BusOpenDataVehicleLocationsTest(TestCase):
             )
             self.assertContains(response, "<p>Great Yarmouth</p>")  # garage
 
-            with self.assertNumQueries(5):
+            with self.assertNumQueries(6):
                 response = self.client.get("/services/u/vehicles?date=2020-06-17")
             self.assertContains(response, "<p>Great Yarmouth</p>")  # garage
 
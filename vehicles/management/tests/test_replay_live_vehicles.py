@@ -0,0 +1,89 @@
+import json
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import fakeredis
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from busstops.models import DataSource, Operator, Region
+
+from ...models import Vehicle
+
+
+@patch(
+    "vehicles.management.import_live_vehicles.redis_client",
+    fakeredis.FakeStrictRedis(),
+)
+class ReplayLiveVehiclesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        DataSource.objects.create(
+            name="Loaches",
+            url="https://example.com/vehicles",
+            settings={"operators": {"YCD": "LCHS"}},
+        )
+        region = Region.objects.create(id="WM")
+        Operator.objects.create(noc="LCHS", name="Loaches’ Coaches", region=region)
+
+    def test_replay(self):
+        with TemporaryDirectory() as directory:
+            directory = Path(directory)
+            with (directory / "index.jsonl").open("w") as index:
+                for i, vehicles in enumerate((["3635"], ["3635", "3636"]), start=1):
+                    features = [
+                        {
+                            "type": "Feature",
+                            "geometry": {
+                                "type": "Point",
+                                "coordinates": [-1.535843, 53.797578],
+                            },
+                            "properties": {
+                                "direction": "outbound",
+                                "line": "POO",
+                                "vehicle": vehicle,
+                            },
+                        }
+                        for vehicle in vehicles
+                    ]
+                    (directory / f"{i:06}.body").write_text(
+                        json.dumps({"features": features})
+                    )
+                    index.write(
+                        json.dumps(
+                            {
+                                "file": f"{i:06}.body",
+                                "url": "https://example.com/vehicles",
+                                "status": 200,
+                                "headers": {"Content-Type": "application/json"},
+                                "fetched_at": f"2018-08-06T22:4{i}:15+01:00",
+                            }
+                        )
+                        + "\n"
+                    )
+
+            stdout = StringIO()
+            with patch("builtins.print"):
+                call_command(
+                    "replay_live_vehicles",
+                    "replay",
+                    "import_polar",
+                    directory,
+                    "--source-name=Loaches",
+                    stdout=stdout,
+                )
+
+        self.assertEqual(Vehicle.objects.count(), 2)
+        stdout = stdout.getvalue()
+        self.assertIn("1/2: 1 items in ", stdout)
+        self.assertIn("2/2: 2 items in ", stdout)
+        self.assertIn("\n3 items in ", stdout)
+
+    def test_not_a_live_vehicles_command(self):
+        with self.assertRaisesMessage(
+            CommandError, "import_noc isn't a live vehicles import command"
+        ):
+            call_command("replay_live_vehicles", "replay", "import_noc", "poo")
@@ -43,7 +43,7 @@ class StagecoachTest(TestCase):
         with vcr.use_cassette(
             str(Path(__file__).resolve().parent / "vcr" / "stagecoach_vehicles.yaml")
         ) as cassette:
-            with self.assertNumQueries(54):
+            with self.assertNumQueries(55):
                 command.update()
 
             cassette.rewind()
@@ -0,0 +1,83 @@
+from datetime import date
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import time_machine
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils.dateparse import parse_datetime
+
+from busstops.models import DataSource, Service
+
+from ...models import Vehicle, VehicleJourney, VehicleJourneyDay
+from ..commands.vehicle_journey_partitions import create_partitions, get_partitions
+
+
+class VehicleJourneyPartitionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        source = DataSource.objects.create(name="Ayrshire")
+        service = Service.objects.create(line_name="11")
+        cls.vehicle = Vehicle.objects.create(code="11")
+        cls.vehicle.latest_journey = VehicleJourney.objects.create(
+            vehicle=cls.vehicle,
+            service=service,
+            datetime=parse_datetime("2020-10-20T12:00:00Z"),
+            source=source,
+        )
+        cls.vehicle.save(update_fields=["latest_journey"])
+        VehicleJourneyDay.objects.rebuild(date(2020, 10, 20))
+
+    def test_create_partitions(self):
+        # the migration already created them
+        self.assertEqual(create_partitions(), [])
+
+        partitions = get_partitions()
+        self.assertIsNone(partitions[0][1])  # everything up to the end of the month
+        self.assertEqual(len(partitions), 4)
+        for previous, partition in zip(partitions, partitions[1:]):
+            self.assertEqual(previous[2], partition[1])
+
+        self.assertEqual(len(create_partitions(5)), 2)
+
+    def test_pruning(self):
+        partitions = get_partitions()
+
+        plan = VehicleJourney.objects.on_date(date(2020, 10, 20)).explain()
+        self.assertIn(partitions[0][0], plan)
+        for name, *_ in partitions[1:]:
+            self.assertNotIn(name, plan)
+
+        journey = VehicleJourney.objects.on_date(date(2020, 10, 20)).get()
+        self.assertEqual(journey, self.vehicle.latest_journey)
+        self.assertFalse(VehicleJourney.objects.on_date(date(2020, 10, 21)))
+
+    def test_archive(self):
+        # let the partitions be detached despite the deferred foreign key checks
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        partitions = get_partitions()
+
+        with TemporaryDirectory() as directory, time_machine.travel("2030-01-01"):
+            stdout = StringIO()
+            call_command(
+                "vehicle_journey_partitions",
+                keep=1,
+                archive_dir=Path(directory),
+                stdout=stdout,
+            )
+
+            path = Path(directory) / f"{partitions[0][0]}.csv.gz"
+            self.assertTrue(path.exists())
+            self.assertIn(f"archived {partitions[0][0]} to {path}", stdout.getvalue())
+
+        self.assertIn("vehicles_vehiclejourney_2030_01", stdout.getvalue())
+        self.assertEqual(get_partitions()[0][0], "vehicles_vehiclejourney_2030_01")
+
+        self.vehicle.refresh_from_db()
+        self.assertIsNone(self.vehicle.latest_journey)
+        self.assertFalse(VehicleJourney.objects.all())
+        self.assertFalse(VehicleJourneyDay.objects.all())
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.5 on 2026-10-19 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busstops', '0001_initial'),
+        ('vehicles', '0011_historicallivery_show_name_livery_show_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleJourneyDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('journeys', models.IntegerField(default=0)),
+                ('trip_matched', models.IntegerField(default=0)),
+                ('first_datetime', models.DateTimeField()),
+                ('last_datetime', models.DateTimeField()),
+                ('service', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='busstops.service')),
+                ('vehicle', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='vehicles.vehicle')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['service', 'date'], name='service_date')],
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'service', 'date'), name='vehicle_service_date', nulls_distinct=False)],
+            },
+        ),
+    ]
@@ -0,0 +1,153 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:05
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+TABLE = 'vehicles_vehiclejourney'
+MONTHS_AHEAD = 3
+
+
+def get_month_start(year, month):
+    while month > 12:
+        year += 1
+        month -= 12
+    return timezone.make_aware(datetime.datetime(year, month, 1))
+
+
+def partition_vehicle_journeys(apps, schema_editor):
+    """Turn the existing table into the first partition (for everything up to the end of
+    this month) of a new table partitioned by month - without copying any rows.
+
+    The slow parts - building a (id, datetime) unique index, and checking every row's
+    datetime - are done first, without blocking reads or writes, so that the part that
+    does (renaming tables and attaching the partition) is quick."""
+
+    execute = schema_editor.execute
+    now = timezone.localtime()
+    bound = get_month_start(now.year, now.month + 1)
+    old_partition = f'{TABLE}_before_{bound:%Y_%m}'
+
+    with schema_editor.connection.cursor() as cursor:
+        # rows on or after the bound would fail the check constraint - find out now,
+        # rather than after the slow index build
+        cursor.execute(f'SELECT MAX(datetime) FROM {TABLE} WHERE datetime >= %s', [bound])
+        latest = cursor.fetchone()[0]
+        if latest:
+            raise ValueError(
+                f'{TABLE} has rows on or after {bound.isoformat()} (up to {latest.isoformat()}) '
+                f'which would not fit in {old_partition} - move or delete them first'
+            )
+
+        # an interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind
+        cursor.execute("""
+            SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)
+        """, [f'{TABLE}_id_datetime'])
+        row = cursor.fetchone()
+    if row and row[0]:
+        execute(f'DROP INDEX CONCURRENTLY {TABLE}_id_datetime')
+
+    # not in a transaction (the migration isn't atomic), so these don't block anything.
+    # A previous, failed attempt may have got some of the way, maybe in an earlier
+    # month (with an earlier bound), so this can be run again
+    execute(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {TABLE}_id_datetime ON {TABLE} (id, datetime)')
+    execute(f'ALTER TABLE {TABLE} DROP CONSTRAINT IF EXISTS {TABLE}_before_bound')
+    execute(
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_before_bound '
+        f"CHECK (datetime < '{bound.isoformat()}') NOT VALID"
+    )
+    execute(f'ALTER TABLE {TABLE} VALIDATE CONSTRAINT {TABLE}_before_bound')
+
+    with transaction.atomic(using=schema_editor.connection.alias):
+        with schema_editor.connection.cursor() as cursor:
+            # every index (and unique and foreign key constraint) except the primary key,
+            # to be recreated on the new table - and then matched up with the old ones
+            cursor.execute("""
+                SELECT index_class.relname, pg_get_indexdef(index_class.oid), constraint_.conname IS NOT NULL
+                FROM pg_index
+                INNER JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+                LEFT JOIN pg_constraint constraint_ ON constraint_.conindid = pg_index.indexrelid
+                WHERE pg_index.indrelid = %s::regclass AND NOT pg_index.indisprimary
+                AND index_class.relname != %s
+            """, [TABLE, f'{TABLE}_id_datetime'])
+            indexes = cursor.fetchall()
+            cursor.execute("""
+                SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype IN ('u', 'f')
+            """, [TABLE])
+            constraints = cursor.fetchall()
+
+            cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {TABLE}')
+            max_id = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'
+            """, [TABLE])
+            identity = cursor.fetchone()[0]
+
+        # one sequence for all the partitions
+        if identity:
+            execute(f'ALTER TABLE {TABLE} ALTER COLUMN id DROP IDENTITY')
+        else:
+            execute(f'ALTER TABLE {TABLE} ALTER COLUMN id DROP DEFAULT')
+            execute(f'DROP SEQUENCE IF EXISTS {TABLE}_id_seq')
+        execute(f'CREATE SEQUENCE {TABLE}_id_seq AS integer')
+        execute(f"SELECT setval('{TABLE}_id_seq', {max_id + 1}, false)")
+
+        # swap the primary key for the new index
+        execute(f'ALTER TABLE {TABLE} DROP CONSTRAINT {TABLE}_pkey')
+        execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey_old PRIMARY KEY USING INDEX {TABLE}_id_datetime')
+
+        execute(f'ALTER TABLE {TABLE} RENAME TO {old_partition}')
+        for name, _, is_constraint in indexes:
+            new_name = f'{name[:59]}_old'
+            if is_constraint:
+                execute(f'ALTER TABLE {old_partition} RENAME CONSTRAINT {name} TO {new_name}')
+            else:
+                execute(f'ALTER INDEX {name} RENAME TO {new_name}')
+
+        execute(f'CREATE TABLE {TABLE} (LIKE {old_partition} INCLUDING DEFAULTS) PARTITION BY RANGE (datetime)')
+        execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+        execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+        execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, datetime)')
+        for name, definition in constraints:
+            execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+        for name, definition, is_constraint in indexes:
+            if not is_constraint:
+                execute(definition)  # "CREATE INDEX name ON public.vehicles_vehiclejourney ..."
+
+        # existing indexes and constraints that match the new table's are reused, and
+        # the check constraint means the rows' datetimes needn't be checked again
+        execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {old_partition} FOR VALUES FROM (MINVALUE) TO ('{bound.isoformat()}')")
+        execute(f'ALTER TABLE {old_partition} DROP CONSTRAINT {TABLE}_before_bound')
+
+        for i in range(1, MONTHS_AHEAD + 1):
+            start = get_month_start(now.year, now.month + i)
+            end = get_month_start(now.year, now.month + i + 1)
+            execute(
+                f"CREATE TABLE {TABLE}_{start:%Y_%m} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+
+
+class Migration(migrations.Migration):
+    # for CREATE INDEX CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('vehicles', '0012_vehiclejourneyday'),
+    ]
+
+    operations = [
+        # a foreign key has to refer to a unique column (or columns), and a
+        # partitioned table's unique constraints must include the partition key
+        migrations.AlterField(
+            model_name='vehicle',
+            name='latest_journey',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='latest_vehicle', to='vehicles.vehiclejourney'),
+        ),
+        # irreversible - a partitioned table can't simply be turned back into a normal one
+        migrations.RunPython(partition_vehicle_journeys),
+    ]
@@ -10,7 +10,8 @@ from urllib.parse import quote
 from autoslug import AutoSlugField
 from django.conf import settings
 from django.contrib.gis.db import models
-from django.db.models import Q, UniqueConstraint
+from django.db import connection, transaction
+from django.db.models import F, Q, UniqueConstraint
 from django.db.models.functions import TruncDate, Upper
 from django.urls import reverse
 from django.utils import timezone
@@ -261,6 +262,7 @@ class Vehicle(models.Model):
         null=True,
         blank=True,
         related_name="latest_vehicle",
+        db_constraint=False,  # VehicleJourney is partitioned, so id alone isn't unique
     )
     latest_journey_data = models.JSONField(null=True, blank=True)
     features = models.ManyToManyField(VehicleFeature, blank=True)
@@ -642,7 +644,30 @@ class VehicleRevision(models.Model):
             yield f"vehicle {vehicle.id} reverted {fields}"
 
 
+def get_day_bounds(date):
+    """The start and end of a (local) day, as aware datetimes"""
+    return (
+        timezone.make_aware(datetime.datetime.combine(date, datetime.time())),
+        timezone.make_aware(
+            datetime.datetime.combine(
+                date + datetime.timedelta(days=1), datetime.time()
+            )
+        ),
+    )
+
+
+class VehicleJourneyQuerySet(models.QuerySet):
+    def on_date(self, date):
+        # the datetime range lets Postgres skip the other months' partitions,
+        # and the date lookup lets it use the (vehicle|service)_datetime_date indexes
+        start, end = get_day_bounds(date)
+        return self.filter(datetime__date=date, datetime__gte=start, datetime__lt=end)
+
+
 class VehicleJourney(models.Model):
+    """The vehicles_vehiclejourney table is partitioned by month of datetime
+    (see the vehicle_journey_partitions command)"""
+
     datetime = models.DateTimeField()
     service = models.ForeignKey(Service, models.SET_NULL, null=True, blank=True)
     route_name = models.CharField(max_length=64, blank=True)
@@ -656,6 +681,8 @@ class VehicleJourney(models.Model):
     # block = models.ForeignKey("bustimes.Block", models.SET_NULL, null=True, blank=True)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
 
+    objects = VehicleJourneyQuerySet.as_manager()
+
     def get_absolute_url(self):
         return f"/vehicles/{self.vehicle_id}?date={self.datetime.date()}#journeys/{self.id}"
 
@@ -690,6 +717,120 @@ class VehicleJourney(models.Model):
         return f"{url}?date={date}"
 
 
+class VehicleJourneyDayManager(models.Manager):
+    def add(self, journeys):
+        """Count some new journeys, in one query"""
+        days = {}
+        for journey in journeys:
+            key = (
+                journey.vehicle_id,
+                journey.service_id,
+                timezone.localdate(journey.datetime),
+            )
+            if key in days:
+                day = days[key]
+                day[0] += 1
+                day[1] += journey.trip_id is not None
+                day[2] = min(day[2], journey.datetime)
+                day[3] = max(day[3], journey.datetime)
+            else:
+                days[key] = [
+                    1,
+                    int(journey.trip_id is not None),
+                    journey.datetime,
+                    journey.datetime,
+                ]
+        if not days:
+            return
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""INSERT INTO {table}
+                    (vehicle_id, service_id, date, journeys, trip_matched, first_datetime, last_datetime)
+                VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(days))}
+                ON CONFLICT (vehicle_id, service_id, date) DO UPDATE SET
+                    journeys = {table}.journeys + EXCLUDED.journeys,
+                    trip_matched = {table}.trip_matched + EXCLUDED.trip_matched,
+                    first_datetime = LEAST({table}.first_datetime, EXCLUDED.first_datetime),
+                    last_datetime = GREATEST({table}.last_datetime, EXCLUDED.last_datetime)""",
+                [value for key, day in days.items() for value in (*key, *day)],
+            )
+
+    def remove(self, journeys):
+        """Uncount some journeys - e.g. the old version of a journey whose service has changed.
+        (first_datetime and last_datetime are left alone until the day is rebuilt)"""
+        for journey in journeys:
+            self.filter(
+                vehicle=journey.vehicle_id,
+                service=journey.service_id,
+                date=timezone.localdate(journey.datetime),
+            ).update(
+                journeys=F("journeys") - 1,
+                trip_matched=F("trip_matched") - int(journey.trip_id is not None),
+            )
+
+    def rebuild(self, date):
+        """Recount a day's journeys from scratch
+        (to catch any changes that weren't counted, or backfill old days)"""
+        start, end = get_day_bounds(date)
+        table = self.model._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.filter(date=date).delete()
+            cursor.execute(
+                f"""INSERT INTO {table}
+                    (vehicle_id, service_id, date, journeys, trip_matched, first_datetime, last_datetime)
+                SELECT vehicle_id, service_id, %s, COUNT(*), COUNT(trip_id), MIN(datetime), MAX(datetime)
+                FROM {VehicleJourney._meta.db_table}
+                WHERE datetime >= %s AND datetime < %s
+                GROUP BY vehicle_id, service_id
+                ON CONFLICT (vehicle_id, service_id, date) DO UPDATE SET
+                    journeys = EXCLUDED.journeys,
+                    trip_matched = EXCLUDED.trip_matched,
+                    first_datetime = EXCLUDED.first_datetime,
+                    last_datetime = EXCLUDED.last_datetime""",
+                [date, start, end],
+            )
+            return cursor.rowcount
+
+
+class VehicleJourneyDay(models.Model):
+    """How many journeys each vehicle made on each service on each (local) date -
+    for the date pickers on vehicle and service journey history pages, without
+    querying the huge VehicleJourney table.
+    Kept up to date by the live vehicle importers and log_vehicle_journey,
+    and each day rebuilt from scratch the next night"""
+
+    vehicle = models.ForeignKey(
+        Vehicle, models.CASCADE, null=True, blank=True, db_index=False
+    )
+    service = models.ForeignKey(
+        Service, models.CASCADE, null=True, blank=True, db_index=False
+    )
+    date = models.DateField()
+    journeys = models.IntegerField(default=0)
+    trip_matched = models.IntegerField(default=0)
+    first_datetime = models.DateTimeField()
+    last_datetime = models.DateTimeField()
+
+    objects = VehicleJourneyDayManager()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["vehicle", "service", "date"],
+                nulls_distinct=False,
+                name="vehicle_service_date",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["service", "date"], name="service_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.vehicle_id} {self.service_id} {self.journeys}"
+
+
 # class VehiclePosition:
 #     journey = models.ForeignKey(VehicleJourney, on_delete)
 
@@ -7,12 +7,19 @@ from django.db import IntegrityError
 from django.db.models import Count, Q
 from django.utils import timezone
 from huey import crontab
-from huey.contrib.djhuey import db_periodic_task, db_task
+from huey.contrib.djhuey import db_periodic_task, db_task, periodic_task
 
 from busstops.models import DataSource, Operator
 
-from .management.commands import import_bod_avl
-from .models import SiriSubscription, Vehicle, VehicleJourney, VehicleRevision
+from .management.commands import import_bod_avl, vehicle_journey_partitions
+from .models import (
+    SiriSubscription,
+    Vehicle,
+    VehicleJourney,
+    VehicleJourneyDay,
+    VehicleRevision,
+)
+from .utils import redis_client, sweep_vehicle_indexes
 
 
 @functools.cache
@@ -177,6 +184,8 @@ def log_vehicle_journey(service, data, time, destination, source_name, url, trip
     except IntegrityError:
         return
 
+    VehicleJourneyDay.objects.add([journey])
+
     if not vehicle.latest_journey or vehicle.latest_journey.datetime < journey.datetime:
         vehicle.latest_journey = journey
         vehicle.latest_journey_data = data
@@ -208,6 +217,24 @@ def stats():
     cache.set("vehicle-tracking-stats", history, None)
 
 
+@db_periodic_task(crontab(hour=2, minute=45))
+def rebuild_vehicle_journey_days():
+    # yesterday's counts were kept up to date as journeys were created,
+    # but not when they were later deleted or changed in other ways
+    VehicleJourneyDay.objects.rebuild(timezone.localdate() - timedelta(days=1))
+
+
+@db_periodic_task(crontab(hour=2, minute=50))
+def create_vehicle_journey_partitions():
+    vehicle_journey_partitions.create_partitions()
+
+
+@periodic_task(crontab(minute="*/5"))
+def sweep_live_vehicle_indexes():
+    if redis_client:
+        sweep_vehicle_indexes(redis_client)
+
+
 @db_periodic_task(crontab(minute=4, hour=10))
 def timetable_source_stats():
     now = timezone.now()
@@ -1,7 +1,12 @@
+from datetime import date
+
+from ciso8601 import parse_datetime
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 
-from .models import Livery, Vehicle
+from busstops.models import DataSource, Service
+
+from .models import Livery, Vehicle, VehicleJourney, VehicleJourneyDay
 
 
 class VehicleModelTests(TestCase):
@@ -120,3 +125,60 @@ class VehicleModelTests(TestCase):
                 ]
             },
         )
+
+
+class VehicleJourneyDayTests(TestCase):
+    def test_add_remove_rebuild(self):
+        source = DataSource.objects.create(name="Kinky Bingo")
+        service = Service.objects.create(line_name="44")
+        vehicle = Vehicle.objects.create(code="44")
+
+        journeys = [
+            VehicleJourney.objects.create(
+                vehicle=vehicle,
+                service=service,
+                datetime=parse_datetime(when),
+                source=source,
+            )
+            for when in (
+                "2024-07-01T23:30:00Z",  # 2 July in British Summer Time
+                "2024-07-02T09:00:00Z",
+                "2024-07-02T18:00:00Z",
+            )
+        ]
+        with self.assertNumQueries(1):
+            VehicleJourneyDay.objects.add(journeys[:2])
+        VehicleJourneyDay.objects.add(journeys[2:])
+
+        day = VehicleJourneyDay.objects.get()
+        self.assertEqual(day.date, date(2024, 7, 2))
+        self.assertEqual(day.journeys, 3)
+        self.assertEqual(day.trip_matched, 0)
+        self.assertEqual(day.first_datetime, journeys[0].datetime)
+        self.assertEqual(day.last_datetime, journeys[2].datetime)
+
+        # service changed
+        journeys[2].service = None
+        journeys[2].save(update_fields=["service"])
+        VehicleJourneyDay.objects.remove(
+            [
+                VehicleJourney(
+                    vehicle=vehicle, service=service, datetime=journeys[2].datetime
+                )
+            ]
+        )
+        VehicleJourneyDay.objects.add(journeys[2:])
+        self.assertEqual(
+            list(
+                VehicleJourneyDay.objects.order_by("journeys").values_list(
+                    "service", "journeys"
+                )
+            ),
+            [(None, 1), (service.id, 2)],
+        )
+
+        journeys[0].delete()
+        self.assertEqual(VehicleJourneyDay.objects.rebuild(date(2024, 7, 2)), 2)
+        day = VehicleJourneyDay.objects.get(service=service)
+        self.assertEqual(day.journeys, 1)
+        self.assertEqual(day.first_datetime, journeys[1].datetime)
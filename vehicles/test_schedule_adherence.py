@@ -3,6 +3,7 @@ from unittest.mock import patch
 
 import fakeredis
 import time_machine
+from ciso8601 import parse_datetime
 from django.test import TestCase
 
 from busstops.models import DataSource, Service, StopPoint, StopUsage
@@ -268,7 +269,11 @@ class ScheduleAdherenceTest(TestCase):
         redis_client = fakeredis.FakeStrictRedis()
 
         with patch("departures.avl.redis_client", redis_client):
-            redis_client.sadd(f"service{self.service.id}vehicles", 1)
+            # last seen "later", so still tracked when travelling to 10:50 below
+            redis_client.zadd(
+                f"service{self.service.id}vehicles:z",
+                {1: parse_datetime("2024-02-16T10:50:00Z").timestamp()},
+            )
             redis_client.set(
                 "vehicle1",
                 json.dumps(
@@ -0,0 +1,71 @@
+import struct
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .time_aware_polyline import (
+    decode_time_aware_polyline,
+    decode_time_aware_polyline_array,
+    encode_locations,
+    encode_time_aware_polyline,
+    encode_time_aware_polyline_array,
+    extend_time_aware_polyline,
+)
+
+
+class TimeAwarePolylineTest(SimpleTestCase):
+    def test_array_codec(self):
+        gpx_logs = [
+            [-1.29643, 52.62269, 1606568305],
+            [-1.29501, 52.62301, 1606568335],
+            [-1.30012, 52.61998, 1606568335],
+            [1.67589, 52.3284, 1606576026],
+        ]
+        polyline = encode_time_aware_polyline(gpx_logs)
+
+        self.assertEqual(encode_time_aware_polyline_array(gpx_logs), polyline)
+        self.assertEqual(
+            encode_time_aware_polyline_array(gpx_logs[1:], gpx_logs[0]),
+            extend_time_aware_polyline("", gpx_logs[1:], gpx_logs[0]),
+        )
+        self.assertEqual(encode_time_aware_polyline_array([]), "")
+
+        self.assertEqual(
+            decode_time_aware_polyline_array(polyline).tolist(),
+            decode_time_aware_polyline(polyline),
+        )
+        self.assertEqual(decode_time_aware_polyline_array("").shape, (0, 3))
+
+    def test_encode_locations(self):
+        locations = [
+            struct.pack(
+                "I 2f ?h ?h", 1606568305, -1.296443, 52.62269, True, 90, False, 0
+            ),
+            struct.pack("I 2f ?h ?h", 1606568335, -1.295, 52.623, False, 0, True, -2),
+        ]
+        unpacked = [struct.unpack("I 2f ?h ?h", location) for location in locations]
+
+        self.assertEqual(
+            encode_locations(locations),
+            encode_time_aware_polyline(
+                [[x, y, time] for time, x, y, _, _, _, _ in unpacked]
+            ),
+        )
+        self.assertEqual(encode_locations([]), "")
+
+    def test_long_journey(self):
+        rng = np.random.default_rng(0)
+        lats = 52.5 + np.cumsum(rng.normal(0, 0.001, 5000))
+        lngs = -1.5 + np.cumsum(rng.normal(0, 0.001, 5000))
+        times = 1606568305 + np.cumsum(rng.integers(0, 60, 5000))
+        gpx_logs = [
+            [lat, lng, time]
+            for lat, lng, time in zip(lats.tolist(), lngs.tolist(), times.tolist())
+        ]
+        polyline = encode_time_aware_polyline(gpx_logs)
+
+        self.assertEqual(encode_time_aware_polyline_array(gpx_logs), polyline)
+        self.assertEqual(
+            decode_time_aware_polyline_array(polyline).tolist(),
+            decode_time_aware_polyline(polyline),
+        )
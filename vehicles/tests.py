@@ -1,3 +1,5 @@
+import json
+from datetime import date
 from http import HTTPStatus
 from unittest.mock import patch
 
@@ -6,7 +8,8 @@ import time_machine
 from ciso8601 import parse_datetime
 from django.contrib.gis.geos import Point
 from django.contrib.auth.models import Permission
-from django.test import TestCase, override_settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
 
 from accounts.models import User
 from busstops.models import DataSource, Operator, Region, Service
@@ -16,11 +19,15 @@ from .models import (
     Vehicle,
     VehicleFeature,
     VehicleJourney,
+    VehicleJourneyDay,
     VehicleLocation,
     VehicleRevision,
     VehicleRevisionFeature,
     VehicleType,
 )
+from . import views
+from .time_aware_polyline import encode_time_aware_polyline
+from .utils import get_recent_vehicle_ids, sweep_vehicle_indexes
 
 
 @patch(
@@ -125,6 +132,9 @@ class VehiclesTests(TestCase):
         cls.vehicle_1.latest_journey = cls.journey
         cls.vehicle_1.save()
 
+        VehicleJourneyDay.objects.rebuild(date(2020, 10, 16))
+        VehicleJourneyDay.objects.rebuild(date(2020, 10, 20))
+
         cls.vehicle_1.features.set([cls.wifi])
 
         cls.staff_user = User.objects.create(
@@ -310,6 +320,44 @@ class VehiclesTests(TestCase):
         location.wheelchair_capacity = 1
         self.assertEqual(location.get_redis_json()["wheelchair"], "free")
 
+    def test_journeys_json(self):
+        location = VehicleLocation(latlong=Point(1.3, 52.6))
+        location.journey = self.journey
+        location.datetime = parse_datetime(self.datetime)
+        location.heading = None
+        location.delay = None
+        views.redis_client.rpush(*location.get_appendage())
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f"/vehicles/{self.vehicle_1.id}/journeys.json?date=2020-10-20"
+            )
+            journeys = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(journeys), 2)
+        self.assertEqual(journeys[0]["id"], self.journey.id)
+        self.assertEqual(journeys[0]["datetime"], "2020-10-19T23:47:00Z")
+        self.assertEqual(
+            journeys[0]["time_aware_polyline"],
+            encode_time_aware_polyline([[1.3, 52.6, 1603151220]]),
+        )
+        self.assertEqual(journeys[1]["time_aware_polyline"], "")
+
+        # completed day - cached
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                f"/vehicles/{self.vehicle_1.id}/journeys.json?date=2020-10-20"
+            )
+        self.assertEqual(response.json(), journeys)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f"/services/{self.journey.service_id}/journeys.json?date=2020-10-21"
+            )
+            self.assertEqual(b"".join(response.streaming_content), b"[]")
+
+        response = self.client.get(f"/vehicles/{self.vehicle_1.id}/journeys.json")
+        self.assertEqual(response.status_code, 400)
+
     def test_vehicle_json(self):
         vehicle = Vehicle.objects.get(id=self.vehicle_2.id)
         vehicle.feature_names = "foo, bar"
@@ -935,7 +983,7 @@ https://www.flickr.com/photos/goodwinjoshua/51046126023/ blah""",
             response = self.client.get(
                 "/services/spixworth-hunworth-happisburgh/vehicles?date=poop"
             )
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(6):
             response = self.client.get(
                 "/services/spixworth-hunworth-happisburgh/vehicles?date=2020-10-20"
             )
@@ -943,11 +991,26 @@ https://www.flickr.com/photos/goodwinjoshua/51046126023/ blah""",
         self.assertContains(response, "/vehicles/")
         self.assertContains(
             response,
-            '<input type="date" name="date" aria-label="Date" value="2020-10-20">',
-            # '<option selected value="2020-10-20">Tuesday 20 October 2020</option>'
+            '<option selected value="2020-10-20">Tuesday 20 October 2020</option>',
+        )
+        self.assertContains(
+            response, '<option value="2020-10-16">Friday 16 October 2020</option>'
         )
         self.assertContains(response, "1 - FD54 JYA")
 
+    def test_vehicle_history_without_days(self):
+        # before rebuild_vehicle_journey_days has been run
+        VehicleJourneyDay.objects.all().delete()
+
+        response = self.client.get(f"/vehicles/{self.vehicle_1.id}?date=2020-10-20")
+        self.assertContains(
+            response,
+            '<option selected value="2020-10-20">Tuesday 20 October 2020</option>',
+        )
+        self.assertContains(
+            response, '<option value="2020-10-16">Friday 16 October 2020</option>'
+        )
+
     def test_api(self):
         with self.assertNumQueries(2):
             response = self.client.get("/api/vehicles/?limit=2")
@@ -1040,3 +1103,41 @@ https://www.flickr.com/photos/goodwinjoshua/51046126023/ blah""",
         with self.assertNumQueries(2):
             response = self.client.get("/api/vehicles/?search=fd54jya")
         self.assertEqual(1, response.json()["count"])
+
+
+class VehicleIndexesTests(SimpleTestCase):
+    def test_sweep_vehicle_indexes(self):
+        redis_client = fakeredis.FakeStrictRedis(version=7)
+
+        with time_machine.travel("2020-10-20 12:00Z"):
+            redis_client.geoadd("vehicle_location_locations", [1.3, 52.6, 1])
+            redis_client.zadd("vehicle_location_times", {1: timezone.now().timestamp()})
+            redis_client.zadd("service2vehicles:z", {1: timezone.now().timestamp()})
+
+        with time_machine.travel("2020-10-20 12:10Z"):
+            redis_client.geoadd("vehicle_location_locations", [1.2, 52.5, 3])
+            redis_client.zadd("vehicle_location_times", {3: timezone.now().timestamp()})
+            redis_client.zadd("service2vehicles:z", {3: timezone.now().timestamp()})
+
+        with time_machine.travel("2020-10-20 12:14Z"):
+            self.assertEqual(
+                get_recent_vehicle_ids(redis_client, ["service2vehicles:z"]), {1, 3}
+            )
+            sweep_vehicle_indexes(redis_client)
+            self.assertEqual(redis_client.zcard("service2vehicles:z"), 2)
+
+        with time_machine.travel("2020-10-20 12:16Z"):
+            # vehicle 1 hasn't been seen for more than 15 minutes
+            self.assertEqual(
+                get_recent_vehicle_ids(
+                    redis_client, ["service2vehicles:z", "service4vehicles:z"]
+                ),
+                {3},
+            )
+            sweep_vehicle_indexes(redis_client)
+
+        self.assertEqual(redis_client.zrange("service2vehicles:z", 0, -1), [b"3"])
+        self.assertEqual(redis_client.zrange("vehicle_location_times", 0, -1), [b"3"])
+        self.assertEqual(
+            redis_client.zrange("vehicle_location_locations", 0, -1), [b"3"]
+        )
@@ -43,6 +43,8 @@ urlpatterns = [
         views.journey_json,
         name="service_journey",
     ),
+    path("vehicles/<int:vehicle_id>/journeys.json", views.journeys_json),
+    path("services/<int:service_id>/journeys.json", views.journeys_json),
     path("liveries.<int:version>.css", views.liveries_css),
     path("rules", TemplateView.as_view(template_name="rules.html")),
     path("map", TemplateView.as_view(template_name="map.html"), name="map"),
@@ -2,6 +2,7 @@ import math
 
 from django.core.cache import caches
 from django.core.cache.backends.base import InvalidCacheBackendError
+from django.utils import timezone
 
 from .models import VehicleRevision, VehicleRevisionFeature
 
@@ -10,6 +11,40 @@ try:
 except InvalidCacheBackendError:
     redis_client = None
 
+# how long a vehicle's location is kept - the "vehicle{id}" key expires after this long,
+# and the live map indexes (sorted sets scored by when each vehicle was last seen)
+# are only read and swept as far back as this
+VEHICLE_LOCATION_EXPIRY = 900  # seconds
+
+
+def get_recent_vehicle_ids(redis_client, keys):
+    """ids of vehicles recently seen in any of the given time-sorted sets"""
+    min_score = timezone.now().timestamp() - VEHICLE_LOCATION_EXPIRY
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.zrangebyscore(key, min_score, "+inf")
+    return {
+        int(vehicle_id)
+        for vehicle_ids in pipeline.execute()
+        for vehicle_id in vehicle_ids
+    }
+
+
+def sweep_vehicle_indexes(redis_client):
+    """Remove vehicles that haven't been seen recently from the live map indexes"""
+    max_score = timezone.now().timestamp() - VEHICLE_LOCATION_EXPIRY
+
+    expired = redis_client.zrangebyscore("vehicle_location_times", "-inf", max_score)
+
+    pipeline = redis_client.pipeline(transaction=False)
+    if expired:
+        pipeline.zrem("vehicle_location_locations", *expired)
+    pipeline.zremrangebyscore("vehicle_location_times", "-inf", max_score)
+    for pattern in ("service*vehicles:z", "operator*vehicles:z"):
+        for key in redis_client.scan_iter(match=pattern, count=1000):
+            pipeline.zremrangebyscore(key, "-inf", max_score)
+    pipeline.execute()
+
 
 def calculate_bearing(a, b):
     a_lat = math.radians(a.y)
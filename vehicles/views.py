@@ -15,14 +15,25 @@ from django.contrib.postgres.aggregates import StringAgg
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import IntegrityError, OperationalError, connection, transaction
 from django.db.models import Case, F, Max, OuterRef, Q, When
 from django.db.models.functions import Coalesce, Now
-from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.cache import get_conditional_response, set_response_etag
+from django.utils.cache import (
+    get_conditional_response,
+    patch_response_headers,
+    set_response_etag,
+)
 from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_safe
@@ -45,13 +56,21 @@ from .models import (
     SiriSubscription,
     Vehicle,
     VehicleJourney,
+    VehicleJourneyDay,
     VehicleLocation,
     VehicleRevision,
     VehicleRevisionFeature,
 )
 from .rtpi import add_progress_and_delay
+from .time_aware_polyline import encode_locations
 from .tasks import handle_siri_post
-from .utils import apply_revision, get_revision, redis_client  # calculate_bearing,
+from .utils import (  # calculate_bearing,
+    VEHICLE_LOCATION_EXPIRY,
+    apply_revision,
+    get_recent_vehicle_ids,
+    get_revision,
+    redis_client,
+)
 
 
 class Vehicles:
@@ -303,7 +322,7 @@ def operator_debug(request, slug):
 
     pipe = redis_client.pipeline(transaction=False)
     for service in services:
-        pipe.exists(f"service{service.id}vehicles")
+        pipe.exists(f"service{service.id}vehicles:z")
     tracking = pipe.execute()
 
     for service, service_tracking in zip(services, tracking):
@@ -376,6 +395,17 @@ def vehicles_json(request) -> JsonResponse:
             width=str(width),
             height=str(height),
         )
+        if vehicle_ids:
+            # only those seen recently
+            min_score = timezone.now().timestamp() - VEHICLE_LOCATION_EXPIRY
+            vehicle_ids = [
+                vehicle_id
+                for vehicle_id, score in zip(
+                    vehicle_ids,
+                    redis_client.zmscore("vehicle_location_times", vehicle_ids),
+                )
+                if score and score >= min_score
+            ]
 
     elif "service" in request.GET:
         try:
@@ -384,19 +414,19 @@ def vehicles_json(request) -> JsonResponse:
             ]
         except ValueError:
             return HttpResponseBadRequest()
-        set_names = [f"service{service_id}vehicles" for service_id in service_ids]
+        set_names = [f"service{service_id}vehicles:z" for service_id in service_ids]
     elif "operator" in request.GET:
         operator_ids = request.GET["operator"].split(",")
-        set_names = [f"operator{operator_id}vehicles" for operator_id in operator_ids]
+        set_names = [f"operator{operator_id}vehicles:z" for operator_id in operator_ids]
     elif "id" in request.GET:
         # specified vehicle ids
         vehicle_ids = request.GET["id"].split(",")
     else:
         # ids of all vehicles
-        vehicle_ids = redis_client.zrange("vehicle_location_locations", 0, -1)
+        set_names = ["vehicle_location_times"]
 
     if set_names:
-        vehicle_ids = list(redis_client.sunion(set_names))
+        vehicle_ids = get_recent_vehicle_ids(redis_client, set_names)
 
     vehicle_ids = [int(vehicle_id) for vehicle_id in vehicle_ids]
 
@@ -409,16 +439,6 @@ def vehicles_json(request) -> JsonResponse:
         json.loads(item) if item else item for item in vehicle_locations
     ]
 
-    # remove expired items from 'vehicle_location_locations'
-    to_remove = [
-        vehicle_id
-        for vehicle_id, item in zip(vehicle_ids, vehicle_locations)
-        if not item
-    ]
-
-    if to_remove:
-        redis_client.zrem("vehicle_location_locations", *to_remove)
-
     journeys = cache.get_many(
         [f"journey{item['journey_id']}" for item in vehicle_locations if item]
     )
@@ -473,15 +493,8 @@ def vehicles_json(request) -> JsonResponse:
             ):
                 add_progress_and_delay(item)
 
-        if (
-            service_ids
-            and (not item or item.get("service_id") not in service_ids)
-            or operator_ids
-            and not item
-        ):
-            for set_name in set_names:
-                redis_client.srem(set_name, vehicle_id)
-        elif item:
+        # (a vehicle stays in a service's index for a while after moving to another service)
+        if item and not (service_ids and item.get("service_id") not in service_ids):
             locations.append(item)
 
     if journeys_to_cache_later:
@@ -495,39 +508,35 @@ def vehicles_json(request) -> JsonResponse:
 
 
 def get_dates(vehicle=None, service=None):
-    if not vehicle:
-        # the database query for a service is too slow
-        return
+    if vehicle:
+        days = VehicleJourneyDay.objects.filter(vehicle=vehicle)
+    else:
+        days = VehicleJourneyDay.objects.filter(service=service)
 
-    key = f"vehicle:{vehicle.id}:dates"
-    journeys = vehicle.vehiclejourney_set
+    try:
+        dates = list(
+            days.filter(journeys__gt=0)
+            .order_by("date")
+            .values_list("date", flat=True)
+            .distinct()
+        )
+        if vehicle and not dates:
+            # the vehicle's days haven't been counted yet
+            # (until rebuild_vehicle_journey_days has backfilled them)
+            dates = list(vehicle.vehiclejourney_set.dates("datetime", "day"))
+    except OperationalError:
+        return
 
-    dates = cache.get(key)
+    if not vehicle:
+        # (if the service's days haven't been counted yet, journeys_list will find
+        # the latest date with journeys)
+        return dates or None
 
-    if dates and vehicle.latest_journey:
+    if vehicle.latest_journey:
+        # in case the days haven't been counted yet
         latest_date = timezone.localdate(vehicle.latest_journey.datetime)
-        if dates[-1] < latest_date:
+        if not dates or dates[-1] < latest_date:
             dates.append(latest_date)
-            # we'll update the cache below
-        else:
-            return dates
-
-    if not dates:
-        try:
-            dates = list(journeys.dates("datetime", "day"))
-        except OperationalError:
-            return
-
-    if dates:
-        now = timezone.localtime()
-        time_to_midnight = datetime.timedelta(days=1) - datetime.timedelta(
-            hours=now.hour, minutes=now.minute, seconds=now.second
-        )
-        if dates[-1] == now.date():  # today
-            time_to_midnight += datetime.timedelta(days=1)
-        time_to_midnight = time_to_midnight.total_seconds()
-        if time_to_midnight > 0:
-            cache.set(key, dates, time_to_midnight)
 
     return dates
 
@@ -559,16 +568,11 @@ def journeys_list(request, journeys, service=None, vehicle=None) -> dict:
     if date:
         context["date"] = date
 
-        journeys = (
-            journeys.filter(datetime__date=date).select_related("trip").order_by("id")
-        )
+        journeys = journeys.on_date(date).select_related("trip").order_by("id")
 
-        if dates:
-            if date not in dates:
-                dates.append(date)
-                dates.sort()
-            elif not journeys:
-                cache.delete(f"vehicle:{vehicle.id}:dates")
+        if dates and date not in dates:
+            dates.append(date)
+            dates.sort()
 
         context["journeys"] = journeys
 
@@ -1110,6 +1114,88 @@ def journey_json(request, pk, vehicle_id=None, service_id=None):
     return JsonResponse(data)
 
 
+MAX_JOURNEYS = 500  # per journeys_json response
+
+
+@require_safe
+def journeys_json(request, vehicle_id=None, service_id=None):
+    """Location histories of all of a vehicle's or service's journeys on a date,
+    as time aware polylines"""
+
+    form = forms.DateForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest()
+    date = form.cleaned_data["date"]
+
+    if vehicle_id:
+        cache_key = f"vehicle:{vehicle_id}:journeys:{date}"
+    else:
+        cache_key = f"service:{service_id}:journeys:{date}"
+
+    # a completed day's history won't change
+    completed = date < timezone.localdate()
+    if completed and (content := cache.get(cache_key)) is not None:
+        response = HttpResponse(content, content_type="application/json")
+        patch_response_headers(response, 86400)
+        return response
+
+    journeys = VehicleJourney.objects.on_date(date)
+    if vehicle_id:
+        journeys = journeys.filter(vehicle=vehicle_id)
+    else:
+        journeys = journeys.filter(service=service_id)
+    journeys = journeys.only(
+        "uuid",
+        "vehicle",
+        "service",
+        "trip",
+        "datetime",
+        "route_name",
+        "destination",
+    ).order_by("datetime", "id")[:MAX_JOURNEYS]
+
+    if redis_client and journeys:
+        # all the journeys' histories in one round trip
+        pipeline = redis_client.pipeline(transaction=False)
+        for journey in journeys:
+            pipeline.lrange(journey.get_redis_key(), 0, -1)
+        try:
+            histories = pipeline.execute()
+        except ConnectionError:
+            histories = [[]] * len(journeys)
+    else:
+        histories = [[]] * len(journeys)
+
+    def generate():
+        parts = []
+        for i, (journey, history) in enumerate(zip(journeys, histories)):
+            part = json.dumps(
+                {
+                    "id": journey.id,
+                    "vehicle_id": journey.vehicle_id,
+                    "service_id": journey.service_id,
+                    "trip_id": journey.trip_id,
+                    "datetime": journey.datetime,
+                    "route_name": journey.route_name,
+                    "destination": journey.destination,
+                    "time_aware_polyline": encode_locations(history),
+                },
+                cls=DjangoJSONEncoder,
+            )
+            parts.append(part)
+            yield f"[{part}" if i == 0 else f",{part}"
+        if not parts:
+            yield "["
+        yield "]"
+
+        if completed:
+            cache.set(cache_key, f"[{','.join(parts)}]", 86400)
+
+    response = StreamingHttpResponse(generate(), content_type="application/json")
+    patch_response_headers(response, 86400 if completed else 60)
+    return response
+
+
 @require_safe
 def latest_journey_debug(request, **kwargs):
     vehicle = get_object_or_404(Vehicle, **kwargs)